@@ -0,0 +1,88 @@
+"""
+Startup-time benchmark: time to import each entry point in a fresh interpreter, which is what the CLI, a shard worker
+or a WSGI worker pays before doing anything.
+
+    python benchmark_startup.py                # median of 5 runs for each entry point
+    python benchmark_startup.py --top 10       # also show the slowest imports (python -X importtime)
+    python benchmark_startup.py --budget 2     # exit with an error if an entry point takes longer (seconds)
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# Entry point: code run by a fresh interpreter (run_path does not run the __main__ blocks)
+TARGETS = {
+    "get_from_wikipedia": "import get_from_wikipedia",
+    "main.py": "import runpy; runpy.run_path('main.py')",
+    "main.wsgi": "import runpy; runpy.run_path('main.wsgi')",
+}
+
+
+def time_import(code):
+    """
+    :return: seconds to start an interpreter and run code
+    """
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-c", code], cwd=ROOT, check=True, stdout=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+
+def slowest_imports(code, top):
+    """
+    :return: [(cumulative seconds, module)] of the top slowest imports, from python -X importtime
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=ROOT,
+        check=True,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True,
+    )
+    imports = []
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, module = line[len("import time:") :].split("|")
+        imports.append((int(cumulative) / 1e6, module.strip()))
+
+    # Parents include the time of their own imports, so they come first
+    return sorted(imports, reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the import time of the entry points.")
+    parser.add_argument("targets", nargs="*", default=list(TARGETS), help=f"among {', '.join(TARGETS)} (default: all)")
+    parser.add_argument("-n", "--runs", type=int, default=5, help="runs per entry point")
+    parser.add_argument("--top", type=int, default=0, help="show the N slowest imports of each entry point")
+    parser.add_argument("--budget", type=float, help="maximum median startup time, in seconds")
+    args = parser.parse_args()
+
+    over_budget = []
+    for target in args.targets:
+        code = TARGETS[target]
+        time_import(code)  # Warm up the filesystem and bytecode caches
+        times = [time_import(code) for _ in range(args.runs)]
+        median = statistics.median(times)
+        print(f"{target}: {median:.3f}s (min {min(times):.3f}s, max {max(times):.3f}s)")
+
+        for seconds, module in slowest_imports(code, args.top) if args.top else []:
+            print(f"    {seconds:.3f}s {module}")
+
+        if args.budget is not None and median > args.budget:
+            over_budget.append(target)
+
+    if over_budget:
+        print(f"Over the budget of {args.budget}s: {', '.join(over_budget)}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
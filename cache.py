@@ -0,0 +1,404 @@
+"""
+Persistent local caches, in SQLite databases under CACHE_DIR (set WIKISTATS_CACHE_DIR to move them).
+"""
+from contextlib import closing, contextmanager
+import datetime
+import json
+import os
+import sqlite3
+import time
+import zlib
+
+
+from metrics import record_cache
+
+
+CACHE_DIR = os.environ.get("WIKISTATS_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "wikistats"))
+
+TITLES_TTL = 30 * 24 * 3600  # Seconds; titles are rarely renamed
+MISSING_TITLES_TTL = 24 * 3600  # Pages that do not exist may be created
+LANGLINKS_TTL = 7 * 24 * 3600  # Pages get new translations more often than they are renamed
+STAGES_TTL = 3600  # Results of the stages are only shared between runs close in time
+LEASE_SECONDS = 300  # After that, a page being fetched by a worker that died can be fetched by another one
+PAGEVIEWS_SETTLE_DAYS = 2  # The pageviews of the last days may not be complete yet
+
+
+@contextmanager
+def open_db(name, schema, cache_dir=None):
+    """
+    Connection to one of the cache databases, created with schema if needed.
+    Each call opens its own connection, so that it can be used from any thread or process.
+
+    :param cache_dir: directory of the databases, CACHE_DIR by default
+    """
+    cache_dir = cache_dir or CACHE_DIR
+    os.makedirs(cache_dir, exist_ok=True)
+    with closing(sqlite3.connect(os.path.join(cache_dir, f"{name}.sqlite3"), timeout=30)) as db:
+        db.execute("PRAGMA journal_mode=WAL")
+        db.executescript(schema)
+        with db:  # Commit on success
+            yield db
+
+
+class TitleIndex:
+    """
+    Maps (lang, input title) to (canonical title, page id, wikibase item), after normalization and redirects, and
+    (lang, page id) to the langlinks of the page, so that known titles do not have to be resolved again.
+    Entries expire, so that renamed pages and new translations are eventually picked up.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS titles (
+            lang TEXT NOT NULL,
+            title TEXT NOT NULL,
+            canonical TEXT,
+            pageid INTEGER,
+            wikibase_item TEXT,
+            expires REAL NOT NULL,
+            PRIMARY KEY (lang, title)
+        );
+        CREATE TABLE IF NOT EXISTS langlinks (
+            lang TEXT NOT NULL,
+            pageid INTEGER NOT NULL,
+            langlinks TEXT NOT NULL,
+            expires REAL NOT NULL,
+            PRIMARY KEY (lang, pageid)
+        );
+    """
+
+    def __init__(self, name="titles", cache_dir=None):
+        self.name = name
+        self.cache_dir = cache_dir
+
+    def get_many(self, lang, titles):
+        """
+        :return: {input title: (canonical title, page id, wikibase item)} for the known, non-expired titles.
+        A page id of None means that the page does not exist.
+        """
+        titles = list(titles)
+        found = {}
+        with open_db(self.name, self.SCHEMA, self.cache_dir) as db:
+            for i in range(0, len(titles), 500):  # SQLite limits the number of parameters
+                batch = titles[i : i + 500]
+                rows = db.execute(
+                    f"SELECT title, canonical, pageid, wikibase_item FROM titles "
+                    f"WHERE lang = ? AND expires > ? AND title IN ({','.join('?' * len(batch))})",
+                    [lang, time.time()] + batch,
+                )
+                for title, canonical, pageid, wikibase_item in rows:
+                    found[title] = (canonical, pageid, wikibase_item)
+
+        for title in titles:
+            record_cache("titles", title in found)
+
+        return found
+
+    def put_many(self, lang, entries):
+        """
+        :param entries: {input title: (canonical title, page id, wikibase item)}
+        """
+        now = time.time()
+        with open_db(self.name, self.SCHEMA, self.cache_dir) as db:
+            db.executemany(
+                "INSERT OR REPLACE INTO titles VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (
+                        lang,
+                        title,
+                        canonical,
+                        pageid,
+                        wikibase_item,
+                        now + (TITLES_TTL if pageid else MISSING_TITLES_TTL),
+                    )
+                    for title, (canonical, pageid, wikibase_item) in entries.items()
+                ],
+            )
+
+    def get_langlinks(self, lang, pageids):
+        """
+        :return: {page id: {lang: title}} for the pages whose langlinks are known and not expired
+        """
+        pageids = list(pageids)
+        found = {}
+        with open_db(self.name, self.SCHEMA, self.cache_dir) as db:
+            for i in range(0, len(pageids), 500):
+                batch = pageids[i : i + 500]
+                rows = db.execute(
+                    f"SELECT pageid, langlinks FROM langlinks "
+                    f"WHERE lang = ? AND expires > ? AND pageid IN ({','.join('?' * len(batch))})",
+                    [lang, time.time()] + batch,
+                )
+                for pageid, langlinks in rows:
+                    found[pageid] = json.loads(langlinks)
+
+        for pageid in pageids:
+            record_cache("langlinks", pageid in found)
+
+        return found
+
+    def put_langlinks(self, lang, entries):
+        """
+        :param entries: {page id: {lang: title}}, all the langlinks of each page
+        """
+        expires = time.time() + LANGLINKS_TTL
+        with open_db(self.name, self.SCHEMA, self.cache_dir) as db:
+            db.executemany(
+                "INSERT OR REPLACE INTO langlinks VALUES (?, ?, ?, ?)",
+                [(lang, pageid, json.dumps(langlinks), expires) for pageid, langlinks in entries.items()],
+            )
+
+    def purge(self):
+        """
+        Remove the expired entries.
+        """
+        with open_db(self.name, self.SCHEMA, self.cache_dir) as db:
+            db.execute("DELETE FROM titles WHERE expires <= ?", [time.time()])
+            db.execute("DELETE FROM langlinks WHERE expires <= ?", [time.time()])
+
+
+class ReadabilityCache:
+    """
+    Stats and readability of an article, keyed by (lang, page id, revision id): as long as the page is not edited,
+    neither its extract nor its scores have to be computed again. The extract can be stored too, compressed.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS readability (
+            lang TEXT NOT NULL,
+            pageid INTEGER NOT NULL,
+            revid INTEGER NOT NULL,
+            stats TEXT NOT NULL,
+            readability TEXT NOT NULL,
+            extract BLOB,
+            PRIMARY KEY (lang, pageid)
+        );
+    """
+
+    def __init__(self, name="readability", store_extracts=False, cache_dir=None):
+        self.name = name
+        self.store_extracts = store_extracts
+        self.cache_dir = cache_dir
+
+    def get(self, lang, pageid, revid):
+        """
+        :return: (stats, readability, extract or None), or None if the page changed since (or was never seen)
+        """
+        with open_db(self.name, self.SCHEMA, self.cache_dir) as db:
+            row = db.execute(
+                "SELECT stats, readability, extract FROM readability WHERE lang = ? AND pageid = ? AND revid = ?",
+                [lang, pageid, revid],
+            ).fetchone()
+
+        record_cache("readability", row is not None)
+        if row is None:
+            return None
+
+        stats, readability, extract = row
+        return json.loads(stats), json.loads(readability), zlib.decompress(extract).decode() if extract else None
+
+    def put(self, lang, pageid, revid, stats, readability, extract=None):
+        # Only the latest revision of a page is kept
+        with open_db(self.name, self.SCHEMA, self.cache_dir) as db:
+            db.execute(
+                "INSERT OR REPLACE INTO readability VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    lang,
+                    pageid,
+                    revid,
+                    json.dumps(stats),
+                    json.dumps(readability),
+                    zlib.compress(extract.encode()) if extract and self.store_extracts else None,
+                ],
+            )
+
+
+class StageCache:
+    """
+    Results of the stages, per page, shared by all the processes using the same cache directory (such as the workers
+    of a deployment), with leases so that identical in-flight fetches are coalesced: the first run to need a page
+    fetches it, the others wait for its result (single flight).
+    Keys are opaque strings (see WikipediaClient), values anything JSON-able.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS results (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL,
+            expires REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS leases (
+            key TEXT PRIMARY KEY,
+            owner TEXT NOT NULL,
+            expires REAL NOT NULL
+        );
+    """
+
+    def __init__(self, name="stages", ttl=STAGES_TTL, lease_seconds=LEASE_SECONDS, cache_dir=None):
+        self.name = name
+        self.ttl = ttl
+        self.lease_seconds = lease_seconds
+        self.cache_dir = cache_dir
+
+    def _select(self, db, query, keys, *params):
+        keys = list(keys)
+        for i in range(0, len(keys), 500):  # SQLite limits the number of parameters
+            batch = keys[i : i + 500]
+            yield from db.execute(query.format(keys=",".join("?" * len(batch))), list(params) + batch)
+
+    def get_many(self, keys):
+        """
+        :return: {key: value} for the keys with a non-expired result
+        """
+        keys = list(keys)
+        with open_db(self.name, self.SCHEMA, self.cache_dir) as db:
+            rows = self._select(
+                db, "SELECT key, value FROM results WHERE expires > ? AND key IN ({keys})", keys, time.time()
+            )
+            found = {key: json.loads(value) for key, value in rows}
+
+        for key in keys:
+            record_cache("stages", key in found)
+
+        return found
+
+    def put_many(self, items):
+        """
+        :param items: {key: value}
+        """
+        with open_db(self.name, self.SCHEMA, self.cache_dir) as db:
+            db.executemany(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?)",
+                [(key, json.dumps(value), time.time() + self.ttl) for key, value in items.items()],
+            )
+
+    def acquire_many(self, keys, owner):
+        """
+        Take the lease of the keys that nobody is fetching.
+
+        :return: set of the keys now leased by owner
+        """
+        keys = list(keys)
+        now = time.time()
+        with open_db(self.name, self.SCHEMA, self.cache_dir) as db:
+            db.execute("DELETE FROM leases WHERE expires <= ?", [now])
+            db.executemany(
+                "INSERT OR IGNORE INTO leases VALUES (?, ?, ?)",
+                [(key, owner, now + self.lease_seconds) for key in keys],
+            )
+            rows = self._select(db, "SELECT key FROM leases WHERE owner = ? AND key IN ({keys})", keys, owner)
+            return {key for key, in rows}
+
+    def release_many(self, keys, owner):
+        with open_db(self.name, self.SCHEMA, self.cache_dir) as db:
+            list(self._select(db, "DELETE FROM leases WHERE owner = ? AND key IN ({keys})", keys, owner))
+
+    def purge(self):
+        """
+        Remove the expired results and leases.
+        """
+        now = time.time()
+        with open_db(self.name, self.SCHEMA, self.cache_dir) as db:
+            db.execute("DELETE FROM results WHERE expires <= ?", [now])
+            db.execute("DELETE FROM leases WHERE expires <= ?", [now])
+
+
+class PageviewStore:
+    """
+    Daily pageviews of the pages, kept across runs (append-only) and keyed by (lang, page id, date), so that the runs
+    only request the days they do not have yet, and histories longer than a run can be read back.
+    The date ranges already fetched are kept apart from the views, as the API leaves out the days without views.
+    Dates are ISO strings (YYYY-MM-DD).
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS pageviews (
+            lang TEXT NOT NULL,
+            pageid INTEGER NOT NULL,
+            access TEXT NOT NULL,
+            agent TEXT NOT NULL,
+            date TEXT NOT NULL,
+            views INTEGER NOT NULL,
+            PRIMARY KEY (lang, pageid, access, agent, date)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS fetched (
+            lang TEXT NOT NULL,
+            pageid INTEGER NOT NULL,
+            access TEXT NOT NULL,
+            agent TEXT NOT NULL,
+            start TEXT NOT NULL,
+            end TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS fetched_page ON fetched (lang, pageid, access, agent);
+    """
+
+    def __init__(self, name="pageviews", cache_dir=None):
+        self.name = name
+        self.cache_dir = cache_dir
+
+    def missing(self, lang, pageid, access, agent, start, end):
+        """
+        :return: [(start, end)] of the date ranges of [start, end] that were never fetched, in order
+        """
+        with open_db(self.name, self.SCHEMA, self.cache_dir) as db:
+            ranges = db.execute(
+                "SELECT start, end FROM fetched WHERE lang = ? AND pageid = ? AND access = ? AND agent = ? "
+                "AND end >= ? AND start <= ? ORDER BY start",
+                [lang, pageid, access, agent, start, end],
+            ).fetchall()
+
+        gaps = []
+        cursor = datetime.date.fromisoformat(start)
+        for fetched_start, fetched_end in ranges:
+            fetched_start = datetime.date.fromisoformat(fetched_start)
+            fetched_end = datetime.date.fromisoformat(fetched_end)
+            if fetched_start > cursor:
+                gaps.append((cursor.isoformat(), (fetched_start - datetime.timedelta(days=1)).isoformat()))
+            cursor = max(cursor, fetched_end + datetime.timedelta(days=1))
+        if cursor <= datetime.date.fromisoformat(end):
+            gaps.append((cursor.isoformat(), end))
+
+        record_cache("pageviews", not gaps)
+        return gaps
+
+    def put(self, lang, pageid, access, agent, views, start, end):
+        """
+        :param views: {date: views} fetched for [start, end]
+        :param start: first date of the range fetched
+        :param end: last date of the range fetched, after which the data may still be incomplete (see
+        PAGEVIEWS_SETTLE_DAYS): the following days are not marked as fetched, and are asked again next time
+        """
+        settled = (datetime.date.today() - datetime.timedelta(days=PAGEVIEWS_SETTLE_DAYS)).isoformat()
+        end = min(end, settled)
+        with open_db(self.name, self.SCHEMA, self.cache_dir) as db:
+            db.executemany(
+                "INSERT OR REPLACE INTO pageviews VALUES (?, ?, ?, ?, ?, ?)",
+                [(lang, pageid, access, agent, date, count) for date, count in views.items()],
+            )
+            if start > end:
+                return
+
+            # Merge with the overlapping or adjacent ranges, so that a page keeps a few ranges at most
+            key = [lang, pageid, access, agent]
+            before = (datetime.date.fromisoformat(start) - datetime.timedelta(days=1)).isoformat()
+            after = (datetime.date.fromisoformat(end) + datetime.timedelta(days=1)).isoformat()
+            where = "lang = ? AND pageid = ? AND access = ? AND agent = ? AND end >= ? AND start <= ?"
+            merged = db.execute(
+                f"SELECT MIN(start), MAX(end) FROM fetched WHERE {where}", key + [before, after]
+            ).fetchone()
+            db.execute(f"DELETE FROM fetched WHERE {where}", key + [before, after])
+            db.execute(
+                "INSERT INTO fetched VALUES (?, ?, ?, ?, ?, ?)",
+                key + [min(start, merged[0] or start), max(end, merged[1] or end)],
+            )
+
+    def get(self, lang, pageid, access, agent, start=None, end=None):
+        """
+        :return: {date: views} of the stored days between start and end (included), all of them by default
+        """
+        with open_db(self.name, self.SCHEMA, self.cache_dir) as db:
+            rows = db.execute(
+                "SELECT date, views FROM pageviews WHERE lang = ? AND pageid = ? AND access = ? AND agent = ? "
+                "AND date BETWEEN ? AND ? ORDER BY date",
+                [lang, pageid, access, agent, start or "0000-00-00", end or "9999-99-99"],
+            )
+            return dict(rows)
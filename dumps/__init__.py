@@ -0,0 +1,4 @@
+"""
+Offline ingestion from the Wikimedia dumps (https://dumps.wikimedia.org/), as an alternative to the API for big runs.
+Every parser streams its input, so that memory does not depend on the size of the dump.
+"""
@@ -0,0 +1,152 @@
+"""
+Revisions from the stub-meta-history XML dumps (https://dumps.wikimedia.org/, "<lang>wiki-<date>-stub-meta-history"),
+instead of paging through the revisions and contributors APIs 500 at a time.
+
+The XML is parsed incrementally, and every element is cleared once read, so that memory only depends on the revisions
+kept for the tracked pages, not on the size of the dump.
+"""
+from xml.etree.ElementTree import iterparse
+import bz2
+import datetime
+import gzip
+import os
+import re
+
+
+from metrics import registry, timed_stage
+
+
+_FILE_LANG = re.compile(r"^([a-z_]+?)wiki-")
+
+
+def open_xml(path):
+    if path.endswith(".gz"):
+        return gzip.open(path, "rb")
+    if path.endswith(".bz2"):
+        return bz2.open(path, "rb")
+    return open(path, "rb")
+
+
+def dump_lang(path):
+    """
+    Language of a dump, from its name (enwiki-20231001-stub-meta-history.xml.gz is "en").
+    """
+    match = _FILE_LANG.match(os.path.basename(path))
+    if match is None:
+        raise ValueError(f"not a Wikipedia dump file name: {path}")
+    return match.group(1).replace("_", "-")
+
+
+def _local(tag):
+    # "{http://www.mediawiki.org/xml/export-0.10/}page" -> "page"
+    return tag.rsplit("}", 1)[-1]
+
+
+def parse_history(path, page_ids):
+    """
+    Stream the revisions of the tracked pages of a dump.
+
+    :param page_ids: set of the page ids to keep
+    :return: generator of (page id, revision, anonymous), revisions being dicts with revid, parentid, timestamp,
+    username, size (username is the IP address for anonymous edits, None if it was deleted), in the order of the dump
+    """
+    with open_xml(path) as f:
+        context = iterparse(f, events=("start", "end"))
+        _, root = next(context)
+
+        page, page_id = None, None
+        tracked = False
+        anonymous = False
+        in_revision = False
+        in_contributor = False
+        revision = {}
+        for event, elem in context:
+            tag = _local(elem.tag)
+
+            if event == "start":
+                if tag == "page":
+                    page, page_id, tracked = elem, None, False
+                elif tag == "revision":
+                    in_revision, anonymous = True, False
+                    revision = {"parentid": 0, "username": None, "size": 0}
+                elif tag == "contributor":
+                    in_contributor = True
+                continue
+
+            if tag == "id" and not in_revision and page_id is None:
+                page_id = int(elem.text)
+                tracked = page_id in page_ids
+            elif in_revision and tracked:
+                if tag == "id" and not in_contributor:
+                    revision["revid"] = int(elem.text)
+                elif tag == "parentid":
+                    revision["parentid"] = int(elem.text)
+                elif tag == "timestamp":
+                    revision["timestamp"] = elem.text
+                elif tag in ("username", "ip"):
+                    revision["username"] = elem.text
+                    anonymous = tag == "ip"
+                elif tag == "text":
+                    revision["size"] = int(elem.get("bytes", 0))
+
+            if tag == "contributor":
+                in_contributor = False
+            elif tag == "revision":
+                in_revision = False
+                if tracked:
+                    yield page_id, revision, anonymous
+                page.clear()  # Drop the revisions we already went through, the page can have a lot of them
+            elif tag == "page":
+                root.clear()
+
+
+@timed_stage
+def fetch_history_from_dumps(queries, paths, target_contributors=None):
+    """
+    Same as fetch_contributions, fetch_contributors, and the creation part of fetch_pageprops_revisions, from local
+    stub-meta-history dumps. Pages need their "pid" (from fetch_pageprops_revisions).
+    Contributors are the named users, as with the API (no IP addresses).
+    """
+    paths_by_lang = {}
+    for path in paths:
+        paths_by_lang.setdefault(dump_lang(path), []).append(path)
+
+    for lang, lang_paths in paths_by_lang.items():
+        pages = {
+            page["pid"]: (obj, page)
+            for obj in queries.values()
+            if "error" not in obj
+            for page_lang, page in obj["langs"].items()
+            if page_lang == lang and "pid" in page
+        }
+        if not pages:
+            continue
+
+        for obj, page in pages.values():
+            page["contributions"] = {"items": []}
+            page["contributors"] = set()
+
+        for path in sorted(lang_paths):  # History dumps can be split in several files
+            with registry.timer("wikistats_dump_seconds", kind="history"):
+                for page_id, revision, anonymous in parse_history(path, set(pages)):
+                    obj, page = pages[page_id]
+
+                    if "creation" not in page or revision["timestamp"] < page["creation"]["timestamp"]:
+                        page["creation"] = {"timestamp": revision["timestamp"], "user": revision["username"]}
+
+                    end = datetime.datetime.fromisoformat(obj["query"]["timestamp"])
+                    start = end - datetime.timedelta(days=obj["query"]["duration"])
+                    timestamp = datetime.datetime.fromisoformat(revision["timestamp"].replace("Z", ""))
+                    if start <= timestamp <= end:
+                        page["contributions"]["items"].append(revision)
+
+                    username = revision["username"]
+                    if username and not anonymous and (not target_contributors or username in target_contributors):
+                        page["contributors"].add(username)
+
+        for obj, page in pages.values():
+            # Newest first, as with the API
+            page["contributions"]["items"].sort(key=lambda revision: revision["timestamp"], reverse=True)
+            page["contributors"] = list(page["contributors"])  # Sets are not valid JSON objects, lists are
+
+    return queries
@@ -0,0 +1,163 @@
+"""
+Pageviews from the pageview dump files (https://dumps.wikimedia.org/other/pageviews/ and
+https://dumps.wikimedia.org/other/pageview_complete/), instead of one API call per article and language.
+
+Two formats are understood, compressed (gzip, bz2) or not:
+- hourly "pageviews-YYYYMMDD-HH0000": domain_code page_title count_views total_response_size
+  where domain_code is "en" (desktop) or "en.m" (mobile) for the Wikipedias;
+- daily "pageviews-YYYYMMDD-user": wiki_code page_title page_id access_type daily_total hourly_counts
+  where wiki_code is "en.wikipedia".
+"""
+from collections import defaultdict
+import bz2
+import datetime
+import gzip
+import os
+import re
+
+
+from metrics import registry, timed_stage
+
+
+_FILE_DATE = re.compile(r"pageviews-(\d{8})-(?:(\d{2})\d{4}|user|automated|spider)")
+
+
+def open_dump(path):
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf8", errors="replace")
+    if path.endswith(".bz2"):
+        return bz2.open(path, "rt", encoding="utf8", errors="replace")
+    return open(path, encoding="utf8", errors="replace")
+
+
+def dump_timestamp(path):
+    """
+    Hour (or day) covered by a dump file, from its name.
+    """
+    match = _FILE_DATE.search(os.path.basename(path))
+    if match is None:
+        raise ValueError(f"not a pageview dump file name: {path}")
+    day, hour = match.groups()
+    return datetime.datetime.strptime(f"{day}{hour or '00'}", "%Y%m%d%H")
+
+
+def bucket_of(timestamp, granularity):
+    """
+    Start of the period of the given granularity containing timestamp, as in the API results.
+    """
+    if granularity == "hourly":
+        return timestamp.replace(minute=0, second=0, microsecond=0)
+    if granularity == "daily":
+        return timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+    if granularity == "monthly":
+        return timestamp.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    raise ValueError(f"unknown granularity: {granularity}")
+
+
+def lang_of(project):
+    """
+    Language of a Wikipedia project code ("en", "en.m", "en.wikipedia"), or None for other projects.
+    """
+    if project.endswith(".wikipedia"):
+        return project[: -len(".wikipedia")]
+    if "." not in project:
+        return project
+    if project.endswith(".m"):
+        return project[:-2]
+    return None
+
+
+def parse_dump(path, tracked):
+    """
+    Stream a dump file, keeping only the tracked pages.
+
+    :param tracked: set of (lang, title with underscores)
+    :return: generator of ((lang, title), views)
+    """
+    with open_dump(path) as f:
+        for line in f:
+            fields = line.split(" ")
+            if len(fields) < 4:
+                continue
+
+            lang = lang_of(fields[0])
+            key = (lang, fields[1])
+            if lang is None or key not in tracked:
+                continue
+
+            # Hourly dumps have the views third, daily dumps fifth
+            views = fields[4] if len(fields) >= 6 else fields[2]
+            try:
+                yield key, int(views)
+            except ValueError:
+                continue
+
+
+def aggregate_dumps(paths, tracked, granularity="daily", start=None, end=None):
+    """
+    Sum the views of the tracked pages per period. Memory is proportional to the number of tracked pages and periods,
+    not to the size of the dumps.
+
+    :param start: ignore the dumps before that datetime (optional)
+    :param end: ignore the dumps after that datetime (optional)
+    :return: ({(lang, title): {bucket: views}}, set of all the buckets covered by the dumps)
+    """
+    views = defaultdict(lambda: defaultdict(int))
+    buckets = set()
+    for path in sorted(paths):
+        timestamp = dump_timestamp(path)
+        if (start is not None and timestamp < start) or (end is not None and timestamp > end):
+            continue
+
+        bucket = bucket_of(timestamp, granularity)
+        buckets.add(bucket)
+        with registry.timer("wikistats_dump_seconds", kind="pageviews"):
+            for key, count in parse_dump(path, tracked):
+                views[key][bucket] += count
+
+    return views, buckets
+
+
+@timed_stage
+def fetch_pageviews_from_dumps(queries, paths, granularity="daily", access="all-access", agent="user"):
+    """
+    Same as fetch_pageviews, from local dump files.
+    Periods covered by the dumps without any view are filled with zeros.
+    """
+    tracked = {
+        (lang, page["name"].replace(" ", "_"))
+        for obj in queries.values()
+        if "error" not in obj
+        for lang, page in obj["langs"].items()
+    }
+
+    timestamps = [obj["query"]["timestamp"] for obj in queries.values() if "error" not in obj]
+    start = end = None
+    if timestamps:
+        end = max(datetime.datetime.fromisoformat(timestamp) for timestamp in timestamps)
+        start = min(
+            datetime.datetime.fromisoformat(obj["query"]["timestamp"])
+            - datetime.timedelta(days=obj["query"]["duration"])
+            for obj in queries.values()
+            if "error" not in obj
+        )
+
+    views, buckets = aggregate_dumps(paths, tracked, granularity, start, end)
+    buckets = sorted(buckets)
+
+    for obj in queries.values():
+        if "error" in obj:
+            continue
+
+        for lang, page in obj["langs"].items():
+            counts = views.get((lang, page["name"].replace(" ", "_")), {})
+            page["pageviews"] = {
+                "granularity": granularity,
+                "access": access,
+                "agent": agent,
+                "source": "dumps",
+                "items": [{"timestamp": bucket.isoformat(), "views": counts.get(bucket, 0)} for bucket in buckets],
+            }
+            page["pageviews_total"] = sum(counts.values())
+
+    return queries
@@ -0,0 +1,267 @@
+"""
+Backlinks and langlinks from the SQL table dumps (https://dumps.wikimedia.org/, "<lang>wiki-<date>-<table>.sql.gz"),
+instead of thousands of API calls.
+
+The INSERT statements of the page, linktarget, pagelinks and langlinks dumps are streamed once into a compact on-disk
+index (SQLite), with for each page: its number of backlinks and a sample of them, and its langlinks.
+Lookups for any number of tracked articles are then local.
+
+To build the index of a wiki:
+    python -m dumps.sql enwiki.sqlite3 --page enwiki-latest-page.sql.gz --linktarget enwiki-latest-linktarget.sql.gz \
+        --pagelinks enwiki-latest-pagelinks.sql.gz --langlinks enwiki-latest-langlinks.sql.gz
+"""
+from collections import defaultdict
+from contextlib import closing
+import argparse
+import gzip
+import re
+import sqlite3
+
+
+from metrics import registry, timed_stage
+
+
+SAMPLE_SIZE = 50  # Backlinks titles kept per page
+FLUSH_EVERY = 1_000_000  # Aggregated link targets kept in memory before being written to the index
+BATCH_SIZE = 10_000  # Rows per insert when loading a table
+
+_TUPLE = re.compile(r"\(((?:'(?:[^'\\]|\\.)*'|[^'()])*)\)")
+_FIELD = re.compile(r"'((?:[^'\\]|\\.)*)'|([^,]+)")
+_ESCAPE = re.compile(r"\\(.)")
+_ESCAPES = {"0": "\0", "n": "\n", "r": "\r", "t": "\t", "Z": "\x1a"}
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS page (id INTEGER PRIMARY KEY, ns INTEGER, title TEXT);
+    CREATE TABLE IF NOT EXISTS linktarget (id INTEGER PRIMARY KEY, ns INTEGER, title TEXT);
+    CREATE TABLE IF NOT EXISTS link_counts (target INTEGER PRIMARY KEY, count INTEGER);
+    CREATE TABLE IF NOT EXISTS link_samples (target INTEGER, source INTEGER);
+    CREATE TABLE IF NOT EXISTS backlinks (page_id INTEGER PRIMARY KEY, count INTEGER);
+    CREATE TABLE IF NOT EXISTS backlink_samples (page_id INTEGER, source INTEGER);
+    CREATE TABLE IF NOT EXISTS langlinks (page_id INTEGER, lang TEXT, title TEXT);
+"""
+
+
+def _unescape(match):
+    char = match.group(1)
+    return _ESCAPES.get(char, char)
+
+
+def _value(match):
+    quoted, raw = match.groups()
+    if quoted is not None:
+        return _ESCAPE.sub(_unescape, quoted) if "\\" in quoted else quoted
+    if raw == "NULL":
+        return None
+    try:
+        return int(raw)
+    except ValueError:
+        return float(raw)
+
+
+def iter_rows(path, table):
+    """
+    Stream the rows of the INSERT statements of a table dump (plain or gzipped), one line at a time.
+
+    :return: generator of tuples
+    """
+    prefix = f"INSERT INTO `{table}` VALUES "
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt", encoding="utf8", errors="replace") as f:
+        for line in f:
+            if not line.startswith(prefix):
+                continue
+            for row in _TUPLE.finditer(line, len(prefix)):
+                yield tuple(_value(field) for field in _FIELD.finditer(row.group(1)))
+
+
+def _load(db, path, table, columns):
+    """
+    Load selected columns of a dump into the table of the same name.
+    """
+    query = f"INSERT OR REPLACE INTO {table} VALUES ({','.join('?' * len(columns))})"
+    batch = []
+    for row in iter_rows(path, table):
+        batch.append(tuple(row[i] for i in columns))
+        if len(batch) >= BATCH_SIZE:
+            db.executemany(query, batch)
+            batch = []
+    db.executemany(query, batch)
+
+
+def _flush_links(db, counts, samples):
+    db.executemany(
+        "INSERT INTO link_counts VALUES (?, ?) ON CONFLICT(target) DO UPDATE SET count = count + excluded.count",
+        counts.items(),
+    )
+    db.executemany(
+        "INSERT INTO link_samples VALUES (?, ?)",
+        [(target, source) for target, sources in samples.items() for source in sources],
+    )
+    counts.clear()
+    samples.clear()
+
+
+def build_index(output, page=None, linktarget=None, pagelinks=None, langlinks=None):
+    """
+    Build (or complete) the index of a wiki from its SQL dumps.
+    The backlinks need the page, linktarget and pagelinks dumps; the langlinks only the langlinks dump.
+    Memory is bounded by FLUSH_EVERY, the rest goes through the index on disk.
+    """
+    with closing(sqlite3.connect(output)) as db:
+        db.executescript(SCHEMA)
+
+        if page:
+            with registry.timer("wikistats_dump_seconds", kind="sql_page"):
+                # page_id, page_namespace, page_title
+                _load(db, page, "page", [0, 1, 2])
+                db.execute("CREATE INDEX IF NOT EXISTS page_title ON page (ns, title)")
+                db.commit()
+
+        if linktarget:
+            with registry.timer("wikistats_dump_seconds", kind="sql_linktarget"):
+                # lt_id, lt_namespace, lt_title
+                _load(db, linktarget, "linktarget", [0, 1, 2])
+                db.commit()
+
+        if pagelinks:
+            with registry.timer("wikistats_dump_seconds", kind="sql_pagelinks"):
+                counts = defaultdict(int)
+                samples = defaultdict(list)
+                for row in iter_rows(pagelinks, "pagelinks"):
+                    if len(row) != 3:
+                        raise ValueError("old pagelinks format (without linktarget) is not supported")
+                    source, _, target = row  # pl_from, pl_from_namespace, pl_target_id
+                    counts[target] += 1
+                    if len(samples[target]) < SAMPLE_SIZE:
+                        samples[target].append(source)
+                    if len(counts) >= FLUSH_EVERY:
+                        _flush_links(db, counts, samples)
+                _flush_links(db, counts, samples)
+
+                # From link targets (namespace and title) to page ids
+                db.executescript(
+                    f"""
+                    DELETE FROM backlinks;
+                    INSERT INTO backlinks
+                        SELECT page.id, link_counts.count FROM link_counts
+                        JOIN linktarget ON linktarget.id = link_counts.target
+                        JOIN page ON page.ns = linktarget.ns AND page.title = linktarget.title;
+                    DELETE FROM backlink_samples;
+                    INSERT INTO backlink_samples
+                        SELECT page_id, source FROM (
+                            SELECT page.id AS page_id, link_samples.source AS source,
+                                ROW_NUMBER() OVER (PARTITION BY link_samples.target) AS rank
+                            FROM link_samples
+                            JOIN linktarget ON linktarget.id = link_samples.target
+                            JOIN page ON page.ns = linktarget.ns AND page.title = linktarget.title
+                        ) WHERE rank <= {SAMPLE_SIZE};
+                    CREATE INDEX IF NOT EXISTS backlink_samples_page ON backlink_samples (page_id);
+                    DELETE FROM link_counts;
+                    DELETE FROM link_samples;
+                    DELETE FROM linktarget;
+                    """
+                )
+                db.commit()
+
+        if langlinks:
+            with registry.timer("wikistats_dump_seconds", kind="sql_langlinks"):
+                # ll_from, ll_lang, ll_title
+                db.execute("DELETE FROM langlinks")
+                _load(db, langlinks, "langlinks", [0, 1, 2])
+                db.execute("CREATE INDEX IF NOT EXISTS langlinks_page ON langlinks (page_id)")
+                db.commit()
+
+        db.execute("VACUUM")
+
+
+class LinkIndex:
+    """
+    Lookups in an index built by build_index.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def _select(self, query, ids):
+        ids = list(ids)
+        with closing(sqlite3.connect(self.path)) as db:
+            for i in range(0, len(ids), 500):  # SQLite limits the number of parameters
+                batch = ids[i : i + 500]
+                yield from db.execute(query.format(ids=",".join("?" * len(batch))), batch)
+
+    def page_ids(self, titles, ns=0):
+        """
+        :return: {title: page id} for the titles (with spaces) that exist
+        """
+        by_title = {title.replace(" ", "_"): title for title in titles}
+        rows = self._select(f"SELECT title, id FROM page WHERE ns = {int(ns)} AND title IN ({{ids}})", by_title)
+        return {by_title[title]: page_id for title, page_id in rows}
+
+    def backlinks(self, page_ids):
+        """
+        :return: {page id: (number of backlinks, [sample of backlinks titles])}
+        Titles are given without their namespace prefix (the dumps only have namespace numbers).
+        """
+        result = {page_id: (0, []) for page_id in page_ids}
+        for page_id, count in self._select("SELECT page_id, count FROM backlinks WHERE page_id IN ({ids})", page_ids):
+            result[page_id] = (count, [])
+        rows = self._select(
+            "SELECT backlink_samples.page_id, page.title FROM backlink_samples "
+            "JOIN page ON page.id = backlink_samples.source WHERE backlink_samples.page_id IN ({ids})",
+            page_ids,
+        )
+        for page_id, title in rows:
+            result[page_id][1].append(title.replace("_", " "))
+        return result
+
+    def langlinks(self, page_ids):
+        """
+        :return: {page id: {lang: title}}
+        """
+        result = {page_id: {} for page_id in page_ids}
+        for page_id, lang, title in self._select(
+            "SELECT page_id, lang, title FROM langlinks WHERE page_id IN ({ids})", page_ids
+        ):
+            result[page_id][lang] = title
+        return result
+
+
+@timed_stage
+def fetch_backlinks_from_index(queries, indexes):
+    """
+    Same as fetch_backlinks, from local indexes, for the langs that have one.
+    "backlinks" is only a sample; the exact number is in "backlinks_count".
+
+    :param indexes: {lang: LinkIndex}
+    """
+    for lang, index in indexes.items():
+        pages = [
+            page
+            for obj in queries.values()
+            if "error" not in obj
+            for page_lang, page in obj["langs"].items()
+            if page_lang == lang
+        ]
+        ids = index.page_ids([page["name"] for page in pages if "pid" not in page])
+        ids.update({page["name"]: page["pid"] for page in pages if "pid" in page})
+
+        found = index.backlinks(set(ids.values()))
+        for page in pages:
+            if page["name"] in ids:
+                page["backlinks_count"], page["backlinks"] = found[ids[page["name"]]]
+
+    return queries
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the local backlinks and langlinks index of a wiki.")
+    parser.add_argument("output", help="index file to create or complete")
+    for table in ["page", "linktarget", "pagelinks", "langlinks"]:
+        parser.add_argument(f"--{table}", help=f"{table} SQL dump")
+    args = parser.parse_args()
+
+    build_index(args.output, args.page, args.linktarget, args.pagelinks, args.langlinks)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+Memory footprint of the results: leaner pages (interned strings, compressed or dropped extracts) and a per-field report
+of the memory a result set takes.
+"""
+import base64
+import sys
+import zlib
+
+
+EXTRACTS = ["keep", "compress", "drop"]  # What to do with the extract of a page once its stats are computed
+
+
+def slim_extract(page, mode):
+    """
+    Compress (as "extract_zlib", base64 of the zlib-compressed text, to stay JSON-able) or drop the extract of a page.
+    """
+    if mode == "keep" or "extract" not in page:
+        return
+    extract = page.pop("extract")
+    if mode == "compress":
+        page["extract_zlib"] = base64.b64encode(zlib.compress(extract.encode())).decode("ascii")
+
+
+def get_extract(page):
+    """
+    :return: plain text of the page, whether its extract was compressed or not; None if it is not there (dropped)
+    """
+    if "extract_zlib" in page:
+        return zlib.decompress(base64.b64decode(page["extract_zlib"])).decode()
+    return page.get("extract")
+
+
+def intern_strings(queries):
+    """
+    Intern the strings that repeat across the pages and revisions (usernames, titles), so that each is stored once.
+    """
+    for obj in queries.values():
+        if "error" in obj:
+            continue
+
+        for page in obj["langs"].values():
+            page["name"] = sys.intern(page["name"])
+            if "backlinks" in page:
+                page["backlinks"] = [sys.intern(title) for title in page["backlinks"]]
+            if "contributors" in page:
+                page["contributors"] = [sys.intern(user) for user in page["contributors"]]
+            if page.get("creation") and page["creation"]["user"]:  # None for deleted contributors
+                page["creation"]["user"] = sys.intern(page["creation"]["user"])
+            for item in page.get("contributions", {}).get("items", []):
+                if item["username"]:  # None for hidden users
+                    item["username"] = sys.intern(item["username"])
+
+    return queries
+
+
+def deep_sizeof(obj, seen):
+    """
+    Bytes taken by obj and everything it references, except the objects in seen (which it is added to), so that
+    shared objects (such as interned strings) are only counted once.
+    """
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_sizeof(key, seen) + deep_sizeof(value, seen) for key, value in obj.items())
+    elif isinstance(obj, (list, tuple, set)):
+        size += sum(deep_sizeof(item, seen) for item in obj)
+    return size
+
+
+def memory_usage(queries):
+    """
+    Memory taken by a result set, per page field ("query" and "error" for the article ones).
+
+    :return: {field: bytes}, biggest first
+    """
+    seen = set()
+    usage = {}
+    for obj in queries.values():
+        for field in ("query", "error"):
+            if field in obj:
+                usage[field] = usage.get(field, 0) + deep_sizeof(obj[field], seen)
+        for page in obj.get("langs", {}).values():
+            for field, value in page.items():
+                usage[field] = usage.get(field, 0) + deep_sizeof(value, seen)
+
+    return dict(sorted(usage.items(), key=lambda item: item[1], reverse=True))
+
+
+def format_usage(usage):
+    total = sum(usage.values())
+    return "\n".join(
+        [f"Total: {total / 2**20:.1f} MiB"]
+        + [f"    {field}: {size / 2**20:.1f} MiB ({size / (total or 1):.0%})" for field, size in usage.items()]
+    )
@@ -1,15 +1,44 @@
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from pprint import pprint
 from urllib.parse import quote, unquote, urlparse
+import argparse
+import contextlib
+import contextvars
+import csv
 import datetime
+import gzip
+import hashlib
+import io
+import itertools
 import json
+import os
+import sys
+import threading
+import time
+import uuid
 
 
-from textstat import textstat
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import requests
 
 
+from cache import PageviewStore, ReadabilityCache, StageCache, TitleIndex
+from dumps.history import fetch_history_from_dumps
+from dumps.pageviews import fetch_pageviews_from_dumps
+from dumps.sql import fetch_backlinks_from_index, LinkIndex
+from footprint import EXTRACTS, format_usage, intern_strings, memory_usage, slim_extract
+from metrics import record_page, record_request
+from metrics import registry as global_registry
+from metrics import timed_stage, use_registry
+from serialization import dumps, loads
+
+
 # URLs
 URL_INFOS = "https://{lang}.wikipedia.org/w/api.php"
+URL_EDIT_COUNTS = "https://{lang}.wikipedia.org/w/rest.php/v1/page/{uri_article_name}/history/counts/edits"
 URL_STATS = "https://wikimedia.org/api/rest_v1/metrics/pageviews/per-article/{lang}.wikipedia/{access}/{agent}/{uri_article_name}/{granularity}/{start}/{end}"
 
 # Parameters
@@ -25,6 +54,8 @@ PARAMS = {
 }
 
 WIKI_LIMIT = 500  # From the API
+TITLES_LIMIT = 50  # Max number of titles per query, from the API
+GZIP_MAGIC = b"\x1f\x8b"
 GLOBAL_LIMIT = WIKI_LIMIT
 
 BACKLINKS_LIMIT = GLOBAL_LIMIT
@@ -34,22 +65,80 @@ ACCESS = "all-access"
 AGENTS = "all-agents"
 GRANULARITY = "daily"
 
+RETRIES = 3  # For 429 and 5xx answers
+RETRY_BACKOFF = 0.5
+# Failures of a request (connection, retries used up, body that is not JSON), recorded on the page they were for
+FETCH_ERRORS = (requests.RequestException, ValueError)
+
+DEFAULT_LATENCY = 0.5  # Seconds per request, when we have not measured anything yet
+DEFAULT_REVISIONS = WIKI_LIMIT  # Assumed number of revisions in the window, when not counted
+PAGINATION_WORKERS = 4  # Continuation chains (sub-ranges of a revision window, pages of a stage) followed concurrently
+RANGES_PER_WORKER = 4  # Maximum number of sub-ranges a revision window is split into, per worker
+
 VERBOSE = False
 
 DEFAULT_LANGS = ["en", "fr", "de"]
 TARGET_DURATION = DEFAULT_DURATION
 
+# Share the results of the stages between the processes using the same cache (several workers of the web app), and
+# coalesce identical in-flight fetches; see StageCache
+SHARED_CACHE = os.environ.get("WIKISTATS_SHARED_CACHE", "") == "1"
+EXTRACT_MODE = os.environ.get("WIKISTATS_EXTRACTS", "keep")  # See footprint.EXTRACTS
+SINGLE_FLIGHT_POLL = 0.5  # Seconds between checks, when waiting for a page fetched by another run
+
+
+class BudgetExceeded(Exception):
+    """
+    Raised when a session has already made as many requests as its budget allows.
+    """
+
+
+class InstrumentedSession(requests.Session):
+    """
+    Session that records latency, status, size and retries of every call in the metrics registry.
+    It can also enforce a hard request budget (None means unlimited).
+    """
+
+    budget = None
+    requests_made = 0
+    registry = None  # Registry of the owning client, None for the process-wide one
+    _budget_lock = threading.Lock()  # Pages can be fetched from several threads (see run_concurrently)
+
+    def request(self, method, url, *args, **kwargs):
+        with self._budget_lock:
+            if self.budget is not None and self.requests_made >= self.budget:
+                raise BudgetExceeded(f"request budget of {self.budget} exhausted")
+            self.requests_made += 1
+
+        with use_registry(self.registry):
+            start = time.perf_counter()
+            try:
+                response = super().request(method, url, *args, **kwargs)
+            except requests.RequestException:
+                record_request(url, time.perf_counter() - start, "exception", 0)
+                raise
+
+            retries = getattr(response.raw, "retries", None)
+            record_request(
+                url,
+                time.perf_counter() - start,
+                response.status_code,
+                len(response.content),
+                len(retries.history) if retries is not None else 0,
+            )
+        return response
+
 
 def get_session():
     # Starts request session, that will be used through the whole process
-    s = requests.Session()
+    s = InstrumentedSession()
     s.headers.update(HEADERS)
     s.params.update(PARAMS)
 
-    return s
-
+    retry = Retry(total=RETRIES, backoff_factor=RETRY_BACKOFF, status_forcelist=[429, 500, 502, 503, 504])
+    s.mount("https://", HTTPAdapter(max_retries=retry))
 
-s = get_session()
+    return s
 
 
 def extract_lang_name(link: str) -> tuple[str, str]:
@@ -66,9 +155,9 @@ def extract_lang_name(link: str) -> tuple[str, str]:
 
 def qprint(json_queries):
     """
-    Check if correct JSON and prints.
+    Check if correct JSON and prints it on stderr, stdout being the output.
     """
-    print(json.dumps(json_queries, indent=2))
+    print(json.dumps(json_queries, indent=2), file=sys.stderr)
 
 
 def wiki_quote(page_name):
@@ -110,74 +199,12 @@ def links_to_find(target_links, target_langs=None):
         del to_find["*"]
 
     if VERBOSE:
-        pprint(to_find)
+        pprint(to_find, stream=sys.stderr)
 
     return to_find
 
 
-def fetch_data(to_find, target_langs=None):
-    # Check if the page exists, gather information if it does
-    # https://www.mediawiki.org/wiki/API:Info
-    # https://www.mediawiki.org/wiki/API:Langlinks
-    if target_langs is None:
-        target_langs = DEFAULT_LANGS
-
-    queries = {}
-    for lang, names in to_find.items():
-        url_full = URL_INFOS.format(lang=lang)
-        # We group the queries per target lang for less queries
-        titles = "|".join(names)
-        params = {
-            "titles": titles,
-            "prop": "info|langlinks",
-            "lllimit": WIKI_LIMIT,  # We want all langs in order to find our target langs
-        }
-
-        results = s.get(url=url_full, params=params)
-        data = results.json()
-
-        if "query" in data and "pages" in data["query"]:
-            data = data["query"]["pages"]
-
-        for pid, obj in data.items():
-            title = obj["title"]
-
-            # Will only keep the latest successful query for same name pages
-            queries[title] = {
-                "query": {
-                    "lang": lang,
-                }
-            }
-
-            # Page was not found with that language
-            if int(pid) < 0:
-                queries[title]["error"] = "not found"
-                continue
-
-            queries[title]["query"].update(
-                {
-                    "pid": int(pid),
-                    "timestamp": datetime.datetime.today().isoformat(),
-                    "duration": TARGET_DURATION,
-                }
-            )
-
-            # Add the query language in the list of langs
-            queries[title]["langs"] = {
-                lang: {
-                    "name": title,
-                }
-            }
-
-            # Add the other target langs
-            if "langlinks" in obj:
-                for langlink in obj["langlinks"]:
-                    if not target_langs or langlink["lang"] in target_langs:  # Use all langs if no target lang
-                        queries[title]["langs"][langlink["lang"]] = {"name": langlink["*"]}
-
-    if VERBOSE:
-        qprint(queries)
-
+def merge_linked(queries):
     # Merge linked pages with different names
     # We assume here that pages are correctly linked (by Wikipedia) between each other
     next_queries = {}
@@ -194,61 +221,590 @@ def fetch_data(to_find, target_langs=None):
 
         if not skip:
             next_queries[name] = obj
-    queries = next_queries
 
-    if VERBOSE:
-        qprint(queries)
+    return next_queries
+
+
+# Stages run after the resolution, in order; the ones at the start of DEGRADABLE_STAGES are the first to go
+STAGES = [
+    "fetch_descriptions",
+    "fetch_backlinks",
+    "fetch_pageprops_revisions",
+    "fetch_contributors",
+    "fetch_contributions",
+    "fetch_pageviews",
+    "fetch_text_and_stats",
+    "fetch_page_assessments",
+]
+DEGRADABLE_STAGES = ["fetch_backlinks", "fetch_contributors", "fetch_page_assessments", "fetch_descriptions"]
+
+# Page fields, and the stages (and props of fetch_pageprops_revisions) that produce them
+FIELDS = {
+    "description": ["fetch_descriptions"],
+    "backlinks": ["fetch_backlinks"],
+    "pid": ["fetch_pageprops_revisions"],
+    "pwikidata": ["fetch_pageprops_revisions:pageprops"],
+    "creation": ["fetch_pageprops_revisions:revisions"],
+    "contributors": ["fetch_contributors"],
+    "contributions": ["fetch_contributions"],
+    "pageviews": ["fetch_pageviews"],
+    "extract": ["fetch_text_and_stats"],
+    "stats": ["fetch_text_and_stats"],
+    "readability": ["fetch_text_and_stats"],
+    "pageassessments": ["fetch_page_assessments"],
+}
+# Stages that need other fields to run
+STAGES_DEPENDENCIES = {
+    "fetch_contributors": ["pid"],
+    "fetch_contributions": ["pid"],
+    "fetch_text_and_stats": ["pid"],
+    "fetch_page_assessments": ["pid"],
+}
+PROFILES = {
+    "full": list(FIELDS),
+    "pageviews": ["pageviews"],  # What the global dashboard shows
+    "metadata": ["description", "pwikidata", "creation", "pageassessments"],
+}
 
-    # Dirty hack to get the short description don't judge me
-    for name, obj in queries.items():
-        if "error" in obj:
-            continue
+# Page fields written by each stage, that is, what is shared through the StageCache
+STAGES_OUTPUTS = {
+    "fetch_descriptions": ["description"],
+    "fetch_backlinks": ["backlinks", "backlinks_count"],
+    "fetch_pageprops_revisions": ["pid", "pwikidata", "creation"],
+    "fetch_contributors": ["contributors"],
+    "fetch_contributions": ["contributions"],
+    "fetch_pageviews": ["pageviews", "pageviews_total"],
+    "fetch_text_and_stats": ["lastrevid", "extract", "extract_zlib", "stats", "readability"],
+    "fetch_page_assessments": ["pageassessments"],
+}
 
-        for lang, page in obj["langs"].items():
-            data = s.get(
-                url=f"https://{lang}.wikipedia.org/api/rest_v1/page/summary/{wiki_quote(page['name'])}?redirect=true"
-            ).json()
-            if "description" in data:
-                page["description"] = data["description"]
-            else:
-                page["description"] = None
+STAGES_ENDPOINTS = {
+    "resolve_pages": "api.php",
+    "fetch_descriptions": "rest/page/summary",
+    "fetch_pageviews": "rest/metrics/pageviews",
+}
 
-    if VERBOSE:
-        qprint(queries)
 
-    return queries
+def stages_for(fields=None):
+    """
+    Minimal stages to run for the given fields, or profile name (see PROFILES), with their dependencies.
 
+    :return: (ordered list of stages, props for fetch_pageprops_revisions)
+    """
+    if fields is None:
+        fields = "full"
+    if isinstance(fields, str):
+        fields = PROFILES[fields]
 
-def fetch_backlinks(queries):
-    # Find the backlinks for each
-    # For important pages (looking at you, "École polytechnique fédérale de Lausanne"), can take some time!
-    # Set BACKLINKS_LIMIT to control that.
-    # https://www.mediawiki.org/wiki/API:Backlinks
-    for name, obj in queries.items():
-        if "error" in obj:
+    needed, props, todo = set(), set(), list(fields)
+    while todo:
+        field = todo.pop()
+        if field not in FIELDS:
+            raise ValueError(f"unknown field: {field}")
+        for stage in FIELDS[field]:
+            stage, _, prop = stage.partition(":")
+            if prop:
+                props.add(prop)
+            if stage not in needed:
+                needed.add(stage)
+                todo += STAGES_DEPENDENCIES.get(stage, [])
+
+    return [stage for stage in STAGES if stage in needed], tuple(sorted(props))
+
+
+def ceil_div(a, b):
+    return -(-a // b)
+
+
+def stage_failed(page, stage, message):
+    """
+    Record that a stage failed on a page (an article in one lang). What the other stages fetched is kept, and
+    WikipediaClient.retry_failed runs the failed stages again.
+    """
+    page.setdefault("errors", {})[stage] = message
+
+
+@contextlib.contextmanager
+def failures_recorded(page, stage):
+    """
+    Record a failed request (see FETCH_ERRORS) of a stage on the page it was for, instead of aborting the run.
+    """
+    try:
+        yield
+    except FETCH_ERRORS as e:
+        stage_failed(page, stage, f"request failed ({type(e).__name__}: {e})")
+
+
+def has_pid(page, stage):
+    """
+    Whether the page id, that some stages need (see STAGES_DEPENDENCIES), is known; if not (fetch_pageprops_revisions
+    failed on the page), the failure of stage is recorded.
+    """
+    if "pid" not in page:
+        stage_failed(page, stage, "no page id (fetch_pageprops_revisions failed)")
+    return "pid" in page
+
+
+def page_id(obj, lang, page):
+    """
+    :return: id of a page if it is known (from fetch_pageprops_revisions, or from the resolution for the page in the
+    lang of the query), None otherwise
+    """
+    if "pid" in page:
+        return page["pid"]
+    if lang == obj["query"].get("lang"):
+        return obj["query"].get("pid")
+    return None
+
+
+def failed_stages(obj):
+    """
+    :return: {lang: [stages that failed on the page]} of an article, only for its pages with failures
+    """
+    return {lang: list(page["errors"]) for lang, page in obj.get("langs", {}).items() if page.get("errors")}
+
+
+def apply_budget(plan, budget):
+    """
+    Skip the degradable stages, in order, until the plan fits in the budget.
+    The plan is modified in place; "skipped" lists the stages that will not run.
+    """
+    plan["budget"] = budget
+    if budget is None:
+        return plan
+
+    for stage in DEGRADABLE_STAGES:
+        if plan["requests"] <= budget:
+            break
+        if stage not in plan["stages"]:
             continue
+        plan["skipped"].append(stage)
+        plan["requests"] -= plan["stages"][stage]["requests"]
+        plan["seconds"] -= plan["stages"][stage]["seconds"]
+
+    plan["fits"] = plan["requests"] <= budget
+    return plan
+
+
+def run_concurrently(calls, workers):
+    """
+    Run functions (without arguments) in a pool of threads, each in a copy of the current context, so that their
+    requests are recorded under the current stage and registry.
+
+    :return: their results, in the same order; the first exception raised, if any
+    """
+    if workers <= 1 or len(calls) <= 1:
+        return [call() for call in calls]
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(contextvars.copy_context().run, call) for call in calls]
+        return [future.result() for future in futures]
+
+
+def parse_timestamp(timestamp):
+    # Naive, as the timestamps of the queries: the API takes both
+    return datetime.datetime.fromisoformat(timestamp.replace("Z", "")).replace(tzinfo=None)
+
 
-        for lang, page in obj["langs"].items():
-            blcontinue = ""
-            blcounter = 0
+def split_window(start, end, probed, probed_since, workers):
+    """
+    Split the part of a revision window that a first request did not cover into sub-ranges of about the same number of
+    revisions, assuming the density of revisions seen by that request.
+
+    :param start: latest timestamp of the window (ISO)
+    :param end: earliest timestamp of the window (ISO)
+    :param probed: number of revisions returned by the first request, the latest ones
+    :param probed_since: timestamp of the earliest of them, where the rest of the window starts
+    :return: [(latest, earliest)] ISO timestamps of the sub-ranges, latest first; their bounds overlap (the API
+    includes both), so revisions on a bound are returned twice
+    """
+    start, end, rest = parse_timestamp(start), parse_timestamp(end), parse_timestamp(probed_since)
+    probed_seconds = max((start - rest).total_seconds(), 1)
+    expected = probed * (rest - end).total_seconds() / probed_seconds
+    # More ranges than workers, so that the pool evens out a density that is not uniform (one request each at least)
+    nb_ranges = max(1, min(RANGES_PER_WORKER * workers, ceil_div(int(expected), WIKI_LIMIT)))
+
+    step = (rest - end) / nb_ranges
+    bounds = [rest - i * step for i in range(nb_ranges)] + [end]
+    return [(bounds[i].isoformat(), bounds[i + 1].isoformat()) for i in range(nb_ranges)]
+
+
+class ModuleSetting:
+    """
+    Setting of a client that falls back to a module global when it was not given (None), read at each use: changing
+    the global (such as BACKLINKS_LIMIT) still changes what the module-level functions do.
+    """
+
+    def __init__(self, global_name):
+        self.global_name = global_name
+
+    def __set_name__(self, owner, name):
+        self.attribute = f"_{name}"
+
+    def __get__(self, client, owner=None):
+        if client is None:
+            return self
+        value = getattr(client, self.attribute, None)
+        return globals()[self.global_name] if value is None else value
+
+    def __set__(self, client, value):
+        setattr(client, self.attribute, value)
+
+
+class WikipediaClient:
+    """
+    Runs the stages with its own settings, session (and thus request budget), caches and metrics registry, so that
+    independent runs can go on in parallel in the same process (one client per run; a client is not thread-safe).
+    The module-level functions are the methods of default_client, which uses the module settings.
+    """
+
+    backlinks_limit = ModuleSetting("BACKLINKS_LIMIT")
+    contribs_limit = ModuleSetting("CONTRIBS_LIMIT")
+    duration = ModuleSetting("TARGET_DURATION")
+    granularity = ModuleSetting("GRANULARITY")
+    access = ModuleSetting("ACCESS")
+    agent = ModuleSetting("AGENTS")
+    verbose = ModuleSetting("VERBOSE")
+    extracts = ModuleSetting("EXTRACT_MODE")
+    workers = ModuleSetting("PAGINATION_WORKERS")
+
+    def __init__(
+        self,
+        backlinks_limit=None,
+        contribs_limit=None,
+        duration=None,
+        granularity=None,
+        access=None,
+        agent=None,
+        verbose=None,
+        session=None,
+        title_index=None,
+        readability_cache=None,
+        stage_cache=None,
+        registry=None,
+        extracts=None,
+        workers=None,
+        pageview_store=None,
+    ):
+        """
+        Settings default to the module ones (BACKLINKS_LIMIT, TARGET_DURATION...), as they are when used (see
+        ModuleSetting).
+
+        :param session: InstrumentedSession, a new one by default
+        :param title_index: TitleIndex, False to disable it
+        :param readability_cache: ReadabilityCache, False to disable it; by default, it stores the extracts unless they
+        are dropped
+        :param stage_cache: StageCache shared with other processes, False to disable it; by default, only enabled
+        with WIKISTATS_SHARED_CACHE=1
+        :param registry: metrics Registry, the process-wide one (served on /metrics) by default
+        :param extracts: what to do with the extracts once the stats are computed, "keep", "compress" (as
+        "extract_zlib", see footprint.get_extract) or "drop"; EXTRACT_MODE (WIKISTATS_EXTRACTS) by default
+        :param workers: number of continuation chains followed at once, PAGINATION_WORKERS by default; 1 to fetch
+        everything sequentially
+        :param pageview_store: PageviewStore, False to disable it
+        """
+        self.backlinks_limit = backlinks_limit
+        self.contribs_limit = contribs_limit
+        self.duration = duration
+        self.granularity = granularity or None
+        self.access = access or None
+        self.agent = agent or None
+        self.verbose = verbose
+        self.extracts = extracts or None
+        self.workers = workers
+        if self.extracts not in EXTRACTS:
+            raise ValueError(f"extracts must be one of {', '.join(EXTRACTS)}, not {self.extracts!r}")
+
+        self.registry = registry or global_registry
+        self._session = session
+        if session is not None:
+            session.registry = self.registry
+        self.title_index = TitleIndex() if title_index is None else title_index
+        if readability_cache is None:
+            readability_cache = ReadabilityCache(store_extracts=self.extracts != "drop")
+        self.readability_cache = readability_cache
+        self.pageview_store = PageviewStore() if pageview_store is None else pageview_store
+        if stage_cache is None:
+            stage_cache = StageCache() if SHARED_CACHE else False
+        self.stage_cache = stage_cache
+        self._textstat = None
+
+    @property
+    def session(self):
+        # Only created when the first request is made, so that importing this module stays cheap
+        if self._session is None:
+            self._session = get_session()
+            self._session.registry = self.registry
+        return self._session
+
+    @property
+    def textstat(self):
+        # textstat (and its dictionaries) is only loaded when the first article is scored
+        if self._textstat is None:
+            from textstat.textstat import textstatistics
+
+            self._textstat = textstatistics()  # set_lang is per instance
+        return self._textstat
+
+    @timed_stage
+    def canonicalize(self, to_find, index=None):
+        """
+        Resolve normalization (case, underscores...) and redirects, in batched queries, so that the same page given
+        under different names is only fetched once. Known titles are taken from the persistent title index instead.
+        https://www.mediawiki.org/wiki/API:Query#Resolving_redirects
+
+        :param index: TitleIndex to use, None for the one of the client, False to disable it
+        :return: to_find, with canonical titles (titles of missing pages are kept as they are)
+        """
+        if index is None:
+            index = self.title_index
+
+        canonical = {}
+        for lang, names in to_find.items():
             url_full = URL_INFOS.format(lang=lang)
+            known = index.get_many(lang, names) if index else {}
+            unknown = sorted(set(names) - set(known))
+
+            resolved = {}
+            for i in range(0, len(unknown), TITLES_LIMIT):
+                batch = unknown[i : i + TITLES_LIMIT]
+                params = {
+                    "titles": "|".join(batch),
+                    "redirects": 1,
+                    "prop": "pageprops",
+                    "ppprop": "wikibase_item",
+                }
+
+                try:
+                    results = self.session.get(url=url_full, params=params)
+                except BudgetExceeded:  # The names left keep their title, resolve_pages stops there too
+                    break
+                data = results.json()
+                if "query" not in data:
+                    continue
+
+                # Input -> normalized -> redirect target -> page
+                renames = {}
+                for step in ["normalized", "redirects"]:
+                    for item in data["query"].get(step, []):
+                        renames[item["from"]] = item["to"]
+                pages = {page["title"]: page for page in data["query"].get("pages", {}).values()}
+
+                for name in batch:
+                    title = name
+                    for _ in range(3):  # Normalization, then at most a redirect (and its normalization)
+                        title = renames.get(title, title)
+                    page = pages.get(title, {})
+                    if "missing" in page or "invalid" in page or "pageid" not in page:
+                        resolved[name] = (title, None, None)
+                    else:
+                        resolved[name] = (title, page["pageid"], page.get("pageprops", {}).get("wikibase_item"))
+                    resolved.setdefault(title, resolved[name])  # Under its canonical title too, for resolve_pages
+
+            if index and resolved:
+                index.put_many(lang, resolved)
+
+            known.update(resolved)
+            canonical[lang] = {known[name][0] if name in known else name for name in names}
+
+        if self.verbose:
+            pprint(canonical, stream=sys.stderr)
+
+        return canonical
+
+    def info_batches(self, lang, names, link_index=None, index=None):
+        """
+        Pages info and langlinks of the names, by batches, in the format of the API (pages by page id, negative if
+        missing). With a local LinkIndex, no request is made; with a TitleIndex, none is made for the names it knows
+        (missing pages, or pages whose langlinks it has), and the langlinks fetched are added to it.
+        """
+        if link_index is not None:
+            ids = link_index.page_ids(names)
+            langlinks = link_index.langlinks(ids.values())
+            data = {}
+            for i, name in enumerate(names):
+                if name in ids:
+                    links = [
+                        {"lang": other, "*": title.replace("_", " ")} for other, title in langlinks[ids[name]].items()
+                    ]
+                    data[str(ids[name])] = {"title": name, "langlinks": links}
+                else:
+                    data[str(-1 - i)] = {"title": name, "missing": ""}
+            yield data
+            return
+
+        if index:
+            # Names are canonical titles here (see canonicalize)
+            known = {name: pid for name, (title, pid, _) in index.get_many(lang, names).items() if title == name}
+            langlinks = index.get_langlinks(lang, [pid for pid in known.values() if pid is not None])
+            data = {}
+            for i, (name, pid) in enumerate(known.items()):
+                if pid is None:
+                    data[str(-1 - i)] = {"title": name, "missing": ""}
+                elif pid in langlinks:
+                    links = [{"lang": other, "*": title} for other, title in langlinks[pid].items()]
+                    data[str(pid)] = {"title": name, "langlinks": links}
+            if data:
+                yield data
+            done = {obj["title"] for obj in data.values()}
+            names = [name for name in names if name not in done]
+
+        url_full = URL_INFOS.format(lang=lang)
+        # We group the queries per target lang for less queries, up to what the API allows
+        for i in range(0, len(names), TITLES_LIMIT):
+            titles = "|".join(names[i : i + TITLES_LIMIT])
+            params = {
+                "titles": titles,
+                "prop": "info|langlinks",
+                "lllimit": WIKI_LIMIT,  # We want all langs in order to find our target langs
+                "redirects": 1,  # Should already be done by canonicalize, but is free
+            }
+
+            results = self.session.get(url=url_full, params=params)
+            data = results.json()
+
+            if "query" in data and "pages" in data["query"]:
+                if index and "continue" not in data:  # Else, the langlinks of some pages are not complete
+                    index.put_langlinks(
+                        lang,
+                        {
+                            int(pid): {langlink["lang"]: langlink["*"] for langlink in obj.get("langlinks", [])}
+                            for pid, obj in data["query"]["pages"].items()
+                            if int(pid) > 0
+                        },
+                    )
+                data = data["query"]["pages"]
+
+            yield data
+
+    @timed_stage
+    def resolve_pages(self, to_find, target_langs=None, link_indexes=None, index=None):
+        # Check if the page exists, gather information if it does
+        # https://www.mediawiki.org/wiki/API:Info
+        # https://www.mediawiki.org/wiki/API:Langlinks
+        # link_indexes: {lang: LinkIndex} to resolve locally, see dumps.sql
+        # index: TitleIndex for the pages already resolved by earlier runs, None for the one of the client, False to
+        # disable it
+        if target_langs is None:
+            target_langs = DEFAULT_LANGS
+        if link_indexes is None:
+            link_indexes = {}
+        if index is None:
+            index = self.title_index
+
+        queries = {}
+        for lang, names in to_find.items():
+            batches = self.info_batches(lang, sorted(names), link_indexes.get(lang), index)
+            while True:
+                try:
+                    data = next(batches)
+                except StopIteration:
+                    break
+                except BudgetExceeded:
+                    # The names left are unknown, not missing: they can be asked again by another run
+                    for name in names:
+                        queries.setdefault(name, {"query": {"lang": lang}, "error": "budget exceeded"})
+                    break
+
+                for pid, obj in data.items():
+                    title = obj["title"]
+
+                    # Will only keep the latest successful query for same name pages
+                    if int(pid) < 0 and title in queries and "error" not in queries[title]:
+                        continue
+                    queries[title] = {
+                        "query": {
+                            "lang": lang,
+                        }
+                    }
+
+                    # Page was not found with that language
+                    if int(pid) < 0:
+                        queries[title]["error"] = "not found"
+                        continue
+
+                    queries[title]["query"].update(
+                        {
+                            "pid": int(pid),
+                            "timestamp": datetime.datetime.today().isoformat(),
+                            "duration": self.duration,
+                        }
+                    )
+
+                    # Add the query language in the list of langs
+                    queries[title]["langs"] = {
+                        lang: {
+                            "name": title,
+                        }
+                    }
+                    if "lastrevid" in obj:
+                        queries[title]["langs"][lang]["lastrevid"] = obj["lastrevid"]
+
+                    # Add the other target langs
+                    if "langlinks" in obj:
+                        for langlink in obj["langlinks"]:
+                            if not target_langs or langlink["lang"] in target_langs:  # Use all langs if no target lang
+                                queries[title]["langs"][langlink["lang"]] = {"name": langlink["*"]}
+
+        if self.verbose:
+            qprint(queries)
+
+        queries = merge_linked(queries)
+
+        if self.verbose:
+            qprint(queries)
+
+        return queries
+
+    @timed_stage
+    def fetch_descriptions(self, queries):
+        # Dirty hack to get the short description don't judge me
+        for name, obj in queries.items():
+            if "error" in obj:
+                continue
+
+            for lang, page in obj["langs"].items():
+                url_full = f"https://{lang}.wikipedia.org/api/rest_v1/page/summary/{wiki_quote(page['name'])}"
+                with failures_recorded(page, "fetch_descriptions"):
+                    data = self.session.get(url=f"{url_full}?redirect=true").json()
+                    if "description" in data:
+                        page["description"] = data["description"]
+                    else:
+                        page["description"] = None
+
+        if self.verbose:
+            qprint(queries)
 
-            while blcounter < BACKLINKS_LIMIT:
+        return queries
+
+    def fetch_data(self, to_find, target_langs=None):
+        queries = self.resolve_pages(to_find, target_langs)
+        self.fetch_descriptions(queries)
+
+        return queries
+
+    def backlinks_of(self, lang, page):
+        blcontinue = ""
+        blcounter = 0
+        url_full = URL_INFOS.format(lang=lang)
+
+        with failures_recorded(page, "fetch_backlinks"):
+            while blcounter < self.backlinks_limit:
                 params = {
                     "list": "backlinks",
                     "bltitle": page["name"],
-                    "bllimit": min(BACKLINKS_LIMIT, WIKI_LIMIT),
+                    "bllimit": min(self.backlinks_limit, WIKI_LIMIT),
                 }
                 if blcontinue != "":
                     params["blcontinue"] = blcontinue
 
-                results = s.get(url=url_full, params=params)
+                results = self.session.get(url=url_full, params=params)
                 data = results.json()
 
                 if "query" in data and "backlinks" in data["query"]:
                     bldata = data["query"]["backlinks"]
                 else:
-                    obj["error"] = "could not retrieve information (backlinks)"
+                    stage_failed(page, "fetch_backlinks", "could not retrieve information (backlinks)")
                     break
 
                 if "backlinks" not in page:
@@ -261,89 +817,114 @@ def fetch_backlinks(queries):
 
                 if "continue" in data:
                     blcontinue = data["continue"]["blcontinue"]
+                    record_page()
                 else:
                     break
 
-            if "backlinks" in page and isinstance(page["backlinks"], set):
-                page["backlinks"] = list(page["backlinks"])  # Sets are not valid JSON objects, lists are
-
-    if VERBOSE:
-        qprint(queries)
-
-    return queries
-
-
-def fetch_pageprops_revisions(queries):
-    # Get some of the missing information
-    # https://www.mediawiki.org/wiki/API:Pageprops
-    # https://www.mediawiki.org/wiki/API:Revisions
-    for name, obj in queries.items():
-        if "error" in obj:
-            continue
-
-        for lang, page in obj["langs"].items():
-            url_full = URL_INFOS.format(lang=lang)
-            params = {
-                "titles": page["name"],
-                "prop": "pageprops|revisions",
-                "rvlimit": 1,
-                "rvprop": "timestamp|user",
-                "rvdir": "newer",
-            }
-
-            results = s.get(url=url_full, params=params)
-            data = results.json()
+        if "backlinks" in page and isinstance(page["backlinks"], set):
+            page["backlinks"] = list(page["backlinks"])  # Sets are not valid JSON objects, lists are
+
+    @timed_stage
+    def fetch_backlinks(self, queries):
+        # Find the backlinks for each
+        # For important pages (looking at you, "École polytechnique fédérale de Lausanne"), can take some time!
+        # Set backlinks_limit to control that.
+        # https://www.mediawiki.org/wiki/API:Backlinks
+        # The continuation (blcontinue) is an opaque position, so the pages are followed concurrently rather than the
+        # parts of a page
+        run_concurrently(
+            [
+                partial(self.backlinks_of, lang, page)
+                for obj in queries.values()
+                if "error" not in obj
+                for lang, page in obj["langs"].items()
+                if "backlinks_count" not in page  # Already done from a local index
+            ],
+            self.workers,
+        )
+
+        if self.verbose:
+            qprint(queries)
+
+        return queries
+
+    @timed_stage
+    def fetch_pageprops_revisions(self, queries, props=("pageprops", "revisions")):
+        # Get some of the missing information
+        # https://www.mediawiki.org/wiki/API:Pageprops
+        # https://www.mediawiki.org/wiki/API:Revisions
+        # props: only ask for what is needed; the pid is always there ("info" if nothing else is asked)
+        for name, obj in queries.items():
+            if "error" in obj:
+                continue
 
-            if "query" in data and "pages" in data["query"]:
-                content = data["query"]["pages"]
-                pid = next(iter(content))
-                page["pid"] = int(pid)
-                content = content[pid]
-                if "pageprops" in content and "wikibase_item" in content["pageprops"]:
-                    page["pwikidata"] = content["pageprops"]["wikibase_item"]
-                else:
-                    page["pwikidata"] = None
-                page["creation"] = {
-                    "timestamp": content["revisions"][0]["timestamp"],
-                    "user": content["revisions"][0]["user"],
+            for lang, page in obj["langs"].items():
+                url_full = URL_INFOS.format(lang=lang)
+                params = {
+                    "titles": page["name"],
+                    "prop": "|".join(props) or "info",
                 }
-            else:
-                obj["error"] = "could not retrieve information (props)"
+                if "revisions" in props:
+                    params.update(
+                        {
+                            "rvlimit": 1,
+                            "rvprop": "timestamp|user",
+                            "rvdir": "newer",
+                        }
+                    )
 
-    if VERBOSE:
-        qprint(queries)
+                with failures_recorded(page, "fetch_pageprops_revisions"):
+                    results = self.session.get(url=url_full, params=params)
+                    data = results.json()
+
+                    if "query" in data and "pages" in data["query"]:
+                        content = data["query"]["pages"]
+                        pid = next(iter(content))
+                        page["pid"] = int(pid)
+                        content = content[pid]
+                        if "pageprops" in props:
+                            if "pageprops" in content and "wikibase_item" in content["pageprops"]:
+                                page["pwikidata"] = content["pageprops"]["wikibase_item"]
+                            else:
+                                page["pwikidata"] = None
+                        if "revisions" in props:
+                            page["creation"] = {
+                                "timestamp": content["revisions"][0]["timestamp"],
+                                "user": content["revisions"][0]["user"],
+                            }
+                    else:
+                        stage_failed(page, "fetch_pageprops_revisions", "could not retrieve information (props)")
 
-    return queries
+        if self.verbose:
+            qprint(queries)
 
+        return queries
 
-def fetch_contributors(queries, target_contributors=None):
-    # Contributors
-    # https://www.mediawiki.org/wiki/API:Contributors
-    for name, obj in queries.items():
-        if "error" in obj:
-            continue
+    def contributors_of(self, lang, page, target_contributors=None):
+        if not has_pid(page, "fetch_contributors"):
+            return
 
-        for lang, page in obj["langs"].items():
-            pccontinue = ""
-            pccounter = 0
-            url_full = URL_INFOS.format(lang=lang)
-            params = {
-                "titles": page["name"],
-                "prop": "contributors",
-                "pclimit": min(CONTRIBS_LIMIT, WIKI_LIMIT),
-            }
+        pccontinue = ""
+        pccounter = 0
+        url_full = URL_INFOS.format(lang=lang)
+        params = {
+            "titles": page["name"],
+            "prop": "contributors",
+            "pclimit": min(self.contribs_limit, WIKI_LIMIT),
+        }
 
-            while pccounter < CONTRIBS_LIMIT:
+        with failures_recorded(page, "fetch_contributors"):
+            while pccounter < self.contribs_limit:
                 if pccontinue != "":
                     params["pccontinue"] = pccontinue
 
-                results = s.get(url=url_full, params=params)
+                results = self.session.get(url=url_full, params=params)
                 data = results.json()
 
                 if "query" in data and "pages" in data["query"]:
                     pcdata = data["query"]["pages"][str(page["pid"])]
                 else:
-                    obj["error"] = "could not retrieve information (contributors)"
+                    stage_failed(page, "fetch_contributors", "could not retrieve information (contributors)")
                     break
 
                 if "contributors" not in page:
@@ -362,66 +943,120 @@ def fetch_contributors(queries, target_contributors=None):
 
                 if "continue" in data:
                     pccontinue = data["continue"]["pccontinue"]
+                    record_page()
                 else:
                     break
 
-            if "contributors" in page and isinstance(page["contributors"], set):
-                page["contributors"] = list(page["contributors"])  # Sets are not valid JSON objects, lists are
-
-    if VERBOSE:
-        qprint(queries)
-
-    return queries
-
+        if "contributors" in page and isinstance(page["contributors"], set):
+            page["contributors"] = list(page["contributors"])  # Sets are not valid JSON objects, lists are
+
+    @timed_stage
+    def fetch_contributors(self, queries, target_contributors=None):
+        # Contributors
+        # https://www.mediawiki.org/wiki/API:Contributors
+        # As for the backlinks, the continuation is opaque: the pages are followed concurrently
+        run_concurrently(
+            [
+                partial(self.contributors_of, lang, page, target_contributors)
+                for obj in queries.values()
+                if "error" not in obj
+                for lang, page in obj["langs"].items()
+            ],
+            self.workers,
+        )
+
+        if self.verbose:
+            qprint(queries)
+
+        return queries
+
+    def revisions_of(self, lang, page, start, end, max_requests=None):
+        """
+        Revisions of a page between start and end (ISO timestamps, start being the latest), newest first, following
+        the continuation.
+
+        :param max_requests: stop after that many requests
+        :return: (revisions as given by the API, whether all of them were fetched), or (None, False) on failure; no
+        revisions in the range is not a failure
+        """
+        url_full = URL_INFOS.format(lang=lang)
+        params = {
+            "titles": page["name"],
+            "prop": "revisions",
+            "rvprop": "ids|timestamp|user|size",
+            "rvstart": start,
+            "rvend": end,
+            "rvdir": "older",  # rvstart has to be later than rvend with that mode
+            "rvlimit": WIKI_LIMIT,
+        }
 
-def fetch_contributions(queries):
-    # Contributions
-    # https://www.mediawiki.org/wiki/API:Revisions
-    for name, obj in queries.items():
-        if "error" in obj:
-            continue
+        revisions = []
+        for nb_requests in itertools.count(1):
+            results = self.session.get(url=url_full, params=params)
+            data = results.json()
 
-        for lang, page in obj["langs"].items():
-            rvcontinue = ""
-            url_full = URL_INFOS.format(lang=lang)
-            params = {
-                "titles": page["name"],
-                "prop": "revisions",
-                "rvprop": "ids|timestamp|user|size",
-                "rvstart": obj["query"]["timestamp"],
-                "rvend": (
-                    datetime.datetime.fromisoformat(obj["query"]["timestamp"])
-                    - datetime.timedelta(days=obj["query"]["duration"])
-                ).isoformat(),
-                "rvdir": "older",  # rvstart has to be later than rvend with that mode
-                "rvlimit": WIKI_LIMIT,
-            }
+            if "query" in data and "pages" in data["query"]:
+                # No "revisions" when there are none in the range (a quiet sub-range of the window)
+                revisions += data["query"]["pages"].get(str(page["pid"]), {}).get("revisions", [])
+            else:
+                return None, False
+
+            if "continue" not in data:
+                return revisions, True
+            if nb_requests == max_requests:
+                return revisions, False
+
+            params["rvcontinue"] = data["continue"]["rvcontinue"]
+            record_page()
+
+    @timed_stage
+    def fetch_contributions(self, queries):
+        # Contributions
+        # https://www.mediawiki.org/wiki/API:Revisions
+        # The first request also measures the density of revisions: if there are more, the rest of the window is split
+        # into sub-ranges fetched concurrently, instead of one long chain of continuations
+        for name, obj in queries.items():
+            if "error" in obj:
+                continue
 
-            while True:
-                if rvcontinue != "":
-                    params["rvcontinue"] = rvcontinue
+            start = obj["query"]["timestamp"]
+            end = (
+                datetime.datetime.fromisoformat(obj["query"]["timestamp"])
+                - datetime.timedelta(days=obj["query"]["duration"])
+            ).isoformat()
+
+            for lang, page in obj["langs"].items():
+                if not has_pid(page, "fetch_contributions"):
+                    continue
+
+                with failures_recorded(page, "fetch_contributions"):
+                    # Sequentially, one chain is as fast and makes fewer requests
+                    revisions, complete = self.revisions_of(lang, page, start, end, 1 if self.workers > 1 else None)
+                    if revisions is not None and not complete:
+                        since = revisions[-1]["timestamp"] if revisions else start
+                        ranges = split_window(start, end, len(revisions), since, self.workers)
+                        for _ in ranges:  # Their first requests are more pages of the window
+                            record_page()
+                        parts = run_concurrently(
+                            [partial(self.revisions_of, lang, page, latest, earliest) for latest, earliest in ranges],
+                            self.workers,
+                        )
 
-                results = s.get(url=url_full, params=params)
-                data = results.json()
+                        # Stitched newest first; revisions on the bounds of the ranges come twice
+                        seen = {revision["revid"] for revision in revisions}
+                        for part, _ in parts:
+                            if part is None:
+                                revisions = None
+                                break
+                            revisions += [revision for revision in part if revision["revid"] not in seen]
+                            seen.update(revision["revid"] for revision in part)
 
-                if (
-                    "query" in data
-                    and "pages" in data["query"]
-                    and "revisions" in data["query"]["pages"][str(page["pid"])]
-                ):
-                    rvdata = data["query"]["pages"][str(page["pid"])]["revisions"]
-                else:
-                    obj["error"] = "could not retrieve information (contributions)"
-                    break
+                    if revisions is None:
+                        stage_failed(page, "fetch_contributions", "could not retrieve information (contributions)")
+                        continue
 
-                if "contributions" not in page:
                     page["contributions"] = {
-                        "items": [],
-                    }
-
-                if rvdata:
-                    for revision in rvdata:
-                        page["contributions"]["items"].append(
+                        "items": [
                             {
                                 "revid": revision["revid"],
                                 "parentid": revision["parentid"],
@@ -429,245 +1064,941 @@ def fetch_contributions(queries):
                                 "username": revision["user"],
                                 "size": revision["size"],
                             }
-                        )
+                            for revision in revisions
+                        ],
+                    }
 
-                if "continue" in data:
-                    rvcontinue = data["continue"]["rvcontinue"]
-                else:
-                    break
+        if self.verbose:
+            qprint(queries)
+
+        return queries
+
+    def pageviews_between(self, lang, name, start, end, missing_ok=False):
+        """
+        Views of a page from the API, between two dates (included), at the granularity of the client.
+
+        :param missing_ok: take a 404 (no data for these dates) as no views rather than as a failure
+        :return: {ISO timestamp: views}, or None on failure
+        """
+        url_full = URL_STATS.format(
+            lang=lang,
+            access=self.access,
+            agent=self.agent,
+            uri_article_name=wiki_quote(name),
+            granularity=self.granularity,
+            start=start.strftime("%Y%m%d00"),
+            end=end.strftime("%Y%m%d00"),
+        )
+
+        results = self.session.get(url=url_full)
+        data = results.json()
 
-    if VERBOSE:
-        qprint(queries)
+        if "items" in data:
+            return {
+                datetime.datetime.strptime(item["timestamp"], "%Y%m%d%H").isoformat(): item["views"]
+                for item in data["items"]
+            }
+        if missing_ok and results.status_code == 404:
+            return {}
+        return None
+
+    def stored_pageviews(self, lang, pid, name, start, end):
+        """
+        Daily views of a page between two dates (included), from the PageviewStore, after fetching the days it does
+        not have yet.
+
+        :return: {ISO timestamp: views}, or None on failure
+        """
+        store = self.pageview_store
+        for gap_start, gap_end in store.missing(lang, pid, self.access, self.agent, start.isoformat(), end.isoformat()):
+            # Short gaps are often the last days, that may not be published yet
+            views = self.pageviews_between(
+                lang, name, datetime.date.fromisoformat(gap_start), datetime.date.fromisoformat(gap_end), True
+            )
+            if views is None:
+                return None
+            store.put(
+                lang,
+                pid,
+                self.access,
+                self.agent,
+                {timestamp[:10]: count for timestamp, count in views.items()},
+                gap_start,
+                gap_end,
+            )
 
-    return queries
+        views = store.get(lang, pid, self.access, self.agent, start.isoformat(), end.isoformat())
+        return {f"{date}T00:00:00": count for date, count in views.items()}
 
+    @timed_stage
+    def fetch_pageviews(self, queries):
+        # Pageviews
+        # https://wikimedia.org/api/rest_v1/#/Pageviews%20data/get_metrics_pageviews_per_article__project___access___agent___article___granularity___start___end_
+        # Daily views of the pages whose id is known go through the PageviewStore: only the missing days are asked
+        for name, obj in queries.items():
+            if "error" in obj:
+                continue
 
-def fetch_pageviews(queries):
-    # Pageviews
-    # https://wikimedia.org/api/rest_v1/#/Pageviews%20data/get_metrics_pageviews_per_article__project___access___agent___article___granularity___start___end_
-    for name, obj in queries.items():
-        if "error" in obj:
-            continue
+            end = datetime.datetime.fromisoformat(obj["query"]["timestamp"])
+            start = end - datetime.timedelta(days=obj["query"]["duration"])
 
-        for lang, page in obj["langs"].items():
-            url_full = URL_STATS.format(
-                lang=lang,
-                access=ACCESS,
-                agent=AGENTS,
-                uri_article_name=wiki_quote(page["name"]),
-                granularity=GRANULARITY,
-                start=(
-                    datetime.datetime.fromisoformat(obj["query"]["timestamp"])
-                    - datetime.timedelta(days=obj["query"]["duration"])
-                ).strftime("%Y%m%d00"),
-                end=datetime.datetime.fromisoformat(obj["query"]["timestamp"]).strftime("%Y%m%d00"),
-            )
+            for lang, page in obj["langs"].items():
+                with failures_recorded(page, "fetch_pageviews"):
+                    pid = page_id(obj, lang, page)
+                    if self.pageview_store and pid is not None and self.granularity == "daily":
+                        views = self.stored_pageviews(lang, pid, page["name"], start.date(), end.date())
+                    else:
+                        views = self.pageviews_between(lang, page["name"], start, end)
 
-            results = s.get(url=url_full)
-            data = results.json()
+                    if views is None:
+                        stage_failed(page, "fetch_pageviews", "could not retrieve information (pageviews)")
+                        continue
 
-            if "items" in data:
-                if "pageviews" not in page:
                     page["pageviews"] = {
-                        "granularity": GRANULARITY,
-                        "access": ACCESS,
-                        "agent": AGENTS,
-                        "items": [],
+                        "granularity": self.granularity,
+                        "access": self.access,
+                        "agent": self.agent,
+                        "items": [{"timestamp": timestamp, "views": count} for timestamp, count in views.items()],
                     }
+                    page["pageviews_total"] = sum(views.values())
+
+        if self.verbose:
+            qprint(queries)
+
+        return queries
+
+    def compute_stats(self, extract, lang):
+        """
+        Compute the text stats and the readability scores of an extract.
+
+        :param extract: plain text of the article
+        :param lang: language of the article, for the language-specific scores
+        :return: (stats, readability)
+        """
+        with self.registry.timer("wikistats_textstat_seconds", lang=lang):
+            # _, _, num_words, _, num_sentences = stats(extract, lang)  # Legacy
+            stats = {
+                "num_words": self.textstat.lexicon_count(extract),
+                "num_sentences": self.textstat.sentence_count(extract),
+                "reading_time": self.textstat.reading_time(extract),
+            }
 
-                total_views = 0
-                for item in data["items"]:
-                    page["pageviews"]["items"].append(
-                        {
-                            "timestamp": datetime.datetime.strptime(item["timestamp"], "%Y%m%d%H").isoformat(),
-                            "views": item["views"],
-                        }
-                    )
-                    total_views += item["views"]
-                page["pageviews_total"] = total_views
-            else:
-                obj["error"] = "could not retrieve information (pageviews)"
-                continue
-
-    if VERBOSE:
-        qprint(queries)
+            # Using textstat
+            # Here, "min" means harder to read, while "max" means easier to read
+            # "minimum readability" vs. "maximum readability"
+            self.textstat.set_lang(lang)
+            readability = {
+                "fres": {
+                    "name": "Flesch Reading Ease Score",
+                    "link": "https://en.wikipedia.org/wiki/Flesch%E2%80%93Kincaid_readability_tests#Flesch_reading_ease",
+                    "result": self.textstat.flesch_reading_ease(extract),
+                    "min": 0,
+                    "max": 100,
+                }
+            }
 
-    return queries
+            if lang == "it":
+                readability["it_gi"] = {
+                    "name": "Gulpease Index",
+                    "link": "https://it.wikipedia.org/wiki/Indice_Gulpease",
+                    "result": self.textstat.gulpease_index(extract),
+                    "min": 0,
+                    "max": 100,
+                }
 
+            if lang == "de":
+                readability["de_ws"] = {
+                    "name": "Wiener Sachtextformel",
+                    "link": "https://de.wikipedia.org/wiki/Lesbarkeitsindex#Wiener_Sachtextformel",
+                    "result": self.textstat.wiener_sachtextformel(extract, 1),  # What are the variants?
+                    "min": 15,
+                    "max": 4,
+                }
 
-def fetch_text_and_stats(queries):
-    for name, obj in queries.items():
-        if "error" in obj:
-            continue
+            # Legacy
+            # page["readability"] = {
+            #     "fres": flesch(extract, lang),
+            #     "fkgl": flesch_kincaid(extract, lang),
+            #     "ari": automated_readability_index(extract, lang),
+            #     "smog": smog_grade(extract, lang),
+            #     "cli": coleman_liau_index(extract, lang),
+            #     "gfi": gunning_fog_index(extract, lang),
+            # }
+            # mean = 0
+            # for _, score in page["readability"].items():
+            #     mean += score
+            # page["readability"]["mean"] = mean / len(page["readability"])
+
+            return stats, readability
+
+    def fetch_lastrevids(self, queries):
+        """
+        Latest revision id of every page that does not have it yet, from batched info queries.
+        """
+        missing = {}
+        for obj in queries.values():
+            if "error" in obj:
+                continue
+            for lang, page in obj["langs"].items():
+                if "lastrevid" not in page:
+                    missing.setdefault(lang, {})[page["name"]] = page
 
-        for lang, page in obj["langs"].items():
-            excontinue = ""
+        for lang, pages in missing.items():
             url_full = URL_INFOS.format(lang=lang)
-            params = {
-                "titles": page["name"],
-                "prop": "extracts",
-                "explaintext": 1,
-                "exsectionformat": "plain",
-            }
+            names = sorted(pages)
+            for i in range(0, len(names), TITLES_LIMIT):
+                params = {
+                    "titles": "|".join(names[i : i + TITLES_LIMIT]),
+                    "prop": "info",
+                }
 
-            while True:
-                if excontinue != "":
-                    params["excontinue"] = excontinue
+                try:
+                    data = self.session.get(url=url_full, params=params).json()
+                except FETCH_ERRORS:  # Only an optimization: the text of these pages is fetched without the cache
+                    continue
 
-                results = s.get(url=url_full, params=params)
-                data = results.json()
+                if "query" in data and "pages" in data["query"]:
+                    for content in data["query"]["pages"].values():
+                        if content.get("title") in pages and "lastrevid" in content:
+                            pages[content["title"]]["lastrevid"] = content["lastrevid"]
+
+        return queries
+
+    @timed_stage
+    def fetch_text_and_stats(self, queries, cache=None):
+        # cache: ReadabilityCache to use, None for the default one, False to disable it
+        if cache is None:
+            cache = self.readability_cache
+        if cache:
+            self.fetch_lastrevids(queries)
+
+        for name, obj in queries.items():
+            if "error" in obj:
+                continue
 
-                if (
-                    "query" in data
-                    and "pages" in data["query"]
-                    and "extract" in data["query"]["pages"][str(page["pid"])]
-                ):
-                    exdata = data["query"]["pages"][str(page["pid"])]["extract"]
-                else:
-                    obj["error"] = "could not retrieve information (extract)"
-                    break
+            for lang, page in obj["langs"].items():
+                if cache and "lastrevid" in page and "pid" in page:
+                    cached = cache.get(lang, page["pid"], page["lastrevid"])
+                    # Not edited since last time; the text is downloaded again if it is kept but was not stored
+                    if cached is not None and (cached[2] is not None or self.extracts == "drop"):
+                        page["stats"], page["readability"], extract = cached
+                        if extract is not None:
+                            page["extract"] = extract
+                            slim_extract(page, self.extracts)
+                        continue
+                if not has_pid(page, "fetch_text_and_stats"):
+                    continue
+
+                excontinue = ""
+                url_full = URL_INFOS.format(lang=lang)
+                params = {
+                    "titles": page["name"],
+                    "prop": "extracts",
+                    "explaintext": 1,
+                    "exsectionformat": "plain",
+                }
 
-                if "extract" not in page:
-                    page["extract"] = ""
+                with failures_recorded(page, "fetch_text_and_stats"):
+                    while True:
+                        if excontinue != "":
+                            params["excontinue"] = excontinue
+
+                        results = self.session.get(url=url_full, params=params)
+                        data = results.json()
+
+                        if (
+                            "query" in data
+                            and "pages" in data["query"]
+                            and "extract" in data["query"]["pages"][str(page["pid"])]
+                        ):
+                            exdata = data["query"]["pages"][str(page["pid"])]["extract"]
+                        else:
+                            stage_failed(page, "fetch_text_and_stats", "could not retrieve information (extract)")
+                            break
+
+                        if "extract" not in page:
+                            page["extract"] = ""
+
+                        if exdata:
+                            page["extract"] += exdata
+
+                        if "continue" in data:
+                            excontinue = data["continue"]["excontinue"]
+                            record_page()
+                        else:
+                            break
+
+                if "fetch_text_and_stats" in page.get("errors", {}):
+                    page.pop("extract", None)  # No stats from a partial text
+
+                if "extract" in page and page["extract"]:
+                    page["stats"], page["readability"] = self.compute_stats(page["extract"], lang)
+                    if cache and "lastrevid" in page:
+                        cache.put(
+                            lang, page["pid"], page["lastrevid"], page["stats"], page["readability"], page["extract"]
+                        )
+                    slim_extract(page, self.extracts)
 
-                if exdata:
-                    page["extract"] += exdata
+        if self.verbose:
+            qprint(queries)
 
-                if "continue" in data:
-                    excontinue = data["continue"]["excontinue"]
-                else:
-                    break
+        return queries
 
-            if "extract" in page and page["extract"]:
-                # _, _, num_words, _, num_sentences = stats(page["extract"], lang)  # Legacy
-                page["stats"] = {
-                    "num_words": textstat.lexicon_count(page["extract"]),
-                    "num_sentences": textstat.sentence_count(page["extract"]),
-                    "reading_time": textstat.reading_time(page["extract"]),
-                }
+    @timed_stage
+    def fetch_page_assessments(self, queries):
+        for name, obj in queries.items():
+            if "error" in obj:
+                continue
 
-                # Using textstat
-                # Here, "min" means harder to read, while "max" means easier to read
-                # "minimum readability" vs. "maximum readability"
-                textstat.set_lang(lang)
-                page["readability"] = {
-                    "fres": {
-                        "name": "Flesch Reading Ease Score",
-                        "link": "https://en.wikipedia.org/wiki/Flesch%E2%80%93Kincaid_readability_tests#Flesch_reading_ease",
-                        "result": textstat.flesch_reading_ease(page["extract"]),
-                        "min": 0,
-                        "max": 100,
-                    }
+            for lang, page in obj["langs"].items():
+                if not has_pid(page, "fetch_page_assessments"):
+                    continue
+
+                url_full = URL_INFOS.format(lang=lang)
+                params = {
+                    "titles": page["name"],
+                    "prop": "pageassessments",
                 }
 
-                if lang == "it":
-                    page["readability"]["it_gi"] = {
-                        "name": "Gulpease Index",
-                        "link": "https://it.wikipedia.org/wiki/Indice_Gulpease",
-                        "result": textstat.gulpease_index(page["extract"]),
-                        "min": 0,
-                        "max": 100,
-                    }
+                with failures_recorded(page, "fetch_page_assessments"):
+                    results = self.session.get(url=url_full, params=params)
+                    data = results.json()
+
+                    if (
+                        "query" in data
+                        and "pages" in data["query"]
+                        and "pageassessments" in data["query"]["pages"][str(page["pid"])]
+                    ):
+                        page["pageassessments"] = data["query"]["pages"][str(page["pid"])]["pageassessments"]
+
+    @timed_stage
+    def count_revisions(self, queries):
+        """
+        Number of edits of each page, from the REST API (one light request per page and lang).
+
+        :return: {(lang, name): count}
+        """
+        counts = {}
+        for name, obj in queries.items():
+            if "error" in obj:
+                continue
 
-                if lang == "de":
-                    page["readability"]["de_ws"] = {
-                        "name": "Wiener Sachtextformel",
-                        "link": "https://de.wikipedia.org/wiki/Lesbarkeitsindex#Wiener_Sachtextformel",
-                        "result": textstat.wiener_sachtextformel(page["extract"], 1),  # What are the variants?
-                        "min": 15,
-                        "max": 4,
-                    }
+            for lang, page in obj["langs"].items():
+                try:
+                    data = self.session.get(
+                        url=URL_EDIT_COUNTS.format(lang=lang, uri_article_name=wiki_quote(page["name"])),
+                    ).json()
+                except FETCH_ERRORS:  # Only for the estimate, the default will do
+                    continue
+                counts[(lang, page["name"])] = data.get("count", DEFAULT_REVISIONS)
+
+        return counts
+
+    def estimate_cost(self, queries, revisions=None, resolution_requests=0, stages=None):
+        """
+        Estimate the number of requests and the time that each stage will take on resolved pages.
+        The numbers are upper bounds for the paginated stages (we stop at the limits).
+
+        :param queries: output of resolve_pages
+        :param revisions: {(lang, name): number of revisions}, from count_revisions; a default is used if missing
+        :param resolution_requests: requests already spent to resolve the pages
+        :param stages: stages that will run (see stages_for), all of them by default
+        :return: the plan, as a JSON-able dict
+        """
+        if revisions is None:
+            revisions = {}
+        if stages is None:
+            stages = STAGES
+
+        pages = [
+            (lang, page["name"])
+            for obj in queries.values()
+            if "error" not in obj
+            for lang, page in obj["langs"].items()
+        ]
+
+        def contributions(page):
+            nb_revisions = revisions.get(page, DEFAULT_REVISIONS)
+            if self.workers <= 1 or nb_revisions <= WIKI_LIMIT:
+                return max(1, ceil_div(nb_revisions, WIKI_LIMIT))
+            # The first request, then the sub-ranges of the rest (see split_window), one request each at least, plus
+            # their continuations; as many sub-ranges as allowed if the first request saw a burst of revisions
+            return 1 + RANGES_PER_WORKER * self.workers + ceil_div(nb_revisions - WIKI_LIMIT, WIKI_LIMIT)
+
+        # Latest revision ids asked in batches before the texts, for the pages that do not have them yet
+        lastrevids = 0
+        if self.readability_cache:
+            missing = Counter(
+                lang
+                for obj in queries.values()
+                if "error" not in obj
+                for lang, page in obj["langs"].items()
+                if "lastrevid" not in page
+            )
+            lastrevids = sum(ceil_div(nb_pages, TITLES_LIMIT) for nb_pages in missing.values())
+
+        per_page = {
+            "fetch_descriptions": lambda _: 1,
+            "fetch_backlinks": lambda _: ceil_div(self.backlinks_limit, min(self.backlinks_limit, WIKI_LIMIT)),
+            "fetch_pageprops_revisions": lambda _: 1,
+            "fetch_contributors": lambda _: ceil_div(self.contribs_limit, min(self.contribs_limit, WIKI_LIMIT)),
+            "fetch_contributions": contributions,
+            "fetch_pageviews": lambda _: 1,
+            "fetch_text_and_stats": lambda _: 1,
+            "fetch_page_assessments": lambda _: 1,
+        }
 
-                # Legacy
-                # page["readability"] = {
-                #     "fres": flesch(page["extract"], lang),
-                #     "fkgl": flesch_kincaid(page["extract"], lang),
-                #     "ari": automated_readability_index(page["extract"], lang),
-                #     "smog": smog_grade(page["extract"], lang),
-                #     "cli": coleman_liau_index(page["extract"], lang),
-                #     "gfi": gunning_fog_index(page["extract"], lang),
-                # }
-                # mean = 0
-                # for _, score in page["readability"].items():
-                #     mean += score
-                # page["readability"]["mean"] = mean / len(page["readability"])
+        plan = {
+            "articles": len([obj for obj in queries.values() if "error" not in obj]),
+            "not_found": len([obj for obj in queries.values() if "error" in obj]),
+            "pages": len(pages),
+            "stages": {},
+        }
+        for stage in ["resolve_pages"] + list(stages):
+            if stage == "resolve_pages":
+                nb_requests = resolution_requests
+            else:
+                nb_requests = sum(per_page[stage](page) for page in pages)
+            if stage == "fetch_text_and_stats":
+                nb_requests += lastrevids
+            latency = self.registry.mean(
+                "wikistats_http_request_seconds", DEFAULT_LATENCY, endpoint=STAGES_ENDPOINTS.get(stage, "api.php")
+            )
+            plan["stages"][stage] = {
+                "requests": nb_requests,
+                "seconds": nb_requests * latency,
+            }
 
-    if VERBOSE:
-        qprint(queries)
+        plan["requests"] = sum(stage["requests"] for stage in plan["stages"].values())
+        plan["seconds"] = sum(stage["seconds"] for stage in plan["stages"].values())
+        plan["budget"] = None
+        plan["skipped"] = []
+
+        return plan
+
+    def plan_from_wikipedia(self, target_links, target_langs=None, budget=None, revisions=True, fields=None):
+        """
+        Dry run: only resolve the pages, then estimate what a run would cost.
+
+        :param revisions: count the revisions of each page for a finer estimate of the contributions (one request per
+        page)
+        :param fields: fields or profile of the run (see stages_for)
+        """
+        if target_langs is None:
+            target_langs = DEFAULT_LANGS
+
+        stages, _ = stages_for(fields)
+        requests_made = self.session.requests_made
+        to_find = self.canonicalize(links_to_find(target_links, target_langs))
+        queries = self.resolve_pages(to_find, target_langs)
+        resolution_requests = self.session.requests_made - requests_made  # Canonicalization included
+        plan = self.estimate_cost(
+            queries,
+            self.count_revisions(queries) if revisions and "fetch_contributions" in stages else None,
+            resolution_requests=resolution_requests,
+            stages=stages,
+        )
+
+        return apply_budget(plan, budget)
+
+    def single_flight(self, stage, run, params):
+        """
+        Wrap a stage so that it only fetches the pages that no other run (in any process sharing the stage cache) has
+        fetched recently or is fetching: results are taken from the cache, or waited for.
+
+        :param run: the stage, as a function of queries
+        :param params: JSON-able settings the results depend on, part of the keys
+        """
+        fingerprint = hashlib.sha1(json.dumps(params).encode()).hexdigest()[:16]
+        owner = uuid.uuid4().hex
+
+        def run_coalesced(queries):
+            pending = {
+                f"{stage}|{lang}|{page['name']}|{fingerprint}": (name, lang, page)
+                for name, obj in queries.items()
+                if "error" not in obj
+                for lang, page in obj["langs"].items()
+            }
+            while pending:
+                for key, value in self.stage_cache.get_many(pending).items():
+                    pending.pop(key)[2].update(value)
+                if not pending:
+                    break
 
-    return queries
+                mine = self.stage_cache.acquire_many(pending, owner)
+                if not mine:  # Everything left is being fetched by other runs
+                    time.sleep(SINGLE_FLIGHT_POLL)
+                    continue
+
+                subset = {}
+                for key in mine:
+                    name, lang, page = pending[key]
+                    subset.setdefault(name, {"query": queries[name]["query"], "langs": {}})["langs"][lang] = page
+                try:
+                    run(subset)
+                except BaseException:  # Such as BudgetExceeded: let another run fetch them
+                    self.stage_cache.release_many(mine, owner)
+                    raise
+
+                results = {}
+                for key in mine:
+                    name, lang, page = pending.pop(key)
+                    if stage not in page.get("errors", {}):  # Failed ones are not shared, to be retried
+                        results[key] = {field: page[field] for field in STAGES_OUTPUTS[stage] if field in page}
+                self.stage_cache.put_many(results)
+                self.stage_cache.release_many(mine, owner)  # Waiters of failed ones will fetch them themselves
+
+            return queries
+
+        return run_coalesced
+
+    def get_from_wikipedia(
+        self, target_links, target_langs=None, target_contributors=None, budget=None, dump_files=None, fields=None
+    ):
+        """
+        Resolve the links, then run the stages on the resulting pages.
+        See get_from_to_find for the parameters.
+        """
+        if target_langs is None:
+            target_langs = DEFAULT_LANGS
+
+        to_find = links_to_find(target_links, target_langs)
+        return self.get_from_to_find(to_find, target_langs, target_contributors, budget, dump_files, fields)
+
+    def get_from_to_find(
+        self, to_find, target_langs=None, target_contributors=None, budget=None, dump_files=None, fields=None
+    ):
+        """
+        Resolve the pages of to_find (output of links_to_find), then run the stages on them.
+
+        :param budget: optional hard limit on the number of requests. Degradable stages are skipped up front if the
+        estimate does not fit, and the run stops (keeping what it has) if the budget is exhausted anyway. The pages it
+        could not even resolve have a "budget exceeded" error.
+        :param dump_files: local dump files to use instead of the API, as {"pageviews": [paths], "history": [paths],
+        "links": {lang: path of the index built by dumps.sql}}
+        :param fields: only run the stages needed for these fields, or profile (see FIELDS and PROFILES); all by default
+        """
+        if target_langs is None:
+            target_langs = DEFAULT_LANGS
+        needed, props = stages_for(fields)
+
+        self.session.budget, self.session.requests_made = budget, 0
+        try:
+            link_indexes = {lang: LinkIndex(path) for lang, path in ((dump_files or {}).get("links") or {}).items()}
+
+            to_find = self.canonicalize(to_find)
+            queries = self.resolve_pages(to_find, target_langs, link_indexes)
+
+            skipped = []
+            if budget is not None:
+                plan = apply_budget(
+                    self.estimate_cost(queries, resolution_requests=self.session.requests_made, stages=needed), budget
+                )
+                skipped = plan["skipped"]
+
+            stages = {stage: getattr(self, stage) for stage in STAGES}
+            stages["fetch_pageprops_revisions"] = lambda queries: self.fetch_pageprops_revisions(queries, props)
+            stages["fetch_contributors"] = lambda queries: self.fetch_contributors(queries, target_contributors)
+            local_stages = []  # From local files, not worth sharing
+            if dump_files and dump_files.get("pageviews"):
+                local_stages.append("fetch_pageviews")
+                stages["fetch_pageviews"] = lambda queries: fetch_pageviews_from_dumps(
+                    queries, dump_files["pageviews"], self.granularity, self.access
+                )
+            if dump_files and dump_files.get("history"):
+                # Contributions, contributors and creation at once, by whichever of the two stages runs first (only one
+                # of them may be needed)
+                local_stages += ["fetch_contributions", "fetch_contributors"]
+                history_read = []
+
+                def fetch_history(queries):
+                    if not history_read:
+                        history_read.append(True)
+                        fetch_history_from_dumps(queries, dump_files["history"], target_contributors)
+                    return queries
+
+                stages["fetch_contributions"] = stages["fetch_contributors"] = fetch_history
+            if link_indexes:
+                local_stages.append("fetch_backlinks")
+                stages["fetch_backlinks"] = lambda queries: self.fetch_backlinks(
+                    fetch_backlinks_from_index(queries, link_indexes)
+                )
+            if self.stage_cache:
+                # Everything the results depend on, besides the page itself
+                params = [
+                    self.duration,
+                    self.backlinks_limit,
+                    self.contribs_limit,
+                    self.granularity,
+                    self.access,
+                    self.agent,
+                    self.extracts,
+                    props,
+                    sorted(target_contributors or []),
+                    datetime.date.today().isoformat(),
+                ]
+                for stage in STAGES:
+                    if stage not in local_stages:
+                        stages[stage] = self.single_flight(stage, stages[stage], params)
+            with use_registry(self.registry):  # Also for the stages from the dumps
+                for stage in needed:
+                    if stage in skipped:
+                        continue
+                    try:
+                        stages[stage](queries)
+                    except BudgetExceeded:
+                        skipped += [left for left in needed[needed.index(stage) :] if left not in skipped]
+                        break
+        finally:
+            self.session.budget = None
+
+        if skipped:
+            for obj in queries.values():
+                if "error" not in obj:
+                    obj["query"]["skipped"] = skipped
+
+        return intern_strings(queries)
+
+    def retry_failed(self, queries, target_contributors=None, budget=None, fields=None):
+        """
+        Run the failed stages again (see stage_failed), on the pages they failed on only; everything else is kept.
+        Pages that fail again keep an error, and so do the ones left when the budget is exhausted.
+
+        :param fields: fields of the original run, for the props to ask again (see stages_for)
+        :return: queries, updated in place
+        """
+        _, props = stages_for(fields)
+        stages = {stage: getattr(self, stage) for stage in STAGES}
+        stages["fetch_pageprops_revisions"] = lambda queries: self.fetch_pageprops_revisions(queries, props)
+        stages["fetch_contributors"] = lambda queries: self.fetch_contributors(queries, target_contributors)
+
+        self.session.budget, self.session.requests_made = budget, 0
+        try:
+            with use_registry(self.registry):
+                # In order, so that the page ids are back before the stages that need them run again
+                for stage in STAGES:
+                    subset, previous = {}, {}
+                    for name, obj in queries.items():
+                        for lang, page in obj.get("langs", {}).items():
+                            if stage not in page.get("errors", {}):
+                                continue
+                            previous[(name, lang)] = page["errors"].pop(stage)
+                            for field in STAGES_OUTPUTS[stage]:  # Partial results, fetched again
+                                page.pop(field, None)
+                            subset.setdefault(name, {"query": obj["query"], "langs": {}})["langs"][lang] = page
+
+                    if not subset:
+                        continue
+                    try:
+                        stages[stage](subset)
+                    except BudgetExceeded:
+                        # Some pages may be done, but which ones cannot be told: they will all be retried next time
+                        for (name, lang), message in previous.items():
+                            queries[name]["langs"][lang].setdefault("errors", {}).setdefault(stage, message)
+                        break
+        finally:
+            self.session.budget = None
+
+        for obj in queries.values():
+            for page in obj.get("langs", {}).values():
+                if "errors" in page and not page["errors"]:
+                    del page["errors"]
+
+        return intern_strings(queries)
+
+
+# Module-level API, used by the scripts and the web app
+default_client = WikipediaClient()
+
+canonicalize = default_client.canonicalize
+info_batches = default_client.info_batches
+resolve_pages = default_client.resolve_pages
+fetch_descriptions = default_client.fetch_descriptions
+fetch_data = default_client.fetch_data
+fetch_backlinks = default_client.fetch_backlinks
+fetch_pageprops_revisions = default_client.fetch_pageprops_revisions
+fetch_contributors = default_client.fetch_contributors
+fetch_contributions = default_client.fetch_contributions
+fetch_pageviews = default_client.fetch_pageviews
+compute_stats = default_client.compute_stats
+fetch_lastrevids = default_client.fetch_lastrevids
+fetch_text_and_stats = default_client.fetch_text_and_stats
+fetch_page_assessments = default_client.fetch_page_assessments
+count_revisions = default_client.count_revisions
+estimate_cost = default_client.estimate_cost
+plan_from_wikipedia = default_client.plan_from_wikipedia
+get_from_wikipedia = default_client.get_from_wikipedia
+get_from_to_find = default_client.get_from_to_find
+retry_failed = default_client.retry_failed
+
+
+def __getattr__(name):
+    # s, the session of the default client, is created on first use
+    if name == "s":
+        return default_client.session
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def iter_links(stream, csv_format=False):
+    """
+    Lazily read the target links from a binary stream: one link or name per line (see example_input), or the first
+    column of a CSV file. Gzipped content is detected and decompressed on the fly.
+    Only a line (or CSV row) at a time is kept in memory.
+    """
+    stream = io.BufferedReader(stream) if not hasattr(stream, "peek") else stream
+    if stream.peek(2)[:2] == GZIP_MAGIC:
+        stream = gzip.GzipFile(fileobj=stream, mode="rb")
+    text = io.TextIOWrapper(stream, encoding="utf-8-sig", errors="replace", newline="")
 
+    if csv_format:
+        for row in csv.reader(text):
+            yield row[0].strip() if row else ""
+    else:
+        for line in text:
+            yield line.strip()
 
-def fetch_page_assessments(queries):
-    for name, obj in queries.items():
-        if "error" in obj:
-            continue
 
-        for lang, page in obj["langs"].items():
-            url_full = URL_INFOS.format(lang=lang)
-            params = {
-                "titles": page["name"],
-                "prop": "pageassessments",
-            }
+def read_links(path):
+    """
+    Lazily read the target links from a file (see iter_links), or from stdin with "-".
+    Files ending with .csv or .csv.gz are read as CSV.
+    """
+    if path == "-":
+        yield from iter_links(sys.stdin.buffer)
+        return
 
-            results = s.get(url=url_full, params=params)
-            data = results.json()
+    with open(path, "rb") as f:
+        yield from iter_links(f, csv_format=path.endswith((".csv", ".csv.gz")))
 
-            print(data)
 
-            if (
-                "query" in data
-                and "pages" in data["query"]
-                and "pageassessments" in data["query"]["pages"][str(page["pid"])]
-            ):
-                page["pageassessments"] = data["query"]["pages"][str(page["pid"])]["pageassessments"]
+def process_in_chunks(links, chunk_size=50, seen=None, client=None, **kwargs):
+    """
+    Process the links by chunks, fetching each chunk as soon as it is read, so that the input never has to be fully
+    in memory (nor fully read before the first requests go out).
+    Articles already returned by a previous chunk are dropped.
+
+    :param seen: names of the articles already processed; updated in place
+    :param client: WikipediaClient to use, default_client by default
+    :param kwargs: passed to get_from_to_find
+    :return: generator of (number of links in the chunk, [(name, obj), ...])
+    """
+    if seen is None:
+        seen = set()
+    if client is None:
+        client = default_client
+    target_langs = kwargs.pop("target_langs", None) or DEFAULT_LANGS
+
+    links = iter(links)
+    while True:
+        chunk = list(itertools.islice(links, chunk_size))
+        if not chunk:
+            break
+
+        queries = client.get_from_to_find(links_to_find(chunk, target_langs), target_langs, **kwargs)
+        records = []
+        for name, obj in queries.items():
+            names = {page["name"] for page in obj.get("langs", {}).values()} | {name}
+            if names & seen:
+                continue
+            if "error" not in obj:  # A page not found in one lang can still be found through another chunk
+                seen |= names
+            records.append((name, obj))
 
+        yield len(chunk), records
 
-def get_from_wikipedia(target_links, target_langs=None, target_contributors=None):
-    if target_langs is None:
-        target_langs = DEFAULT_LANGS
 
-    to_find = links_to_find(target_links, target_langs)
-    queries = fetch_data(to_find, target_langs)
-    fetch_backlinks(queries)
-    fetch_pageprops_revisions(queries)
-    fetch_contributors(queries, target_contributors)
-    fetch_contributions(queries)
-    fetch_pageviews(queries)
-    fetch_text_and_stats(queries)
-    fetch_page_assessments(queries)
+def load_checkpoint(path):
+    if path is None or not os.path.exists(path):
+        return {"input_lines": 0, "output_bytes": 0, "seen": []}
 
-    return queries
+    with open(path, encoding="utf8") as f:
+        return json.load(f)
 
 
-def main():
-    # Links are provided
-    target_links = [
-        "https://fr.wikipedia.org/wiki/Martin_Vetterli",
-        "https://en.wikipedia.org/wiki/%C3%89cole_Polytechnique_F%C3%A9d%C3%A9rale_de_Lausanne",
-        "https://en.wikipedia.org/wiki/Jean-Pierre_Hubaux",
-        "https://it.wikipedia.org/wiki/Jean-Michel_LErreur",
-        "https://fr.wikipedia.org/wiki/%C3%89cole_polytechnique_f%C3%A9d%C3%A9rale_de_Lausanne",
-        "it.wikipedia.org/wiki/Jean-Michel_LErreur",
-        "Michael_Grätzel",
-        "Patrick Aebischer",
-    ]
+def save_checkpoint(path, checkpoint):
+    # Write then rename, so that a crash never leaves a half-written checkpoint
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf8") as f:
+        json.dump(checkpoint, f, ensure_ascii=False)
+    os.replace(tmp, path)
 
-    # Chosen Langs
-    target_langs = ["en", "fr", "de"]
 
-    # Chosen contributors
-    target_contributors = []
+def run_batch(links, output, checkpoint_path=None, chunk_size=50, memory_report=False, **kwargs):
+    """
+    Process the links by chunks, and stream one NDJSON record per article to output as soon as its chunk is done.
+    With a checkpoint, an interrupted run resumes after the last completed chunk.
+
+    :param links: iterable of links or names
+    :param output: path of the NDJSON file ("-" for stdout, which cannot be resumed)
+    :param memory_report: print the memory taken by each chunk, per field (see footprint.memory_usage)
+    :param kwargs: passed to process_in_chunks
+    :return: number of articles written during this run
+    """
+    checkpoint = load_checkpoint(checkpoint_path)
+    seen = set(checkpoint["seen"])  # Names of articles already written, to deduplicate across chunks
+
+    if output == "-":
+        out = sys.stdout.buffer
+    else:
+        out = open(output, "ab")
+        # Drop whatever was written after the last checkpoint, it will be redone
+        out.truncate(checkpoint["output_bytes"])
+        out.seek(checkpoint["output_bytes"])
+
+    links = iter(links)
+    for _ in itertools.islice(links, checkpoint["input_lines"]):  # Already done
+        pass
+
+    written = 0
+    try:
+        for nb_links, records in process_in_chunks(links, chunk_size, seen, **kwargs):
+            if memory_report:
+                print(format_usage(memory_usage(dict(records))), file=sys.stderr)
+            for name, obj in records:
+                out.write(dumps({"name": name, **obj}) + b"\n")
+                written += 1
+            out.flush()
+
+            checkpoint["input_lines"] += nb_links
+            checkpoint["output_bytes"] = out.tell() if out is not sys.stdout.buffer else 0
+            checkpoint["seen"] = sorted(seen)
+            if checkpoint_path is not None:
+                save_checkpoint(checkpoint_path, checkpoint)
+
+            print(f"{checkpoint['input_lines']} lines done", file=sys.stderr)
+    finally:
+        if out is not sys.stdout.buffer:
+            out.close()
+
+    return written
+
+
+def retry_batch(path, chunk_size=50, client=None, **kwargs):
+    """
+    Run the failed stages again in an NDJSON output of run_batch, by chunks, and rewrite it (atomically).
 
-    # Length for the revisions, in days
-    target_duration = DEFAULT_DURATION
+    :param kwargs: passed to WikipediaClient.retry_failed
+    :return: (number of articles with failures before, after)
+    """
+    if client is None:
+        client = default_client
+
+    before = after = 0
+    tmp = f"{path}.tmp"
+    with open(path, "rb") as f, open(tmp, "wb") as out:
+        while True:
+            chunk = [loads(line) for line in itertools.islice(f, chunk_size)]
+            if not chunk:
+                break
+
+            queries = {record.pop("name"): record for record in chunk}
+            failed = {name: obj for name, obj in queries.items() if failed_stages(obj)}
+            if failed:
+                client.retry_failed(failed, **kwargs)
+            before += len(failed)
+            after += len([obj for obj in failed.values() if failed_stages(obj)])
 
-    queries = get_from_wikipedia(target_links, target_langs, target_contributors)
+            for name, obj in queries.items():
+                out.write(dumps({"name": name, **obj}) + b"\n")
+            print(f"{before} articles with failures retried, {after} still failing", file=sys.stderr)
+    os.replace(tmp, path)
 
-    import json
+    return before, after
 
-    with open("webapp/samples/results.json", "w", encoding="utf8") as f:
-        json.dump(queries, f, ensure_ascii=False, indent=4)
+
+def main():
+    parser = argparse.ArgumentParser(description="Fetch statistics about Wikipedia articles, as NDJSON.")
+    parser.add_argument(
+        "input", nargs="?", help="file with one link or name per line, a CSV file (first column), or - for stdin"
+    )
+    parser.add_argument("-o", "--output", default="-", help="NDJSON output file (default: stdout)")
+    parser.add_argument(
+        "-c", "--checkpoint", help="checkpoint file, to resume an interrupted run (default: OUTPUT.checkpoint)"
+    )
+    parser.add_argument("--chunk-size", type=int, default=50, help="number of input lines processed at once")
+    parser.add_argument("--langs", default=",".join(DEFAULT_LANGS), help="comma-separated target langs")
+    parser.add_argument("--contributors", help="comma-separated usernames to keep in the contributors")
+    parser.add_argument("--duration", type=int, default=DEFAULT_DURATION, help="length of the history, in days")
+    parser.add_argument("--budget", type=int, help="request budget per chunk")
+    parser.add_argument(
+        "--fields",
+        default="full",
+        help=f"profile ({', '.join(PROFILES)}) or comma-separated fields ({', '.join(FIELDS)}) to fetch",
+    )
+    parser.add_argument(
+        "--pageview-dumps", nargs="+", help="local pageview dump files, to use instead of the pageviews API"
+    )
+    parser.add_argument(
+        "--history-dumps", nargs="+", help="local stub-meta-history dump files, to use instead of the revisions API"
+    )
+    parser.add_argument(
+        "--link-index",
+        action="append",
+        default=[],
+        metavar="LANG=PATH",
+        help="local backlinks and langlinks index of a wiki, built with dumps.sql (can be repeated)",
+    )
+    parser.add_argument(
+        "--extracts",
+        choices=EXTRACTS,
+        default=EXTRACT_MODE,
+        help="keep, compress or drop the plain text of the articles once their stats are computed",
+    )
+    parser.add_argument(
+        "--workers", type=int, default=PAGINATION_WORKERS, help="continuation chains followed at once (1: sequential)"
+    )
+    parser.add_argument("--memory-report", action="store_true", help="print the memory taken by each chunk, per field")
+    parser.add_argument(
+        "--retry-failed",
+        action="store_true",
+        help="instead of fetching INPUT, run the stages that failed again in OUTPUT (rewritten)",
+    )
+    parser.add_argument("-v", "--verbose", action="store_true")
+    args = parser.parse_args()
+    if args.retry_failed and args.output == "-":
+        parser.error("--retry-failed needs an output file")
+    if not args.retry_failed and args.input is None:
+        parser.error("the input is required")
+
+    global VERBOSE
+    VERBOSE = args.verbose  # For links_to_find, which has no client
+
+    client = WikipediaClient(duration=args.duration, verbose=args.verbose, extracts=args.extracts, workers=args.workers)
+    fields = args.fields if args.fields in PROFILES else args.fields.split(",")
+    target_contributors = args.contributors.split(",") if args.contributors else None
+    if args.retry_failed:
+        retry_batch(
+            args.output,
+            args.chunk_size,
+            client,
+            target_contributors=target_contributors,
+            budget=args.budget,
+            fields=fields,
+        )
+        return
+
+    checkpoint = args.checkpoint
+    if checkpoint is None and args.output != "-":
+        checkpoint = f"{args.output}.checkpoint"
+
+    written = run_batch(
+        read_links(args.input),
+        args.output,
+        checkpoint,
+        chunk_size=args.chunk_size,
+        memory_report=args.memory_report,
+        client=client,
+        target_langs=args.langs.split(","),
+        target_contributors=target_contributors,
+        budget=args.budget,
+        fields=fields,
+        dump_files={
+            "pageviews": args.pageview_dumps,
+            "history": args.history_dumps,
+            "links": dict(link_index.split("=", 1) for link_index in args.link_index),
+        },
+    )
+    print(f"Done, {written} articles written", file=sys.stderr)
 
 
 if __name__ == "__main__":
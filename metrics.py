@@ -0,0 +1,221 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from urllib.parse import urlparse
+import threading
+import time
+
+
+# Default buckets, in seconds (same spirit as the Prometheus client defaults)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+# Which stage is currently running, so that HTTP calls can be attributed to it
+current_stage = ContextVar("current_stage", default="none")
+# Registry of the client currently running, None for the process-wide one
+current_registry = ContextVar("current_registry", default=None)
+
+
+def _labels_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(key, extra=None):
+    items = list(key) + (list(extra) if extra else [])
+    if not items:
+        return ""
+    inner = ",".join(f'{name}="{_escape(value)}"' for name, value in items)
+    return f"{{{inner}}}"
+
+
+class Registry:
+    """
+    Thread-safe store for counters and histograms, rendered in the Prometheus text format.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._help = {}
+        self._counters = {}  # name -> {labels_key: value}
+        self._histograms = {}  # name -> {labels_key: [bucket counts..., sum, count]}
+        self._buckets = {}
+
+    def describe(self, name, text):
+        self._help[name] = text
+
+    def inc(self, name, value=1, **labels):
+        key = _labels_key(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS, **labels):
+        key = _labels_key(labels)
+        with self._lock:
+            self._buckets.setdefault(name, buckets)
+            buckets = self._buckets[name]
+            series = self._histograms.setdefault(name, {})
+            if key not in series:
+                series[key] = [0] * len(buckets) + [0.0, 0]
+            values = series[key]
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    values[i] += 1
+            values[-2] += value
+            values[-1] += 1
+
+    @contextmanager
+    def timer(self, name, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def get(self, name, **labels):
+        """
+        Current value of a counter (mostly useful for debugging and reports).
+        """
+        with self._lock:
+            return self._counters.get(name, {}).get(_labels_key(labels), 0)
+
+    def mean(self, name, default=None, **labels):
+        """
+        Mean of the observations of a histogram, or default if nothing was observed yet.
+        """
+        with self._lock:
+            values = self._histograms.get(name, {}).get(_labels_key(labels))
+            if not values or not values[-1]:
+                return default
+            return values[-2] / values[-1]
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def render(self):
+        """
+        Prometheus text exposition format (version 0.0.4).
+        """
+        lines = []
+        with self._lock:
+            for name in sorted(self._counters):
+                if name in self._help:
+                    lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} counter")
+                for key, value in sorted(self._counters[name].items()):
+                    lines.append(f"{name}{_format_labels(key)} {value}")
+
+            for name in sorted(self._histograms):
+                buckets = self._buckets[name]
+                if name in self._help:
+                    lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} histogram")
+                for key, values in sorted(self._histograms[name].items()):
+                    for bound, count in zip(buckets, values):
+                        lines.append(f"{name}_bucket{_format_labels(key, [('le', bound)])} {count}")
+                    lines.append(f"{name}_bucket{_format_labels(key, [('le', '+Inf')])} {values[-1]}")
+                    lines.append(f"{name}_sum{_format_labels(key)} {values[-2]}")
+                    lines.append(f"{name}_count{_format_labels(key)} {values[-1]}")
+
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+registry.describe("wikistats_stage_seconds", "Time spent in each fetch_* stage.")
+registry.describe("wikistats_stage_runs_total", "Number of times each stage ran.")
+registry.describe("wikistats_http_request_seconds", "Latency of HTTP calls, per endpoint.")
+registry.describe("wikistats_http_requests_total", "HTTP calls, per endpoint, stage and status.")
+registry.describe("wikistats_http_retries_total", "Retries done by the HTTP adapter, per endpoint.")
+registry.describe("wikistats_http_response_bytes_total", "Bytes received, per endpoint.")
+registry.describe("wikistats_pages_paginated_total", "Continuation pages followed, per stage.")
+registry.describe("wikistats_cache_hits_total", "Cache hits, per cache.")
+registry.describe("wikistats_cache_misses_total", "Cache misses, per cache.")
+registry.describe("wikistats_textstat_seconds", "Time spent computing textstat metrics.")
+registry.describe("wikistats_dump_seconds", "Time spent parsing local dump files, per kind of dump.")
+registry.describe("wikistats_webapp_run_seconds", "Time taken by the runs started from the web app, per source.")
+
+
+def active_registry():
+    """
+    Registry to record into: the one of the running client if it has its own, the process-wide one otherwise.
+    """
+    return current_registry.get() or registry
+
+
+@contextmanager
+def use_registry(target):
+    """
+    Record into target (a Registry) in this context; None keeps the current one.
+    """
+    if target is None:
+        yield
+        return
+
+    token = current_registry.set(target)
+    try:
+        yield
+    finally:
+        current_registry.reset(token)
+
+
+def endpoint_of(url):
+    """
+    Low-cardinality name for a Wikimedia URL (no article names, no langs).
+    """
+    path = urlparse(url).path
+    if path.endswith("/api.php"):
+        return "api.php"
+    if "/page/summary/" in path:
+        return "rest/page/summary"
+    if "/metrics/pageviews/" in path:
+        return "rest/metrics/pageviews"
+    if "/export" in path:
+        return "export"
+    return "other"
+
+
+def record_request(url, seconds, status, size, retries=0):
+    endpoint = endpoint_of(url)
+    stage = current_stage.get()
+    registry = active_registry()
+    registry.observe("wikistats_http_request_seconds", seconds, endpoint=endpoint)
+    registry.inc("wikistats_http_requests_total", endpoint=endpoint, stage=stage, status=status)
+    registry.inc("wikistats_http_response_bytes_total", size, endpoint=endpoint)
+    if retries:
+        registry.inc("wikistats_http_retries_total", retries, endpoint=endpoint)
+
+
+def record_page(stage=None):
+    active_registry().inc("wikistats_pages_paginated_total", stage=stage or current_stage.get())
+
+
+def record_cache(cache, hit):
+    active_registry().inc("wikistats_cache_hits_total" if hit else "wikistats_cache_misses_total", cache=cache)
+
+
+def timed_stage(func):
+    """
+    Decorator for the fetch_* stages: time them, and tag the HTTP calls they make.
+    Methods of an object with its own registry attribute (a WikipediaClient) record into it.
+    """
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        owner = getattr(args[0], "registry", None) if args else None
+        with use_registry(owner if isinstance(owner, Registry) else None):
+            registry = active_registry()
+            token = current_stage.set(func.__name__)
+            try:
+                with registry.timer("wikistats_stage_seconds", stage=func.__name__):
+                    return func(*args, **kwargs)
+            finally:
+                registry.inc("wikistats_stage_runs_total", stage=func.__name__)
+                current_stage.reset(token)
+
+    return wrapper
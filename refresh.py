@@ -0,0 +1,243 @@
+"""
+Refresh service for a fixed list of tracked articles (a watchlist): keeps their results up to date within a request
+budget, and publishes them to the server-side store of the web app, where the dashboards load them at once
+(/?snapshot=NAME, "watchlist" by default).
+
+    python refresh.py watchlist.txt --budget 2000 --interval 3600    # a cycle every hour, until stopped
+    python refresh.py watchlist.txt --once                           # a single cycle
+
+At each cycle, the articles are refreshed by order of priority: the longest time since their last refresh, weighted by
+their edit rate and their page views, so that active and popular articles are refreshed more often. Articles are not
+refreshed more than once per MIN_AGE. The local caches make a refresh cheaper: titles are not resolved again, only the
+new days of pageviews are asked, and the text of an article is only downloaded again if it was edited. The revisions of
+the window are asked again in full. Data of the stages that failed or did not fit in the budget is carried over from
+the previous snapshot, and the articles removed from the watchlist are dropped from it.
+"""
+import argparse
+import copy
+import math
+import sys
+import time
+
+
+from cache import open_db
+from get_from_wikipedia import extract_lang_name, links_to_find, PROFILES, read_links, STAGES_OUTPUTS, WikipediaClient
+from webapp.store import load_results, publish, published
+from webapp.views import save_dataset
+
+
+MIN_AGE = 3600  # Seconds between two refreshes of an article, at least
+DEFAULT_REQUESTS = 30  # Assumed cost of an article never refreshed
+SNAPSHOT = "watchlist"
+
+
+class RefreshState:
+    """
+    When each article of the watchlist was last refreshed, and what it takes, to prioritize the next refreshes.
+    Kept in a SQLite database under the cache directory (see cache.py), so that a restart resumes where it stopped.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS articles (
+            link TEXT PRIMARY KEY,
+            refreshed REAL,
+            edits_per_day REAL NOT NULL,
+            views_per_day REAL NOT NULL,
+            requests REAL NOT NULL
+        );
+    """
+
+    def __init__(self, name="refresh", cache_dir=None):
+        self.name = name
+        self.cache_dir = cache_dir
+
+    def get_many(self, links):
+        """
+        :return: {link: {"refreshed", "edits_per_day", "views_per_day", "requests"}}, with defaults for the new links
+        (refreshed is None if never refreshed)
+        """
+        articles = {
+            link: {"refreshed": None, "edits_per_day": 0, "views_per_day": 0, "requests": DEFAULT_REQUESTS}
+            for link in links
+        }
+        with open_db(self.name, self.SCHEMA, self.cache_dir) as db:
+            rows = db.execute("SELECT link, refreshed, edits_per_day, views_per_day, requests FROM articles")
+            for link, *values in rows:
+                if link in articles:
+                    articles[link] = dict(zip(["refreshed", "edits_per_day", "views_per_day", "requests"], values))
+        return articles
+
+    def put_many(self, articles):
+        with open_db(self.name, self.SCHEMA, self.cache_dir) as db:
+            db.executemany(
+                "INSERT OR REPLACE INTO articles VALUES (?, ?, ?, ?, ?)",
+                [
+                    (link, obj["refreshed"], obj["edits_per_day"], obj["views_per_day"], obj["requests"])
+                    for link, obj in articles.items()
+                ],
+            )
+
+
+def priority(article, now):
+    """
+    :return: how urgent the refresh of an article is, 0 if it was refreshed less than MIN_AGE ago
+    """
+    if article["refreshed"] is None:
+        return math.inf
+    age = now - article["refreshed"]
+    if age < MIN_AGE:
+        return 0
+    # The log dampens the differences: a page with 1000x the views is refreshed about 3x more often, not 1000x
+    return age / 3600 * (1 + math.log1p(article["edits_per_day"]) + math.log1p(article["views_per_day"]) / 4)
+
+
+def plan_cycle(articles, budget, now=None):
+    """
+    :param articles: output of RefreshState.get_many
+    :return: links to refresh, most urgent first, as many as the estimated budget allows (at least one if any is due)
+    """
+    now = time.time() if now is None else now
+    priorities = {link: priority(article, now) for link, article in articles.items()}
+    due = sorted((link for link in articles if priorities[link] > 0), key=priorities.get, reverse=True)
+
+    planned, cost = [], 0
+    for link in due:
+        if planned and cost + articles[link]["requests"] > budget:
+            break
+        planned.append(link)
+        cost += articles[link]["requests"]
+    return planned
+
+
+def article_of(link, queries, index=None):
+    """
+    :param index: TitleIndex, to also recognize the article when the link is a redirect (or not normalized)
+    :return: name of the article of queries that a watchlist link resolved to, None if it cannot be told
+    """
+    name = extract_lang_name(link)[1] if "wikipedia.org" in link else link.strip()
+    names = {name.replace("_", " ")}
+    if index:
+        for lang, titles in links_to_find([link]).items():
+            names.update(title for title, _, _ in index.get_many(lang, titles).values())
+    for title, obj in queries.items():
+        if title in names or any(page["name"] in names for page in obj.get("langs", {}).values()):
+            return title
+    return None
+
+
+def carry_over(previous, obj):
+    """
+    Take the fields of the stages that failed on a page, or were skipped for the budget, from its previous results.
+    """
+    skipped = obj["query"].get("skipped", [])
+    for lang, page in obj.get("langs", {}).items():
+        old = previous.get("langs", {}).get(lang)
+        if old is None:
+            continue
+        for stage in list(page.get("errors", {})) + skipped:
+            for field in STAGES_OUTPUTS.get(stage, []):
+                if field in old and field not in page:
+                    page[field] = old[field]
+
+
+def run_cycle(links, state, snapshot, client, budget, fields=None, chunk_size=20):
+    """
+    Refresh the most urgent articles of the watchlist within budget, updating snapshot ({name: results}) in place.
+
+    :return: number of articles refreshed
+    """
+    articles = state.get_many(links)
+    planned = plan_cycle(articles, budget)
+
+    spent = refreshed = 0
+    for i in range(0, len(planned), chunk_size):
+        if spent >= budget:
+            break
+        chunk = planned[i : i + chunk_size]
+
+        queries = client.get_from_wikipedia(chunk, budget=budget - spent, fields=fields)
+        spent += client.session.requests_made
+        now = time.time()
+
+        for name, obj in queries.items():
+            if "error" in obj and name in snapshot:  # Not found this time: keep the last results
+                continue
+            if name in snapshot and "error" not in snapshot[name]:
+                carry_over(snapshot[name], obj)
+            snapshot[name] = obj
+
+        updated = {}
+        for link in chunk:
+            article = dict(articles[link], requests=client.session.requests_made / len(chunk))
+            obj = queries.get(article_of(link, queries, client.title_index))
+            if obj is not None and "error" not in obj:
+                duration = max(obj["query"]["duration"], 1)
+                pages = obj["langs"].values()
+                edits = sum(len(page.get("contributions", {}).get("items", [])) for page in pages)
+                article["edits_per_day"] = edits / duration
+                article["views_per_day"] = sum(page.get("pageviews_total", 0) for page in pages) / duration
+            if obj is None or not obj["query"].get("skipped"):  # Else, some of it is still to be done
+                article["refreshed"] = now
+                refreshed += 1
+            updated[link] = article
+        state.put_many(updated)
+
+    return refreshed
+
+
+def prune(snapshot, links, index=None):
+    """
+    Drop the articles of snapshot that no watchlist link resolves to anymore.
+
+    :param index: TitleIndex, see article_of
+    :return: number of articles dropped
+    """
+    kept = {article_of(link, snapshot, index) for link in links}
+    removed = [name for name in snapshot if name not in kept]
+    for name in removed:
+        del snapshot[name]
+    return len(removed)
+
+
+def load_snapshot(name):
+    """
+    :return: the latest results published under name, {} if there are none
+    """
+    try:
+        return copy.deepcopy(load_results(published(name)))  # Updated in place, and the store keeps it in memory
+    except KeyError:
+        return {}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Keep the results of a watchlist of articles up to date.")
+    parser.add_argument("watchlist", help="file with one link or name per line, or a CSV file (first column)")
+    parser.add_argument("--budget", type=int, default=2000, help="requests per cycle")
+    parser.add_argument("--interval", type=int, default=3600, help="seconds between the start of two cycles")
+    parser.add_argument("--once", action="store_true", help="run a single cycle")
+    parser.add_argument("--chunk-size", type=int, default=20, help="articles fetched at once")
+    parser.add_argument("--fields", default="full", help=f"profile ({', '.join(PROFILES)}) or comma-separated fields")
+    parser.add_argument("--snapshot", default=SNAPSHOT, help="name the results are published under")
+    args = parser.parse_args()
+
+    fields = args.fields if args.fields in PROFILES else args.fields.split(",")
+    state = RefreshState()
+    snapshot = load_snapshot(args.snapshot)
+    while True:
+        start = time.time()
+        links = [link for link in read_links(args.watchlist) if link]  # Re-read, so that it can be edited meanwhile
+
+        client = WikipediaClient()  # A client per cycle, with a fresh session
+        refreshed = run_cycle(links, state, snapshot, client, args.budget, fields, args.chunk_size)
+        removed = prune(snapshot, links, client.title_index)
+        if refreshed or removed:
+            publish(args.snapshot, save_dataset(snapshot))
+        print(f"{refreshed} articles refreshed, {removed} removed, {len(snapshot)} in the snapshot", file=sys.stderr)
+
+        if args.once:
+            break
+        time.sleep(max(0, args.interval - (time.time() - start)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,33 @@
+"""
+JSON serialization of the results, using orjson when it is installed (much faster on big results), json otherwise.
+Both backends produce UTF-8 bytes without ASCII escaping.
+"""
+import json
+
+
+try:
+    import orjson
+except ImportError:  # Optional
+    orjson = None
+
+
+BACKEND = "orjson" if orjson is not None else "json"
+
+
+def dumps(obj, indent=False):
+    """
+    Serialize to UTF-8 JSON bytes.
+
+    :param indent: pretty-print with two spaces (slower, bigger)
+    """
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else 0)
+
+    return json.dumps(obj, ensure_ascii=False, indent=2 if indent else None).encode("utf8")
+
+
+def loads(data):
+    if orjson is not None:
+        return orjson.loads(data)
+
+    return json.loads(data)
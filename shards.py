@@ -0,0 +1,257 @@
+"""
+Sharded execution: split the input links into shards, run them in separate processes (or on separate machines sharing
+a filesystem), and merge the shard outputs into one result set.
+
+Usage, on a shared directory:
+    python shards.py plan example_input --workdir /shared/run --shards 8
+    python shards.py run --workdir /shared/run            # on each machine, as many times as wanted
+    python shards.py merge --workdir /shared/run -o results.json
+
+Or, on a single machine: python shards.py all example_input --workdir run --shards 8 --workers 4 -o results.json
+"""
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import glob
+import hashlib
+import json
+import os
+import sys
+
+
+from get_from_wikipedia import (
+    DEFAULT_LANGS,
+    extract_lang_name,
+    get_from_to_find,
+    links_to_find,
+    merge_linked,
+    read_links,
+)
+from serialization import dumps, loads
+
+
+PLAN_FILE = "plan.json"
+SHARD_FILE = "shard-{index:05d}.json"
+OUTPUT_FILE = "shard-{index:05d}.ndjson"
+LOCK_FILE = "shard-{index:05d}.lock"
+
+
+def shard_key(link, nb_shards, by="hash"):
+    """
+    Stable shard index of an input link or name (Python's hash() is salted per process, so we do not use it).
+    """
+    if "wikipedia.org" in link:
+        lang, name = extract_lang_name(link)
+    else:  # Looked for in every target lang, by the shard it is in
+        lang, name = "*", link.strip()
+    key = lang if by == "lang" else f"{lang}:{name}"
+    return int(hashlib.sha1(key.encode("utf8")).hexdigest(), 16) % nb_shards
+
+
+def shard_links(target_links, nb_shards, by="hash"):
+    """
+    Split the input links into nb_shards lists. The links are split before links_to_find expands the names without a
+    lang to the target langs, so that each of them is resolved and fetched by a single shard, in all its langs.
+    Different links can still lead to the same article (the same page in two langs, a redirect): merge_queries drops
+    the duplicates.
+
+    :param by: "hash" spreads the links evenly; "lang" keeps the links of each language in a single shard (and the
+    names without a lang in one as well)
+    """
+    shards = [[] for _ in range(nb_shards)]
+    for link in target_links:
+        if link:
+            shards[shard_key(link, nb_shards, by)].append(link)
+
+    return shards
+
+
+def _write_atomic(path, content):
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(content.encode("utf8") if isinstance(content, str) else content)
+    os.replace(tmp, path)
+
+
+def plan_shards(target_links, workdir, nb_shards, by="hash", target_langs=None, target_contributors=None):
+    """
+    Write one input file per shard in workdir, as well as the parameters shared by all shards.
+    """
+    if target_langs is None:
+        target_langs = DEFAULT_LANGS
+
+    os.makedirs(workdir, exist_ok=True)
+    shards = shard_links(target_links, nb_shards, by)
+
+    for index, links in enumerate(shards):
+        content = {lang: sorted(names) for lang, names in links_to_find(links, target_langs).items()}
+        _write_atomic(os.path.join(workdir, SHARD_FILE.format(index=index)), json.dumps(content, ensure_ascii=False))
+
+    plan = {
+        "shards": nb_shards,
+        "by": by,
+        "target_langs": target_langs,
+        "target_contributors": target_contributors,
+    }
+    _write_atomic(os.path.join(workdir, PLAN_FILE), json.dumps(plan, ensure_ascii=False))
+
+    return plan
+
+
+def load_plan(workdir):
+    with open(os.path.join(workdir, PLAN_FILE), encoding="utf8") as f:
+        return json.load(f)
+
+
+def run_shard(workdir, index):
+    """
+    Process a single shard; its output is only visible (renamed) once complete.
+    """
+    plan = load_plan(workdir)
+    with open(os.path.join(workdir, SHARD_FILE.format(index=index)), encoding="utf8") as f:
+        to_find = {lang: set(names) for lang, names in json.load(f).items()}
+
+    queries = get_from_to_find(to_find, plan["target_langs"], plan["target_contributors"]) if to_find else {}
+
+    lines = [dumps({"name": name, **obj}) + b"\n" for name, obj in queries.items()]
+    _write_atomic(os.path.join(workdir, OUTPUT_FILE.format(index=index)), b"".join(lines))
+
+    return len(queries)
+
+
+def claim_shard(workdir):
+    """
+    Atomically claim the next shard that no one is working on, so that several machines can share the same workdir.
+    If a worker crashed, remove its lock file (or use "run --shard") to redo the shard.
+
+    :return: the index of the claimed shard, or None if there is nothing left
+    """
+    plan = load_plan(workdir)
+    for index in range(plan["shards"]):
+        if os.path.exists(os.path.join(workdir, OUTPUT_FILE.format(index=index))):
+            continue
+        try:
+            fd = os.open(os.path.join(workdir, LOCK_FILE.format(index=index)), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            continue
+        os.write(fd, f"{os.uname().nodename}:{os.getpid()}".encode())
+        os.close(fd)
+        return index
+
+    return None
+
+
+def run_worker(workdir):
+    """
+    Claim and process shards until there is none left.
+    """
+    done = 0
+    while (index := claim_shard(workdir)) is not None:
+        run_shard(workdir, index)
+        done += 1
+        print(f"Shard {index} done", file=sys.stderr)
+
+    return done
+
+
+def merge_queries(records):
+    """
+    Deterministically merge articles coming from several shards.
+    The same cross-language deduplication as in fetch_data is applied, on articles sorted by name, so that the result
+    does not depend on the number of shards nor on the order in which they finished.
+    A found article always wins over a "not found" one with the same name.
+    """
+    queries = {}
+    for name, obj in sorted(records, key=lambda record: (record[0], record[1]["query"].get("lang", ""))):
+        if name in queries and ("error" not in queries[name] or "error" in obj):
+            continue
+        queries[name] = obj
+
+    # Found articles first, so that an error does not shadow a page found through another lang
+    ordered = {name: obj for name, obj in queries.items() if "error" not in obj}
+    ordered.update({name: obj for name, obj in queries.items() if "error" in obj})
+
+    return merge_linked(ordered)
+
+
+def read_shard_outputs(workdir):
+    for path in sorted(glob.glob(os.path.join(workdir, "shard-*.ndjson"))):
+        with open(path, "rb") as f:
+            for line in f:
+                record = loads(line)
+                yield record.pop("name"), record
+
+
+def merge_shards(workdir, output=None):
+    plan = load_plan(workdir)
+    missing = [
+        index
+        for index in range(plan["shards"])
+        if not os.path.exists(os.path.join(workdir, OUTPUT_FILE.format(index=index)))
+    ]
+    if missing:
+        raise RuntimeError(f"shards not done yet: {missing}")
+
+    queries = merge_queries(read_shard_outputs(workdir))
+
+    if output is not None:
+        with open(output, "wb") as f:
+            f.write(dumps(queries))
+
+    return queries
+
+
+def run_sharded(target_links, workdir, nb_shards, nb_workers=None, by="hash", **kwargs):
+    """
+    Plan, run every shard in a pool of worker processes, and merge.
+    """
+    plan_shards(target_links, workdir, nb_shards, by, **kwargs)
+    with ProcessPoolExecutor(max_workers=nb_workers) as executor:
+        list(executor.map(run_worker, [workdir] * (nb_workers or os.cpu_count() or 1)))
+
+    return merge_shards(workdir)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sharded execution of get_from_wikipedia.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    for command in ["plan", "all"]:
+        sub = subparsers.add_parser(command)
+        sub.add_argument("input", help="file with one link or name per line, a CSV file, or - for stdin")
+        sub.add_argument("--shards", type=int, required=True)
+        sub.add_argument("--by", choices=["hash", "lang"], default="hash")
+        sub.add_argument("--langs", default=",".join(DEFAULT_LANGS), help="comma-separated target langs")
+        sub.add_argument("--contributors", help="comma-separated usernames to keep in the contributors")
+    subparsers.choices["all"].add_argument("--workers", type=int)
+    subparsers.add_parser("run").add_argument("--shard", type=int, help="run this shard only (default: claim shards)")
+    subparsers.add_parser("merge")
+
+    for sub in subparsers.choices.values():
+        sub.add_argument("--workdir", required=True, help="directory shared by all the workers")
+    for command in ["all", "merge"]:
+        subparsers.choices[command].add_argument("-o", "--output", required=True, help="merged JSON output")
+
+    args = parser.parse_args()
+
+    if args.command in ["plan", "all"]:
+        kwargs = {
+            "target_langs": args.langs.split(","),
+            "target_contributors": args.contributors.split(",") if args.contributors else None,
+        }
+        if args.command == "plan":
+            plan_shards(read_links(args.input), args.workdir, args.shards, args.by, **kwargs)
+        else:
+            queries = run_sharded(read_links(args.input), args.workdir, args.shards, args.workers, args.by, **kwargs)
+            with open(args.output, "wb") as f:
+                f.write(dumps(queries))
+    elif args.command == "run":
+        if args.shard is not None:
+            run_shard(args.workdir, args.shard)
+        else:
+            run_worker(args.workdir)
+    elif args.command == "merge":
+        merge_shards(args.workdir, args.output)
+
+
+if __name__ == "__main__":
+    main()
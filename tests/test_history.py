@@ -0,0 +1,95 @@
+import gzip
+
+
+import pytest
+
+
+from dumps.history import fetch_history_from_dumps, parse_history
+
+
+HISTORY = """<mediawiki xmlns="http://www.mediawiki.org/xml/export-0.10/">
+  <page>
+    <title>Tracked</title>
+    <ns>0</ns>
+    <id>1</id>
+    <revision>
+      <id>10</id>
+      <timestamp>2023-01-01T00:00:00Z</timestamp>
+      <contributor deleted="deleted" />
+      <text bytes="100" />
+    </revision>
+    <revision>
+      <id>11</id>
+      <parentid>10</parentid>
+      <timestamp>2023-06-01T00:00:00Z</timestamp>
+      <contributor>
+        <ip>192.0.2.1</ip>
+      </contributor>
+      <text bytes="120" />
+    </revision>
+    <revision>
+      <id>12</id>
+      <parentid>11</parentid>
+      <timestamp>2023-07-01T00:00:00Z</timestamp>
+      <contributor>
+        <username>Alice</username>
+        <id>42</id>
+      </contributor>
+      <text bytes="150" />
+    </revision>
+  </page>
+  <page>
+    <title>Untracked</title>
+    <ns>0</ns>
+    <id>2</id>
+    <revision>
+      <id>20</id>
+      <timestamp>2023-01-01T00:00:00Z</timestamp>
+      <contributor>
+        <username>Bob</username>
+        <id>43</id>
+      </contributor>
+      <text bytes="10" />
+    </revision>
+  </page>
+</mediawiki>
+"""
+
+
+@pytest.fixture
+def history_dump(tmp_path):
+    path = tmp_path / "enwiki-20230801-stub-meta-history.xml.gz"
+    with gzip.open(path, "wt", encoding="utf8") as f:
+        f.write(HISTORY)
+    return str(path)
+
+
+def test_parse_history_deleted_and_ip_contributors(history_dump):
+    revisions = list(parse_history(history_dump, {1}))
+
+    assert [(page_id, revision["revid"], anonymous) for page_id, revision, anonymous in revisions] == [
+        (1, 10, False),
+        (1, 11, True),
+        (1, 12, False),
+    ]
+    deleted, ip, named = (revision for _, revision, _ in revisions)
+    assert deleted == {"revid": 10, "parentid": 0, "timestamp": "2023-01-01T00:00:00Z", "username": None, "size": 100}
+    assert ip["username"] == "192.0.2.1"
+    assert named["username"] == "Alice"  # Not the <id> of the contributor
+    assert named["revid"] == 12
+
+
+def test_fetch_history_from_dumps_keeps_named_contributors_only(history_dump):
+    queries = {
+        "Tracked": {
+            "query": {"lang": "en", "pid": 1, "timestamp": "2023-08-01T00:00:00", "duration": 365},
+            "langs": {"en": {"name": "Tracked", "pid": 1}},
+        },
+        "Missing": {"query": {"lang": "en"}, "error": "not found"},
+    }
+
+    page = fetch_history_from_dumps(queries, [history_dump])["Tracked"]["langs"]["en"]
+
+    assert page["creation"] == {"timestamp": "2023-01-01T00:00:00Z", "user": None}
+    assert page["contributors"] == ["Alice"]
+    assert [revision["revid"] for revision in page["contributions"]["items"]] == [12, 11, 10]
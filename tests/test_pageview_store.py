@@ -0,0 +1,80 @@
+import datetime
+
+
+import pytest
+
+
+from cache import open_db, PAGEVIEWS_SETTLE_DAYS, PageviewStore
+
+
+PAGE = ("en", 1, "all-access", "user")
+
+
+@pytest.fixture
+def store(tmp_path):
+    return PageviewStore(cache_dir=str(tmp_path))
+
+
+def fetched(store):
+    with open_db(store.name, store.SCHEMA, store.cache_dir) as db:
+        return db.execute("SELECT start, end FROM fetched ORDER BY start").fetchall()
+
+
+def test_missing_when_empty(store):
+    assert store.missing(*PAGE, "2023-01-01", "2023-01-31") == [("2023-01-01", "2023-01-31")]
+
+
+def test_missing_around_fetched_ranges(store):
+    store.put(*PAGE, {"2023-01-05": 3}, "2023-01-05", "2023-01-10")
+    store.put(*PAGE, {}, "2023-01-20", "2023-01-25")  # No views on these days, still fetched
+
+    assert store.missing(*PAGE, "2023-01-01", "2023-01-31") == [
+        ("2023-01-01", "2023-01-04"),
+        ("2023-01-11", "2023-01-19"),
+        ("2023-01-26", "2023-01-31"),
+    ]
+    assert store.missing(*PAGE, "2023-01-06", "2023-01-09") == []
+
+
+def test_put_merges_adjacent_ranges(store):
+    store.put(*PAGE, {"2023-01-01": 1}, "2023-01-01", "2023-01-10")
+    store.put(*PAGE, {"2023-01-11": 2}, "2023-01-11", "2023-01-20")
+
+    assert fetched(store) == [("2023-01-01", "2023-01-20")]
+    assert store.get(*PAGE) == {"2023-01-01": 1, "2023-01-11": 2}
+
+
+def test_put_merges_the_ranges_it_bridges(store):
+    store.put(*PAGE, {}, "2023-01-01", "2023-01-10")
+    store.put(*PAGE, {}, "2023-01-21", "2023-01-31")
+    store.put(*PAGE, {}, "2023-02-15", "2023-02-20")
+    assert len(fetched(store)) == 3
+
+    store.put(*PAGE, {}, "2023-01-08", "2023-01-20")  # Overlaps the first, adjacent to the second
+
+    assert fetched(store) == [("2023-01-01", "2023-01-31"), ("2023-02-15", "2023-02-20")]
+    assert store.missing(*PAGE, "2023-01-01", "2023-02-28") == [
+        ("2023-02-01", "2023-02-14"),
+        ("2023-02-21", "2023-02-28"),
+    ]
+
+
+def test_put_ranges_of_other_pages_not_merged(store):
+    store.put(*PAGE, {}, "2023-01-01", "2023-01-10")
+    store.put("fr", 1, "all-access", "user", {}, "2023-01-11", "2023-01-20")
+
+    assert store.missing(*PAGE, "2023-01-01", "2023-01-20") == [("2023-01-11", "2023-01-20")]
+
+
+def test_put_recent_days_asked_again(store):
+    today = datetime.date.today()
+    start = (today - datetime.timedelta(days=10)).isoformat()
+    settled = (today - datetime.timedelta(days=PAGEVIEWS_SETTLE_DAYS)).isoformat()
+
+    store.put(*PAGE, {today.isoformat(): 5}, start, today.isoformat())
+
+    assert fetched(store) == [(start, settled)]
+    assert store.missing(*PAGE, start, today.isoformat()) == [
+        ((today - datetime.timedelta(days=PAGEVIEWS_SETTLE_DAYS - 1)).isoformat(), today.isoformat())
+    ]
+    assert store.get(*PAGE) == {today.isoformat(): 5}  # Kept meanwhile
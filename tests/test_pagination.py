@@ -0,0 +1,113 @@
+import datetime
+
+
+import pytest
+
+
+from get_from_wikipedia import parse_timestamp, RANGES_PER_WORKER, split_window, WIKI_LIMIT, WikipediaClient
+from metrics import Registry
+
+
+NOW = datetime.datetime(2024, 1, 1)
+DURATION = 365
+
+
+class FakeResponse:
+    def __init__(self, data):
+        self.data = data
+
+    def json(self):
+        return self.data
+
+
+class FakeSession:
+    """
+    Answers the revisions queries of a single page (pid 1) from a list of revisions, newest first, as the API does.
+    """
+
+    budget = None
+    registry = None
+
+    def __init__(self, revisions):
+        self.revisions = revisions
+        self.requests_made = 0
+
+    def get(self, url, params):
+        self.requests_made += 1
+        latest, earliest = parse_timestamp(params["rvstart"]), parse_timestamp(params["rvend"])
+        selected = [r for r in self.revisions if earliest <= parse_timestamp(r["timestamp"]) <= latest]
+        offset = int(params.get("rvcontinue", 0))
+        page = {"pageid": 1, "title": "Page"}
+        if selected[offset : offset + WIKI_LIMIT]:
+            page["revisions"] = selected[offset : offset + WIKI_LIMIT]
+        data = {"query": {"pages": {"1": page}}}
+        if offset + WIKI_LIMIT < len(selected):
+            data["continue"] = {"rvcontinue": str(offset + WIKI_LIMIT)}
+        return FakeResponse(data)
+
+
+def revision(revid, timestamp):
+    return {"revid": revid, "parentid": revid - 1, "timestamp": f"{timestamp.isoformat()}Z", "user": "User", "size": 1}
+
+
+@pytest.fixture
+def revisions():
+    """
+    An edit every 3 hours over the window, plus one on each bound of the sub-ranges the window will be split into.
+    """
+    revisions = [revision(100_000 - i, NOW - datetime.timedelta(hours=3 * i)) for i in range(DURATION * 8)]
+    since = revisions[WIKI_LIMIT - 1]["timestamp"]
+    end = (NOW - datetime.timedelta(days=DURATION)).isoformat()
+    ranges = split_window(NOW.isoformat(), end, WIKI_LIMIT, since, workers=4)
+    for i, (latest, _) in enumerate(ranges[1:]):
+        revisions.append(revision(i + 1, parse_timestamp(latest)))
+    revisions.sort(key=lambda r: parse_timestamp(r["timestamp"]), reverse=True)
+    return revisions
+
+
+def contributions(revisions, workers):
+    session = FakeSession(revisions)
+    client = WikipediaClient(
+        session=session,
+        workers=workers,
+        registry=Registry(),
+        title_index=False,
+        readability_cache=False,
+        stage_cache=False,
+        pageview_store=False,
+    )
+    queries = {
+        "Page": {
+            "query": {"lang": "en", "pid": 1, "timestamp": NOW.isoformat(), "duration": DURATION},
+            "langs": {"en": {"name": "Page", "pid": 1}},
+        }
+    }
+    return client.fetch_contributions(queries)["Page"]["langs"]["en"], session.requests_made
+
+
+def test_split_window_covers_the_rest_of_the_window():
+    ranges = split_window("2024-01-01T00:00:00", "2023-01-01T00:00:00", 500, "2023-12-01T00:00:00", workers=2)
+
+    assert len(ranges) == RANGES_PER_WORKER * 2  # 500 revisions a month, far more than 8 requests for the rest
+    assert ranges[0][0] == "2023-12-01T00:00:00"
+    assert ranges[-1][1] == "2023-01-01T00:00:00"
+    for (_, earliest), (latest, _) in zip(ranges, ranges[1:]):
+        assert earliest == latest  # Contiguous, the bound being in both
+
+
+def test_split_window_one_range_at_least():
+    # About 50 more revisions expected in the last month
+    ranges = split_window("2024-01-01T00:00:00", "2023-01-01T00:00:00", 500, "2023-02-01T00:00:00", workers=4)
+
+    assert ranges == [("2023-02-01T00:00:00", "2023-01-01T00:00:00")]
+
+
+def test_stitched_revisions_without_duplicates(revisions):
+    sequential, _ = contributions(revisions, workers=1)
+    concurrent, requests_made = contributions(revisions, workers=4)
+
+    revids = [item["revid"] for item in concurrent["contributions"]["items"]]
+    assert "errors" not in concurrent
+    assert len(revids) == len(set(revids)) == len(revisions)
+    assert concurrent["contributions"] == sequential["contributions"]
+    assert requests_made > len(revisions) // WIKI_LIMIT  # The sub-ranges were fetched
@@ -0,0 +1,67 @@
+import gzip
+
+
+import pytest
+
+
+from dumps.sql import build_index, iter_rows, LinkIndex
+
+
+PAGE = r"""-- MySQL dump
+INSERT INTO `page` VALUES (1,0,'Rock_(band)',0,0.5,NULL),(2,0,'It\'s_(a),_test',0,0.1,NULL),(3,0,'Back\\slash\'s',0,0,NULL);
+INSERT INTO `page` VALUES (4,0,'Linker_\"one\"',0,0,NULL),(5,1,'Rock_(band)',0,0,NULL);
+"""
+LINKTARGET = r"""INSERT INTO `linktarget` VALUES (100,0,'Rock_(band)'),(101,0,'It\'s_(a),_test');
+"""
+PAGELINKS = r"""INSERT INTO `pagelinks` VALUES (2,0,100),(4,0,100),(3,0,101);
+"""
+LANGLINKS = r"""INSERT INTO `langlinks` VALUES (1,'fr','Rock (groupe)'),(2,'de','Es ist (ein), \'Test\'');
+"""
+
+
+@pytest.fixture
+def dumps(tmp_path):
+    paths = {}
+    for table, content in [("page", PAGE), ("linktarget", LINKTARGET), ("pagelinks", PAGELINKS)]:
+        paths[table] = str(tmp_path / f"enwiki-latest-{table}.sql.gz")
+        with gzip.open(paths[table], "wt", encoding="utf8") as f:
+            f.write(content)
+    paths["langlinks"] = str(tmp_path / "enwiki-latest-langlinks.sql")  # Not gzipped
+    with open(paths["langlinks"], "w", encoding="utf8") as f:
+        f.write(LANGLINKS)
+    return paths
+
+
+def test_iter_rows_quotes_and_parentheses_in_strings(dumps):
+    assert list(iter_rows(dumps["page"], "page")) == [
+        (1, 0, "Rock_(band)", 0, 0.5, None),
+        (2, 0, "It's_(a),_test", 0, 0.1, None),
+        (3, 0, "Back\\slash's", 0, 0, None),
+        (4, 0, 'Linker_"one"', 0, 0, None),
+        (5, 1, "Rock_(band)", 0, 0, None),
+    ]
+    assert list(iter_rows(dumps["langlinks"], "langlinks")) == [
+        (1, "fr", "Rock (groupe)"),
+        (2, "de", "Es ist (ein), 'Test'"),
+    ]
+
+
+def test_iter_rows_other_tables_ignored(dumps):
+    assert list(iter_rows(dumps["page"], "linktarget")) == []
+
+
+def test_build_index(dumps, tmp_path):
+    output = str(tmp_path / "enwiki.sqlite3")
+    build_index(output, **dumps)
+    index = LinkIndex(output)
+
+    ids = index.page_ids(["Rock (band)", "It's (a), test", "Missing"])
+    assert ids == {"Rock (band)": 1, "It's (a), test": 2}
+
+    backlinks = index.backlinks([1, 2, 3])
+    assert backlinks[1][0] == 2
+    assert sorted(backlinks[1][1]) == ["It's (a), test", 'Linker "one"']
+    assert backlinks[2] == (1, ["Back\\slash's"])
+    assert backlinks[3] == (0, [])
+
+    assert index.langlinks([1, 2, 3]) == {1: {"fr": "Rock (groupe)"}, 2: {"de": "Es ist (ein), 'Test'"}, 3: {}}
@@ -1,8 +1,21 @@
+import os
+
+
 from dash import Dash, dcc, html
+from flask import abort, jsonify, redirect, request, Response
 import dash
 import dash_bootstrap_components as dbc
 
 
+from get_from_wikipedia import iter_links, process_in_chunks, PROFILES, WikipediaClient
+from metrics import registry
+from webapp.store import iter_results_gz, results_path
+from webapp.views import save_dataset
+
+
+UPLOAD_CHUNK_SIZE = 200
+
+
 app = Dash(
     __name__,
     external_stylesheets=[dbc.themes.BOOTSTRAP],
@@ -12,7 +25,8 @@ app = Dash(
 
 app.layout = dbc.Container(
     [
-        dcc.Store(id="data", storage_type="session"),
+        # Key of the results in the server-side store (see webapp.store): the results themselves stay on the server
+        dcc.Store(id="dataset-id", storage_type="session"),
         dcc.Location(id="url", refresh=True),
         dcc.Download(id="download"),
         # Header
@@ -39,6 +53,63 @@ app.layout = dbc.Container(
     ]
 )
 
+
+@app.server.route("/metrics")
+def metrics():
+    # Prometheus scraping endpoint
+    return Response(registry.render(), mimetype="text/plain; version=0.0.4; charset=utf-8")
+
+
+@app.server.route("/download/<dataset_id>")
+def download(dataset_id):
+    # Streamed, already gzipped on disk
+    try:
+        if not os.path.exists(results_path(dataset_id)):
+            abort(404)
+    except KeyError:
+        abort(404)
+
+    return Response(
+        iter_results_gz(dataset_id),
+        mimetype="application/gzip",
+        headers={"Content-Disposition": f'attachment; filename="wikipedia-analysor-{dataset_id}.json.gz"'},
+    )
+
+
+@app.server.route("/upload", methods=["POST"])
+def upload():
+    """
+    Streaming ingestion of (very) large input lists: text, CSV or gzipped, parsed line by line.
+    Each chunk of lines is fetched as soon as it is read. There is no cost estimate to confirm (it would resolve the
+    whole list first): the optional budget applies to each chunk.
+    Either a form with a "file" field (then redirects to the load page), or the raw file as the body of the request:
+    curl --data-binary @list.csv.gz "https://.../upload?filename=list.csv.gz" (then answers with the dataset id).
+    Only the latter is read as it arrives: Werkzeug spools a multipart form to a temporary file before we get it.
+    """
+    if "file" in request.files:
+        file = request.files["file"]
+        stream, filename = file.stream, file.filename or ""
+    else:  # Not parsed by Flask, read as it arrives
+        stream, filename = request.stream, request.args.get("filename", "")
+    csv_format = filename.endswith((".csv", ".csv.gz")) or request.mimetype == "text/csv"
+    budget = request.values.get("budget", type=int)
+    fields = request.values.get("fields", "full")
+    if fields not in PROFILES:
+        abort(400, f"unknown profile: {fields}")
+
+    queries = {}
+    with registry.timer("wikistats_webapp_run_seconds", source="upload"):
+        for _, records in process_in_chunks(
+            iter_links(stream, csv_format), UPLOAD_CHUNK_SIZE, client=WikipediaClient(), budget=budget, fields=fields
+        ):
+            queries.update(records)
+        dataset_id = save_dataset(queries)
+
+    if "file" in request.files:
+        return redirect(f"/?dataset={dataset_id}")
+    return jsonify(dataset_id=dataset_id, articles=len(queries))
+
+
 # Debug
 if __name__ == "__main__":
     app.run(debug=True)
@@ -0,0 +1,130 @@
+"""
+Aggregation engine for the global dashboard: all the pageview series of a dataset, aligned on a common date index in
+one 2-D array (one row per article and language), from which totals, per-language sums, rolling means and resamples
+are computed in vectorized form.
+
+The matrix is built once per dataset and stored next to it (see webapp.store), the aggregates are cached in memory.
+It can also be built from the whole history of the pages kept in the local PageviewStore (see cache.py), longer than
+what the dataset fetched.
+"""
+from functools import lru_cache
+
+
+from cache import PageviewStore
+from get_from_wikipedia import page_id
+from webapp.store import load_arrays, load_results, save_arrays
+
+
+RESAMPLES = {"D": "Daily", "W": "Weekly", "MS": "Monthly"}
+
+
+def page_items(obj, lang, page, history=None):
+    """
+    :param history: PageviewStore to read the whole history of the page from (when its id is known)
+    :return: pageview items of a page
+    """
+    pageviews = page.get("pageviews", {})
+    pid = page_id(obj, lang, page)
+    if history is None or pid is None or pageviews.get("granularity") != "daily":
+        return pageviews.get("items", [])
+
+    views = history.get(lang, pid, pageviews["access"], pageviews["agent"])
+    return [{"timestamp": date, "views": count} for date, count in views.items()] or pageviews.get("items", [])
+
+
+def build_matrix(queries, history=None):
+    """
+    Align the pageviews of every page of the dataset.
+
+    :param history: PageviewStore, to take the whole stored history of the pages rather than what the dataset has
+
+    :return: {"articles": (n,), "langs": (n,), "dates": (d,) ISO dates, "views": (n, d) floats, NaN where missing}
+    """
+    import numpy as np
+
+    articles, langs = [], []
+    rows, columns, views = [], [], []
+    dates = {}  # Date: column, in order of appearance (there are far fewer dates than points)
+    for name, obj in queries.items():
+        if "error" in obj:
+            continue
+        for lang, page in obj["langs"].items():
+            items = page_items(obj, lang, page, history)
+            if not items:
+                continue
+            row = len(articles)
+            articles.append(name)
+            langs.append(lang)
+            rows += [row] * len(items)
+            columns += [dates.setdefault(item["timestamp"][:10], len(dates)) for item in items]
+            views += [item["views"] for item in items]
+
+    # Columns in chronological order
+    order = np.array(sorted(dates, key=dates.get), dtype="U10")
+    ranks = np.empty(len(dates), dtype=int)
+    ranks[np.argsort(order)] = np.arange(len(dates))
+    matrix = np.full((len(articles), len(dates)), np.nan)
+    matrix[np.array(rows, dtype=int), ranks[np.array(columns, dtype=int)]] = views
+    dates = np.sort(order)
+
+    return {
+        "articles": np.array(articles, dtype=str),
+        "langs": np.array(langs, dtype=str),
+        "dates": dates,
+        "views": matrix,
+    }
+
+
+def get_matrix(dataset_id, history=False):
+    """
+    Pageview matrix of a stored dataset, built (and stored) on first use.
+
+    :param history: over the whole history of the pages in the PageviewStore (as it is at the first use)
+    :raise KeyError: if there is no such dataset
+    """
+    kind = "history" if history else "pageviews"
+    try:
+        return load_arrays(dataset_id, kind)
+    except KeyError:
+        matrix = build_matrix(load_results(dataset_id), PageviewStore() if history else None)
+        save_arrays(dataset_id, kind, **matrix)
+        return matrix
+
+
+@lru_cache(maxsize=32)
+def aggregate(dataset_id, resample="D", window=1, history=False):
+    """
+    Total and per-language pageviews of a dataset.
+
+    :param resample: pandas frequency of the result (see RESAMPLES)
+    :param window: rolling mean over that many periods (after resampling), 1 for none
+    :param history: over the whole stored history of the pages (see get_matrix)
+    :return: {"dates": [ISO dates], "total": [views], "langs": {lang: [views]}}, JSON-able
+    """
+    import numpy as np
+    import pandas as pd
+
+    matrix = get_matrix(dataset_id, history)
+    views = np.nan_to_num(matrix["views"])
+
+    # Sum of the rows of each language, as one product with the (langs x rows) indicator matrix
+    langs, inverse = np.unique(matrix["langs"], return_inverse=True)
+    indicator = np.zeros((len(langs), len(inverse)))
+    indicator[inverse, np.arange(len(inverse))] = 1
+    frame = pd.DataFrame(
+        (indicator @ views).T if len(inverse) else np.zeros((len(matrix["dates"]), 0)),
+        index=pd.to_datetime(matrix["dates"]),
+        columns=langs,
+    )
+    frame["total"] = frame.sum(axis=1)
+
+    if resample != "D":
+        frame = frame.resample(resample).sum()
+    if window > 1:
+        frame = frame.rolling(window, min_periods=1).mean()
+
+    return {
+        "dates": [date.strftime("%Y-%m-%d") for date in frame.index],
+        "total": frame["total"].tolist(),
+        "langs": {str(lang): frame[lang].tolist() for lang in langs},
+    }
@@ -0,0 +1,133 @@
+"""
+Cross-article analytics of the pageviews: which articles move together (correlations) and when they spike (rolling
+z-scores), computed for all the series at once from the pageview matrix (see webapp.aggregates).
+
+The results are computed once per dataset and stored next to it (see webapp.store).
+"""
+from webapp.aggregates import get_matrix
+from webapp.store import load_derived, save_derived
+
+
+SPIKE_WINDOW = 28  # Days before a day that its views are compared with
+SPIKE_Z = 4  # Minimum z-score of a spike
+SPIKE_MIN_VIEWS = 100  # Ignore the spikes of pages nobody reads
+TOP_PAIRS = 20
+
+
+def article_series(matrix):
+    """
+    Views of each article, summed over its languages (missing days count as no views).
+
+    :return: (articles (n,), views (n, d))
+    """
+    import numpy as np
+
+    articles, inverse = np.unique(matrix["articles"], return_inverse=True)
+    series = np.zeros((len(articles), matrix["views"].shape[1]))
+    np.add.at(series, inverse, np.nan_to_num(matrix["views"]))
+    return articles, series
+
+
+def correlations(series):
+    """
+    Pearson correlation of every pair of series, as one matrix product of the standardized series.
+
+    :return: (n, n) array, NaN for the constant series
+    """
+    import numpy as np
+
+    centered = series - series.mean(axis=1, keepdims=True)
+    norms = np.linalg.norm(centered, axis=1, keepdims=True)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        standardized = centered / norms
+    return standardized @ standardized.T
+
+
+def rolling_zscores(series, window=SPIKE_WINDOW):
+    """
+    z-score of each day against the window days before it, from cumulative sums (no loop over the series or days).
+
+    :return: (n, d) array, NaN for the first window days and when these were constant
+    """
+    import numpy as np
+
+    # Cumulative sums with a leading 0, so that the sum of days [a, b) is sums[:, b] - sums[:, a]
+    zero = np.zeros((series.shape[0], 1))
+    sums = np.concatenate([zero, np.cumsum(series, axis=1)], axis=1)
+    squares = np.concatenate([zero, np.cumsum(series**2, axis=1)], axis=1)
+
+    zscores = np.full(series.shape, np.nan)
+    if series.shape[1] <= window:
+        return zscores
+
+    # Sums over the window before each day, for the days from window on
+    total = sums[:, window:-1] - sums[:, : -window - 1]
+    total_squares = squares[:, window:-1] - squares[:, : -window - 1]
+    mean = total / window
+    std = np.sqrt(np.maximum(total_squares / window - mean**2, 0))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        zscores[:, window:] = np.where(std > 0, (series[:, window:] - mean) / std, np.nan)
+    return zscores
+
+
+def top_pairs(scores, top=TOP_PAIRS):
+    """
+    :param scores: symmetric (n, n) array
+    :return: [(i, j, score)] of the top scores with i < j, best first
+    """
+    import numpy as np
+
+    i, j = np.triu_indices(scores.shape[0], k=1)
+    values = np.nan_to_num(scores[i, j], nan=-np.inf)
+    best = np.argpartition(values, -top)[-top:] if len(values) > top else np.arange(len(values))
+    best = best[np.argsort(values[best])[::-1]]
+    return [(int(i[k]), int(j[k]), float(values[k])) for k in best if np.isfinite(values[k])]
+
+
+def build_analytics(matrix):
+    """
+    :return: {"correlated": [{"articles", "correlation"}], "cospiking": [{"articles", "spikes"}],
+    "spikes": [{"date", "articles"}]}, best first, JSON-able
+    """
+    import numpy as np
+
+    articles, series = article_series(matrix)
+    zscores = rolling_zscores(series)
+    with np.errstate(invalid="ignore"):
+        spikes = (zscores >= SPIKE_Z) & (series >= SPIKE_MIN_VIEWS)
+
+    # Number of days two articles spiked together, as a product of the spike indicators
+    cospikes = spikes.astype(float) @ spikes.T.astype(float)
+
+    days = np.flatnonzero(spikes.any(axis=0))
+    days = days[np.argsort(spikes[:, days].sum(axis=0), kind="stable")[::-1]][:TOP_PAIRS]
+
+    return {
+        "correlated": [
+            {"articles": [str(articles[i]), str(articles[j])], "correlation": round(score, 3)}
+            for i, j, score in top_pairs(correlations(series))
+        ],
+        "cospiking": [
+            {"articles": [str(articles[i]), str(articles[j])], "spikes": int(score)}
+            for i, j, score in top_pairs(cospikes)
+            if score > 0
+        ],
+        "spikes": [
+            {"date": str(matrix["dates"][day]), "articles": [str(name) for name in articles[spikes[:, day]]]}
+            for day in days
+        ],
+    }
+
+
+def get_analytics(dataset_id):
+    """
+    Analytics of a stored dataset, computed (and stored) on first use.
+
+    :raise KeyError: if there is no such dataset
+    """
+    try:
+        return load_derived(dataset_id, "analytics")
+    except KeyError:
+        analytics = build_analytics(get_matrix(dataset_id))
+        save_derived(dataset_id, "analytics", analytics)
+        return analytics
@@ -40,6 +40,7 @@ QI_TEXT_COLORS = {
     "NA": "#333333",
 }
 
+
 # https://stackoverflow.com/a/1094933
 def sizeof_fmt(num, suffix="B", sign=False):
     if abs(num) < 1024.0:
@@ -56,6 +57,8 @@ def humantime_fmt(t):
         return f"{t:2.0f}s"
     elif t < 60.0 * 60.0:
         return f"{t // 60:2.0f}min {t % 60:2.0f}s"
+    else:
+        return f"{t // 3600:2.0f}h {t % 3600 // 60:2.0f}min"
 
 
 def get_lang_name(code):
@@ -80,6 +83,7 @@ def get_color(key):
     m.update(key.encode())
     return f"#{m.hexdigest()[:6]}"
 
+
 def get_textcolor(key):
     if key == "":
         return "#FFFFFF"
@@ -91,6 +95,7 @@ def get_textcolor(key):
     m.update(key.encode())
     return f"#{m.hexdigest()[:6]}"
 
+
 def map_score(value, min_value, max_value, min_score=1, max_score=6):
     """
     Map a value from a range to another range.
@@ -2,15 +2,15 @@ import json
 
 
 from dash import callback, dcc, html, Input, Output, State
-from plotly import express as px
-from plotly import graph_objects as go
 import dash
 import dash_bootstrap_components as dbc
-import pandas as pd
 
 
 from get_from_wikipedia import DEFAULT_LANGS
+from webapp.aggregates import aggregate, RESAMPLES
+from webapp.analytics import get_analytics, SPIKE_WINDOW, SPIKE_Z
 from webapp.helpers import create_main_fig, get_color
+from webapp.store import load_results
 
 
 dash.register_page(__name__)
@@ -44,15 +44,47 @@ layout = dbc.Container(
                 html.A(dbc.Button("Article dashboard", size="lg", className="me-1"), href="individual"),
             ]
         ),
-        # dbc.Row([
-        #     html.H3("Total page views"),
-        #     html.P("All the pages, all the languages."),
-        #     dbc.Col([
-        #         dcc.Graph(
-        #             id="total-graph"
-        #         )
-        #     ]),
-        # ]),
+        dbc.Row(
+            [
+                html.H3("Total page views"),
+                html.P("All the pages, all the languages."),
+                dbc.Col(
+                    [
+                        dbc.RadioItems(
+                            id="total-resample",
+                            options=[{"label": label, "value": value} for value, label in RESAMPLES.items()],
+                            value="D",
+                            inline=True,
+                        ),
+                        dbc.Checklist(
+                            id="total-rolling",
+                            options=[{"label": "Rolling mean (7 periods)", "value": 7}],
+                            value=[],
+                            switch=True,
+                        ),
+                        dbc.Checklist(
+                            id="total-history",
+                            options=[{"label": "Whole history fetched so far (not only this query)", "value": 1}],
+                            value=[],
+                            switch=True,
+                        ),
+                        dcc.Graph(id="total-graph"),
+                    ]
+                ),
+            ]
+        ),
+        dbc.Row(
+            [
+                html.H3("Moving together"),
+                html.P(
+                    f"Articles whose page views are the most correlated, and the days when several of them spiked "
+                    f"(more than {SPIKE_Z} standard deviations above the previous {SPIKE_WINDOW} days)."
+                ),
+                dbc.Col([html.H5("Most correlated"), html.Ol(id="correlated")], md=4),
+                dbc.Col([html.H5("Most often spiking together"), html.Ol(id="cospiking")], md=4),
+                dbc.Col([html.H5("Spikes"), html.Ul(id="spikes")], md=4),
+            ]
+        ),
     ],
     fluid="xl",
 )
@@ -63,9 +95,19 @@ layout = dbc.Container(
     Output("top-graph", "style"),
     Output("debug", "children"),
     Input("top-langs", "value"),
-    State("data", "data"),
+    State("dataset-id", "data"),
 )
-def update_top5(selected_lang, data):
+def update_top5(selected_lang, dataset_id):
+    # Only loaded once a figure is built, they are slow to import
+    from plotly import express as px
+    from plotly import graph_objects as go
+    import pandas as pd
+
+    try:
+        data = load_results(dataset_id)
+    except KeyError:  # No data loaded (or it expired from the store)
+        return go.Figure(), {"display": "none"}, []
+
     tops = []
     for person, content in data.items():
         if "error" in content:
@@ -75,6 +117,8 @@ def update_top5(selected_lang, data):
         for lang, obj in content["langs"].items():
             if lang != selected_lang:
                 continue
+            if "pageviews" not in obj:  # Not fetched (field selection, request budget) or failed
+                continue
 
             if len(tops) < 5:
                 tops.append(
@@ -120,3 +164,54 @@ def update_top5(selected_lang, data):
         style,
         [html.Li(f"{top['name']}: {top['pageviews_total']} views") for top in tops],
     )
+
+
+@callback(
+    Output("total-graph", "figure"),
+    Output("total-graph", "style"),
+    Input("total-resample", "value"),
+    Input("total-rolling", "value"),
+    Input("total-history", "value"),
+    State("dataset-id", "data"),
+)
+def update_total(resample, rolling, history, dataset_id):
+    from plotly import graph_objects as go
+
+    try:
+        totals = aggregate(dataset_id, resample, max(rolling or [1]), bool(history))
+    except KeyError:  # No data loaded (or it expired from the store)
+        return go.Figure(), {"display": "none"}
+
+    fig = go.Figure(
+        [go.Scatter(x=totals["dates"], y=totals["total"], name="All languages", line_color="black")]
+        + [
+            go.Scatter(x=totals["dates"], y=views, name=lang, line_color=get_color(lang), visible="legendonly")
+            for lang, views in totals["langs"].items()
+        ]
+    )
+    return create_main_fig(fig)
+
+
+@callback(
+    Output("correlated", "children"),
+    Output("cospiking", "children"),
+    Output("spikes", "children"),
+    Input("dataset-id", "data"),
+)
+def update_analytics(dataset_id):
+    try:
+        analytics = get_analytics(dataset_id)
+    except KeyError:  # No data loaded (or it expired from the store)
+        return [], [], []
+
+    return (
+        [html.Li(f"{' & '.join(pair['articles'])}: {pair['correlation']}") for pair in analytics["correlated"]],
+        [html.Li(f"{' & '.join(pair['articles'])}: {pair['spikes']} days") for pair in analytics["cospiking"]],
+        [
+            html.Li(
+                f"{spike['date']}: {', '.join(spike['articles'][:5])}"
+                + (f" and {len(spike['articles']) - 5} more" if len(spike["articles"]) > 5 else "")
+            )
+            for spike in analytics["spikes"]
+        ],
+    )
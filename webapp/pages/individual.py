@@ -1,20 +1,21 @@
-from datetime import datetime
 import json
 
 
-from dash import callback, Dash, dash_table, dcc, html, Input, Output, State
-from plotly import express as px
-from plotly import graph_objects as go
+from dash import ALL, callback, clientside_callback, Dash, dash_table, dcc, html, Input, MATCH, Output, Patch, State
 import dash
 import dash_bootstrap_components as dbc
-import pandas as pd
 
 
-from webapp.helpers import create_main_fig, get_color, get_textcolor, humantime_fmt, LANGS, map_score, sizeof_fmt
+from webapp.helpers import create_main_fig, get_color, get_lang_name
+from webapp.revisions import get_revisions, query_table
+from webapp.store import load_results
+from webapp.views import get_views
 
 
 dash.register_page(__name__)
 
+ROW_STYLE = {"margin-bottom": "2em"}  # Of the rows of by-lang
+
 layout = dbc.Container(
     [
         html.H2("", id="page_title"),
@@ -62,6 +63,7 @@ layout = dbc.Container(
             style={"margin-bottom": "1em"},
         ),
         html.Div(id="by-lang"),
+        dcc.Store(id="shown-langs"),  # Person and langs of the rows in by-lang
         html.Center(
             [
                 html.A(dbc.Button("Global dashboard", size="lg", className="me-1"), href="dashboard"),
@@ -76,11 +78,14 @@ layout = dbc.Container(
 @callback(
     Output("person", "options"),
     Output("person", "value"),
-    Input("data", "data"),
+    Input("dataset-id", "data"),
 )
-def load_data(data):
-    if data is not None:
-        people = list(data.keys())
+def load_data(dataset_id):
+    try:
+        people = list(load_results(dataset_id))
+    except KeyError:  # No data loaded (or it expired from the store)
+        return dash.no_update, dash.no_update
+    if people:
         return people, people[0]
 
 
@@ -89,10 +94,10 @@ def load_data(data):
     Output("langs", "value"),
     Output("page_title", "children"),
     Input("person", "value"),
-    State("data", "data"),
+    State("dataset-id", "data"),
 )
-def change_person(person, data):
-    cur_data = data[person]
+def change_person(person, dataset_id):
+    cur_data = load_results(dataset_id)[person]
 
     if "error" in cur_data:
         return [], "", f"Error with {person}"
@@ -103,30 +108,39 @@ def change_person(person, data):
 
 @callback(
     Output("by-lang", "children"),
+    Output("shown-langs", "data"),
     State("person", "value"),
     Input("langs", "value"),
-    State("data", "data"),
+    State("dataset-id", "data"),
+    State("shown-langs", "data"),
 )
-def update_by_lang(selected_person, selected_langs, data):
+def update_by_lang(selected_person, selected_langs, dataset_id, shown):
     """
     Add a row to contain language details, such as contributions, for each language selected.
+    Rows already sent are kept (and hidden in the browser when their language is unselected, see the clientside
+    callback below), only the rows of newly selected languages are built and appended.
     """
-    if "error" in data[selected_person]:
-        return []
-
-    cur_data = data[selected_person]["langs"]
+    if "error" in load_results(dataset_id)[selected_person]:
+        return [], None
 
     if not isinstance(selected_langs, list):
         selected_langs = [selected_langs]
 
-    by_langs = []
-    for lang in selected_langs:
-        # Infos card
-        name = cur_data[lang]["name"]
-        link = f"https://{lang}.wikipedia.org/wiki/{name.replace(' ', '_')}"
-        creation_user = cur_data[lang]["creation"]["user"]
-        creation_user_link = f"https://{lang}.wikipedia.org/wiki/User:{creation_user}"
+    if shown is not None and shown["person"] == selected_person:
+        by_langs = Patch()
+        shown_langs = shown["langs"]
+    else:  # Another person, start over
+        by_langs = []
+        shown_langs = []
+    new_langs = [lang for lang in selected_langs if lang not in shown_langs]
+    if not new_langs:
+        return dash.no_update, dash.no_update
+
+    cur_views = get_views(dataset_id)[selected_person]
+    for lang in new_langs:
+        view = cur_views[lang]
 
+        # Infos card
         class_importance = [
             html.H5(
                 html.A(
@@ -136,92 +150,84 @@ def update_by_lang(selected_person, selected_langs, data):
                 )
             ),
         ]
-        # We have this to assure readability of the in the badge (no white text on yellow bkgnd)
-        if "pageassessments" in cur_data[lang]:
-            for category, obj in cur_data[lang]["pageassessments"].items():
-                class_importance.append(html.Dt(category))
+        if view["assessments"] is not None:
+            for assessment in view["assessments"]:
+                class_importance.append(html.Dt(assessment["category"]))
                 cnt = []
-                if "class" in obj and obj["class"] != "":
-                    cnt.append(dbc.Badge(obj["class"], color=get_color(obj["class"]), text_color=get_textcolor(obj["class"])))
-                if "importance" in obj and obj["importance"] != "":
-                    cnt.append(dbc.Badge(obj["importance"], color=get_color(obj["importance"])))
+                if assessment["class"] != "":
+                    cnt.append(
+                        dbc.Badge(
+                            assessment["class"],
+                            color=assessment["class_color"],
+                            text_color=assessment["class_textcolor"],
+                        )
+                    )
+                if assessment["importance"] != "":
+                    cnt.append(dbc.Badge(assessment["importance"], color=assessment["importance_color"]))
                 class_importance.append(html.Dd(html.Span(cnt)))
         else:
             class_importance.append(html.P("Not available."))
 
-        readability = [
-            html.H5("Readability"),
-            html.Dt("Stats"),
-            html.Dd(
-                [
-                    cur_data[lang]["stats"]["num_words"],
-                    " words, ",
-                    cur_data[lang]["stats"]["num_sentences"],
-                    " sentences, ",
-                    "takes ",
-                    humantime_fmt(cur_data[lang]["stats"]["reading_time"]),
-                    " to read.",
-                ]
-            ),
-        ]
-        for obj in cur_data[lang]["readability"].values():
-            readability.append(html.Dt(html.A(obj["name"], href=obj["link"], target="_blank")))
-            percent = map_score(obj["result"], obj["min"], obj["max"], 0, 100)  # min is harder to read
-            if percent < 30:
-                colour = "danger"
-            elif percent > 60:
-                colour = "success"
-            else:
-                colour = "warning"
-            hint = f"{'Lower' if obj['min'] > obj['max'] else 'Higher'} value means the article is easier to read (from {obj['min']} to {obj['max']})."
+        readability = [html.H5("Readability")]
+        if view["stats"] is not None:
+            readability += [
+                html.Dt("Stats"),
+                html.Dd(
+                    [
+                        view["stats"]["num_words"],
+                        " words, ",
+                        view["stats"]["num_sentences"],
+                        " sentences, ",
+                        "takes ",
+                        view["stats"]["reading_time"],
+                        " to read.",
+                    ]
+                ),
+            ]
+        for item in view["readability"]:
+            readability.append(html.Dt(html.A(item["name"], href=item["link"], target="_blank")))
             readability.append(
                 html.Dd(
                     [
-                        hint,
-                        dbc.Progress(label=obj["result"], value=percent, color=colour),
+                        item["hint"],
+                        dbc.Progress(label=item["result"], value=item["percent"], color=item["color"]),
                     ]
                 )
             )
 
-        len_contributors = len(set(cur_data[lang]["contributors"]))
-        len_backlinks = len(set(cur_data[lang]["backlinks"]))
+        creation = (
+            [
+                html.Dt("Page creation"),
+                html.Dd(
+                    html.P(
+                        [
+                            view["creation"]["date"],
+                            ", by ",
+                            html.A(view["creation"]["user"], href=view["creation"]["user_link"], target="_blank"),
+                        ]
+                    ),
+                ),
+            ]
+            if view["creation"] is not None
+            else []
+        )
         card = dbc.Card(
             [
-                dbc.CardHeader(f"{lang} - {LANGS[lang]}"),
+                dbc.CardHeader(f"{lang} - {view['lang_name']}"),
                 dbc.CardBody(
                     [
-                        html.A(html.H4(name, className="card-title"), href=link, target="_blank"),
-                        html.P(cur_data[lang]["description"] or "(no short description found)", className="card-text"),
+                        html.A(html.H4(view["name"], className="card-title"), href=view["link"], target="_blank"),
+                        html.P(view["description"], className="card-text"),
+                        html.P(f"Incomplete, failed: {', '.join(view['failed'])}", className="card-text text-danger")
+                        if view.get("failed")  # Views stored before the failures were recorded do not have it
+                        else None,
                         html.Dl(
-                            [
-                                html.Dt("Page creation"),
-                                html.Dd(
-                                    html.P(
-                                        [
-                                            datetime.fromisoformat(
-                                                cur_data[lang]["creation"]["timestamp"].replace("Z", "+00:00")
-                                            ).strftime("%Y-%m-%d %H:%M"),
-                                            ", by ",
-                                            html.A(creation_user, href=creation_user_link, target="_blank"),
-                                        ]
-                                    ),
-                                ),
+                            creation
+                            + [
                                 html.Dt("Unique (named) contributors"),
-                                html.Dd(
-                                    len_contributors
-                                    if len_contributors < CONTRIBS_LIMIT
-                                    else f"More than {CONTRIBS_LIMIT}"
-                                ),
+                                html.Dd(view["contributors"]),
                                 html.Dt("Unique (internal) backlinks"),
-                                html.Dd(
-                                    html.A(
-                                        len_backlinks
-                                        if len_backlinks < BACKLINKS_LIMIT
-                                        else f"More than {BACKLINKS_LIMIT}",
-                                        href=f"https://{lang}.wikipedia.org/wiki/Special:WhatLinksHere/{name.replace(' ', '_')}",
-                                        target="_blank",
-                                    )
-                                ),
+                                html.Dd(html.A(view["backlinks"], href=view["backlinks_link"], target="_blank")),
                             ]
                             + class_importance
                             + readability,
@@ -233,35 +239,6 @@ def update_by_lang(selected_person, selected_langs, data):
         )
 
         # Contributions table
-        data = cur_data[lang]["contributions"]["items"]
-        data.reverse()
-
-        try:
-            prev_size = None
-            first_id = data[-1]["revid"]
-            for d in data:
-                d.update(
-                    {
-                        "timestamp": datetime.fromisoformat(d["timestamp"].replace("Z", "+00:00")).strftime(
-                            "%Y-%m-%d %H:%M"
-                        ),
-                        "change": sizeof_fmt(d["size"] - prev_size if prev_size else 0, sign=True),
-                    }
-                )
-                prev_size = d["size"]
-                d.update({"size": sizeof_fmt(d["size"])})
-
-                # Diff link
-                actu = (
-                    f"[actu](https://{lang}.wikipedia.org/w/index.php?title={name.replace(' ', '_')}&diff={first_id}&oldid={d['revid']})"
-                    if first_id != d["revid"]
-                    else "actu"
-                )
-                diff = f"[diff](https://{lang}.wikipedia.org/w/index.php?title={name.replace(' ', '_')}&diff=prev&oldid={d['revid']})"
-                d.update({"links": f"({actu} | {diff})"})
-        except TypeError:  # Already done
-            pass
-
         columns = [
             {
                 "name": "Timestamp (UTC)",
@@ -287,16 +264,21 @@ def update_by_lang(selected_person, selected_langs, data):
         ]
         table = dbc.Card(
             [
-                dbc.CardHeader(f"List of contributions"),
+                dbc.CardHeader(f"List of contributions ({view['nb_contributions']})"),
                 dbc.CardBody(
                     [
+                        # Paged, sorted and filtered on the server, see update_contributions
                         dash_table.DataTable(
-                            id=f"table-{lang}",
-                            data=data,
+                            id={"type": "contributions", "person": selected_person, "lang": lang},
                             columns=columns,
-                            sort_action="native",
-                            filter_action="native",
+                            page_action="custom",
+                            page_current=0,
                             page_size=10,
+                            sort_action="custom",
+                            sort_mode="single",
+                            sort_by=[],
+                            filter_action="custom",
+                            filter_query="",
                             style_cell_conditional=[
                                 {"if": {"column_id": "timestamp"}, "width": "40%"},
                                 {"if": {"column_id": "username"}, "width": "40%"},
@@ -308,8 +290,8 @@ def update_by_lang(selected_person, selected_langs, data):
         )
 
         row_lang = dbc.Row(
-            id=f"lang-{lang}",
-            style={"margin-bottom": "2em"},
+            id={"type": "lang-row", "lang": lang},
+            style=ROW_STYLE,
             children=[
                 dbc.Col(
                     width=3,
@@ -323,35 +305,78 @@ def update_by_lang(selected_person, selected_langs, data):
         )
         by_langs.append(row_lang)
 
-    return by_langs
+    return by_langs, {"person": selected_person, "langs": shown_langs + new_langs}
+
+
+clientside_callback(
+    """
+    function(langs, ids) {
+        const selected = Array.isArray(langs) ? langs : [langs];
+        return ids.map(id => selected.includes(id.lang) ? %s : %s);
+    }
+    """
+    % (json.dumps(ROW_STYLE), json.dumps({**ROW_STYLE, "display": "none"})),
+    Output({"type": "lang-row", "lang": ALL}, "style"),
+    Input("langs", "value"),
+    State({"type": "lang-row", "lang": ALL}, "id"),
+    prevent_initial_call=True,
+)
+
+
+@callback(
+    Output({"type": "contributions", "person": MATCH, "lang": MATCH}, "data"),
+    Output({"type": "contributions", "person": MATCH, "lang": MATCH}, "page_count"),
+    Input({"type": "contributions", "person": MATCH, "lang": MATCH}, "page_current"),
+    Input({"type": "contributions", "person": MATCH, "lang": MATCH}, "page_size"),
+    Input({"type": "contributions", "person": MATCH, "lang": MATCH}, "sort_by"),
+    Input({"type": "contributions", "person": MATCH, "lang": MATCH}, "filter_query"),
+    State({"type": "contributions", "person": MATCH, "lang": MATCH}, "id"),
+    State("dataset-id", "data"),
+)
+def update_contributions(page_current, page_size, sort_by, filter_query, table_id, dataset_id):
+    """
+    Only the visible page of a contributions table, from the revision tables of the dataset.
+    """
+    try:
+        table = get_revisions(dataset_id)[table_id["person"]][table_id["lang"]]
+    except KeyError:  # Not a stored dataset
+        return [], 1
+
+    return query_table(table, page_current, page_size, sort_by, filter_query)
 
 
 @callback(
     Output("graph", "figure"),
     Output("graph", "style"),
-    State("person", "value"),
-    Input("langs", "value"),
-    State("data", "data"),
+    Input("person", "value"),
+    State("dataset-id", "data"),
 )
-def update_graph(selected_person, selected_langs, data):
+def update_graph(selected_person, dataset_id):
     """
-    Update the graph with one or multiple languages.
+    Build the graph with the traces of every language of the person, only the first one visible (as selected by
+    change_person). Languages are then shown and hidden in the browser, see the clientside callback below.
     """
+    # Only loaded once a figure is built, they are slow to import
+    from plotly import express as px
+    from plotly import graph_objects as go
+    import pandas as pd
+
+    data = load_results(dataset_id)
     if "error" in data[selected_person]:
         return go.Figure(), {"display": "none"}
 
     cur_data = data[selected_person]["langs"]
-
-    if not isinstance(selected_langs, list):
-        selected_langs = [selected_langs]
+    langs = list(cur_data)
 
     figs = list()
-    for lang in selected_langs:
-        pageviews_en = cur_data[lang]["pageviews"]["items"]  # "timestamp", "views"
+    for lang in langs:
+        pageviews_en = cur_data[lang].get("pageviews", {}).get("items", [])  # "timestamp", "views"
+        if not pageviews_en:
+            continue
         df = pd.read_json(json.dumps(pageviews_en))
 
         fig_line = px.line(df, x="timestamp", y="views", hover_name=len(df) * [get_lang_name(lang)])
-        fig_line.update_traces(line_color=get_color(lang))
+        fig_line.update_traces(line_color=get_color(lang), meta=lang, visible=lang == langs[0])
 
         figs.append(fig_line)
     try:
@@ -365,9 +390,37 @@ def update_graph(selected_person, selected_langs, data):
 
     fig_main = go.Figure(data=figs_data)
 
-    for lang in selected_langs:
-        contributions = cur_data[lang]["contributions"]["items"]
+    for lang in langs:
+        contributions = cur_data[lang].get("contributions", {}).get("items", [])
         for contrib in contributions:
-            fig_main.add_vline(x=contrib["timestamp"], line_dash="dash", line_color=get_color(lang))
+            fig_main.add_vline(
+                x=contrib["timestamp"],
+                line_dash="dash",
+                line_color=get_color(lang),
+                name=lang,
+                visible=lang == langs[0],
+            )
 
     return create_main_fig(fig_main)
+
+
+# Show the traces and contribution lines of the selected languages only, without a round trip to the server
+clientside_callback(
+    """
+    function(langs, figure) {
+        if (!figure) {
+            return window.dash_clientside.no_update;
+        }
+        const selected = Array.isArray(langs) ? langs : [langs];
+        const data = figure.data.map(trace => ({...trace, visible: selected.includes(trace.meta)}));
+        const shapes = (figure.layout.shapes || []).map(
+            shape => ({...shape, visible: selected.includes(shape.name)})
+        );
+        return {...figure, data: data, layout: {...figure.layout, shapes: shapes}};
+    }
+    """,
+    Output("graph", "figure", allow_duplicate=True),
+    Input("langs", "value"),
+    State("graph", "figure"),
+    prevent_initial_call=True,
+)
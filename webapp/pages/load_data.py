@@ -1,6 +1,6 @@
-import base64
+from urllib.parse import parse_qs
+import copy
 import csv
-import json
 
 
 from dash import callback, dcc, html, Input, Output, State
@@ -9,15 +9,33 @@ import dash_bootstrap_components as dbc
 import requests
 
 
-from get_from_wikipedia import get_from_wikipedia
+from get_from_wikipedia import apply_budget, failed_stages, PROFILES, WikipediaClient
+from metrics import registry
+from webapp.helpers import humantime_fmt
+from webapp.store import load_results, published
+from webapp.views import save_dataset
 
 
 dash.register_page(__name__, path="/")
 
+PREVIEW_PAGE_SIZE = 20
+PROFILES_LABELS = {
+    "full": "Everything (all dashboards)",
+    "pageviews": "Pageviews only (global dashboard, much faster)",
+    "metadata": "Metadata only (descriptions, Wikidata items, creation, assessments)",
+}
+
 layout = dbc.Container(
     [
         html.H2("Input your Wikipedia pages"),
         html.P("Can be either a full link, or a page name. One article per row."),
+        html.H5("What to fetch"),
+        dbc.RadioItems(
+            id="profile",
+            options=[{"label": PROFILES_LABELS[profile], "value": profile} for profile in PROFILES],
+            value="full",
+            className="mb-3",
+        ),
         html.Br(),
         # Text input
         html.H3("Copy-paste your inputs"),
@@ -34,20 +52,25 @@ layout = dbc.Container(
         html.Br(),
         # File input
         html.H3("Or, upload a file"),
-        dcc.Upload(
-            id="input_file",
-            children=html.Div(["Drag and Drop or ", html.A("Select Files")]),
-            style={
-                "width": "100%",
-                "height": "60px",
-                "lineHeight": "60px",
-                "borderWidth": "1px",
-                "borderStyle": "dashed",
-                "borderRadius": "5px",
-                "textAlign": "center",
-            },
-            # Allow multiple files to be uploaded
-            multiple=False,
+        html.P(
+            "Text or CSV (first column), possibly gzipped. Once uploaded, the file is read and fetched 200 lines at a "
+            "time, without an estimate to confirm first: set a request budget to bound the cost."
+        ),
+        html.Form(
+            [
+                html.Input(type="file", name="file", className="form-control mb-3"),
+                dbc.Select(
+                    name="fields",
+                    options=[{"label": PROFILES_LABELS[profile], "value": profile} for profile in PROFILES],
+                    value="full",
+                    className="mb-3",
+                ),
+                dbc.Input(name="budget", type="number", min=1, step=1, placeholder="Request budget per 200 lines"),
+                dbc.Button("Upload", type="submit", color="primary", className="mt-3"),
+            ],
+            action="/upload",
+            method="POST",
+            encType="multipart/form-data",
         ),
         html.Div(id="output-data-upload"),
         html.Br(),
@@ -64,22 +87,55 @@ layout = dbc.Container(
                 dbc.Button("Submit", id="submit_gsheet", color="primary"),
             ]
         ),
+        # Estimate, to be confirmed
+        dcc.Store(id="pending"),
+        html.Center(dbc.Spinner(html.Div(id="spinner-plan"), color="primary")),
+        html.Div(
+            [
+                html.Hr(),
+                html.H2("Estimated cost"),
+                html.Div(id="plan-summary"),
+                dbc.Form(
+                    [
+                        dbc.Label("Request budget (optional)", html_for="budget"),
+                        dbc.Input(id="budget", className="mb-3", type="number", min=1, step=1),
+                        dbc.FormText(
+                            "If the estimate does not fit, backlinks, contributors, assessments and descriptions are "
+                            "skipped, in that order."
+                        ),
+                    ],
+                    className="mb-3",
+                ),
+                dbc.Button("Confirm", id="confirm", color="primary"),
+            ],
+            id="plan",
+            style={"display": "none"},
+        ),
         # Result
         html.Center(dbc.Spinner(html.Div(id="spinner"), id="spinner-out", color="primary")),
         html.Div(
             [
                 html.Hr(),
                 html.H2("Resulting query"),
-                dbc.Textarea(
-                    id="queries-text",
+                html.P(id="queries-count"),
+                dbc.Button(
+                    "Retry failed stages",
+                    id="retry-failed",
+                    color="warning",
                     className="mb-3",
-                    placeholder="{}",
+                    style={"display": "none"},
                 ),
+                dbc.Accordion(id="queries-preview", start_collapsed=True, always_open=True, className="mb-3"),
+                dbc.Pagination(id="queries-pages", max_value=1, active_page=1, fully_expanded=False),
                 html.Center(
                     [
                         html.A(dbc.Button("Global dashboard", size="lg", className="me-1"), href="dashboard"),
                         html.A(dbc.Button("Article dashboard", size="lg", className="me-1"), href="individual"),
-                        dbc.Button("Download resulting query", id="queries-dl", size="lg", className="me-1"),
+                        html.A(
+                            dbc.Button("Download resulting query", size="lg", className="me-1"),
+                            id="queries-dl",
+                            href="",
+                        ),
                     ]
                 ),
             ],
@@ -89,50 +145,61 @@ layout = dbc.Container(
 )
 
 
+def plan_links(target_links, profile):
+    plan = WikipediaClient().plan_from_wikipedia(target_links, fields=profile)
+    return {"links": target_links, "fields": profile, "plan": plan}
+
+
 @callback(
-    Output("data", "data"),
-    Output("spinner", "children"),
+    Output("pending", "data"),
+    Output("spinner-plan", "children"),
     Input("submit_text", "n_clicks"),
-    Input("input_text", "value"),
+    State("input_text", "value"),
+    State("profile", "value"),
 )
-def process_text(n, value):
-    if n is not None:
+def process_text(n, value, profile):
+    if n is not None and value:
         target_links = value.split("\n")
-        queries = get_from_wikipedia(target_links)
-        print("Done with processing text")
-        return queries, "Done with processing text"
+        return plan_links(target_links, profile), None
     else:
         return None, None
 
 
 @callback(
-    Output("data", "data", allow_duplicate=True),
-    Output("spinner", "children", allow_duplicate=True),
-    Input("input_file", "contents"),
-    State("input_file", "filename"),
-    State("input_file", "last_modified"),
+    Output("dataset-id", "data", allow_duplicate=True),
+    Input("url", "search"),
     prevent_initial_call="initial_duplicate",
 )
-def process_file(content, name, date):
-    if content is not None:
-        content_type, content_string = content.split(",")
-        target_links = base64.b64decode(content_string).decode().replace("\r", "").split("\n")
-        queries = get_from_wikipedia(target_links)
-        print("Done with processing file")
-        return queries, "Done with processing file"
-    else:
-        return None, None
+def load_uploaded(search):
+    """
+    Coming back from a streamed upload, with ?dataset=<id>; or loading the latest snapshot published by refresh.py,
+    with ?snapshot=<name>.
+    """
+    params = parse_qs((search or "").lstrip("?"))
+    dataset_id = params.get("dataset", [None])[0]
+    snapshot = params.get("snapshot", [None])[0]
+    if dataset_id is None and snapshot is None:
+        return dash.no_update
+
+    try:
+        if dataset_id is None:
+            dataset_id = published(snapshot)
+        load_results(dataset_id)  # Only to check that it is there
+        return dataset_id
+    except KeyError:
+        return None
 
 
 @callback(
-    Output("data", "data", allow_duplicate=True),
-    Output("spinner", "children", allow_duplicate=True),
+    Output("pending", "data", allow_duplicate=True),
+    Output("spinner-plan", "children", allow_duplicate=True),
     Input("submit_gsheet", "n_clicks"),
-    Input("input_gsheet", "value"),
+    State("input_gsheet", "value"),
+    State("profile", "value"),
     prevent_initial_call="initial_duplicate",
 )
-def process_gsheet(n, value):
-    if n is not None:
+def process_gsheet(n, value, profile):
+    if n is not None and value:
         csv_url = value.replace("edit", "export?format=csv")
 
         res = requests.get(url=csv_url)
@@ -142,20 +209,174 @@ def process_gsheet(n, value):
             res.encoding = res.apparent_encoding  # So that we get properly encoded results
             target_links = [link[0] for link in csv.reader(res.text.strip().split("\n"))]
 
-        queries = get_from_wikipedia(target_links)
-        print("Done with processing gsheet")
-        return queries, "Done with processing gsheet"
+        return plan_links(target_links, profile), None
     else:
         return None, None
 
 
 @callback(
-    Output("queries-text", "value"),
-    Output("queries", "style"),
-    Input("data", "data"),
+    Output("plan-summary", "children"),
+    Output("plan", "style"),
+    Input("pending", "data"),
+    Input("budget", "value"),
 )
-def show_query(data):
-    if data is not None:
-        return json.dumps(data, indent=2, ensure_ascii=False), {"display": "inline"}
-    else:
+def show_plan(pending, budget):
+    """
+    Show the estimate of the pending run, so that the user can confirm it.
+    """
+    if pending is None:
         return None, {"display": "none"}
+
+    plan = apply_budget(copy.deepcopy(pending["plan"]), budget or None)
+    skipped = plan["skipped"]
+
+    rows = [
+        html.Tr(
+            [
+                html.Td(stage),
+                html.Td(cost["requests"]),
+                html.Td(humantime_fmt(cost["seconds"])),
+                html.Td("skipped" if stage in skipped else ""),
+            ]
+        )
+        for stage, cost in plan["stages"].items()
+    ]
+
+    summary = [
+        html.P(
+            f"{plan['articles']} articles found ({plan['not_found']} not found), {plan['pages']} pages over all "
+            f"languages: about {plan['requests']} requests, {humantime_fmt(plan['seconds'])}."
+        ),
+        dbc.Table(
+            [html.Thead(html.Tr([html.Th("Stage"), html.Th("Requests"), html.Th("Time"), html.Th("")]))]
+            + [html.Tbody(rows)],
+            size="sm",
+        ),
+    ]
+    if budget and not plan["fits"]:
+        summary.append(dbc.Alert("Even without the optional stages, the estimate exceeds the budget.", color="warning"))
+
+    return summary, {"display": "inline"}
+
+
+@callback(
+    Output("dataset-id", "data"),
+    Output("spinner", "children"),
+    Input("confirm", "n_clicks"),
+    State("pending", "data"),
+    State("budget", "value"),
+    prevent_initial_call=True,
+)
+def run_pending(n, pending, budget):
+    if n is not None and pending is not None:
+        # A client per run, so that concurrent users do not share their request budget
+        client = WikipediaClient()
+        with registry.timer("wikistats_webapp_run_seconds", source="load_page"):
+            queries = client.get_from_wikipedia(pending["links"], budget=budget or None, fields=pending["fields"])
+            dataset_id = save_dataset(queries)
+        return dataset_id, "Done with processing"
+    else:
+        return None, None
+
+
+def summarize_article(name, obj):
+    """
+    Short description of an article for the preview, without the heavy fields (extract, revisions, pageviews).
+    """
+    if "error" in obj:
+        return html.P(f"Error: {obj['error']}")
+
+    rows = []
+    for lang, page in obj["langs"].items():
+        rows.append(
+            html.Tr(
+                [
+                    html.Td(lang),
+                    html.Td(page["name"]),
+                    html.Td(page.get("pageviews_total", "")),
+                    html.Td(len(page.get("contributions", {}).get("items", []))),
+                    html.Td(len(page.get("contributors", []))),
+                    html.Td(len(page.get("backlinks", []))),
+                    html.Td(page.get("creation", {}).get("timestamp", "")),
+                ]
+            )
+        )
+
+    header = ["Lang", "Name", "Page views", "Revisions", "Contributors", "Backlinks", "Created"]
+    content = [
+        dbc.Table(
+            [html.Thead(html.Tr([html.Th(title) for title in header])), html.Tbody(rows)],
+            size="sm",
+        )
+    ]
+    if obj["query"].get("skipped"):
+        content.append(html.P(f"Skipped stages: {', '.join(obj['query']['skipped'])}"))
+    for lang, stages in failed_stages(obj).items():
+        content.append(html.P(f"Failed stages ({lang}): {', '.join(stages)}", className="text-danger"))
+
+    return content
+
+
+@callback(
+    Output("queries-preview", "children"),
+    Output("queries-pages", "max_value"),
+    Output("queries-count", "children"),
+    Output("queries-dl", "href"),
+    Output("retry-failed", "style"),
+    Output("queries", "style"),
+    Input("dataset-id", "data"),
+    Input("queries-pages", "active_page"),
+)
+def show_query(dataset_id, active_page):
+    """
+    Preview of the results, one page of articles at a time, read from the server-side store.
+    """
+    try:
+        queries = load_results(dataset_id)
+    except KeyError:
+        return [], 1, None, "", {"display": "none"}, {"display": "none"}
+
+    names = list(queries)
+    nb_pages = max(1, -(-len(names) // PREVIEW_PAGE_SIZE))
+    page = min(active_page or 1, nb_pages)
+    shown = names[(page - 1) * PREVIEW_PAGE_SIZE : page * PREVIEW_PAGE_SIZE]
+
+    items = [dbc.AccordionItem(summarize_article(name, queries[name]), title=name, item_id=name) for name in shown]
+    failed = sum(bool(failed_stages(obj)) for obj in queries.values())
+    count = (
+        f"{len(names)} articles ({sum('error' in obj for obj in queries.values())} not found, "
+        f"{failed} with failed stages)."
+    )
+
+    return (
+        items,
+        nb_pages,
+        count,
+        f"/download/{dataset_id}",
+        {"display": "inline"} if failed else {"display": "none"},
+        {"display": "inline"},
+    )
+
+
+@callback(
+    Output("dataset-id", "data", allow_duplicate=True),
+    Output("spinner", "children", allow_duplicate=True),
+    Input("retry-failed", "n_clicks"),
+    State("dataset-id", "data"),
+    State("pending", "data"),
+    State("budget", "value"),
+    prevent_initial_call=True,
+)
+def retry_failed(n, dataset_id, pending, budget):
+    """
+    Run the failed stages again, and store the result as a new dataset (the previous one may be shared).
+    """
+    try:
+        queries = copy.deepcopy(load_results(dataset_id))  # Updated in place, and the store keeps it in memory
+    except KeyError:
+        return dash.no_update, "These results are not available anymore, please run the query again"
+
+    queries = WikipediaClient().retry_failed(
+        queries, budget=budget or None, fields=pending["fields"] if pending else None
+    )
+    return save_dataset(queries), "Done with retrying"
@@ -0,0 +1,167 @@
+"""
+Columnar revision tables, for the server-side paging, sorting and filtering of the contributions tables: the browser
+only ever receives the rows of the page it shows, whatever the number of revisions.
+
+A table holds the revisions of a page (oldest first) as one list per column, with the size change precomputed, and a
+sort index per sortable column (row numbers in ascending order), so that a sorted page does not need a sort.
+"""
+from datetime import datetime
+import operator
+import re
+
+
+from webapp.helpers import sizeof_fmt
+from webapp.store import load_derived, load_results, save_derived
+
+
+COLUMNS = ["revid", "timestamp", "username", "size", "change"]
+SORTABLE = ["timestamp", "username", "size", "change"]
+
+# Operators of the DataTable filter syntax, for the ones we support
+OPERATORS = {
+    "=": operator.eq,
+    "eq": operator.eq,
+    "!=": operator.ne,
+    "ne": operator.ne,
+    "<": operator.lt,
+    "lt": operator.lt,
+    "<=": operator.le,
+    "le": operator.le,
+    ">": operator.gt,
+    "gt": operator.gt,
+    ">=": operator.ge,
+    "ge": operator.ge,
+    "contains": lambda value, term: str(term).lower() in str(value).lower(),
+    "datestartswith": lambda value, term: str(value).startswith(str(term)),
+}
+_FILTER = re.compile(
+    r"^\s*\{(?P<column>[^}]+)\}\s*(?P<operator>"
+    + "|".join(re.escape(op) for op in sorted(OPERATORS, key=len, reverse=True))
+    + r")\s*(?P<value>.*?)\s*$"
+)
+
+
+def build_table(lang, page):
+    """
+    Revision table of a page, from its "contributions" (newest first, as given by the API).
+    """
+    items = list(reversed(page.get("contributions", {}).get("items", [])))
+    table = {column: [] for column in COLUMNS}
+    prev_size = None
+    for item in items:
+        table["revid"].append(item["revid"])
+        table["timestamp"].append(item["timestamp"])
+        table["username"].append(item["username"] or "")
+        table["size"].append(item["size"])
+        table["change"].append(item["size"] - prev_size if prev_size else 0)
+        prev_size = item["size"]
+
+    table["index"] = {
+        column: sorted(range(len(items)), key=lambda i, values=table[column]: values[i]) for column in SORTABLE
+    }
+    table["lang"] = lang
+    table["name"] = page["name"]
+    table["last_revid"] = items[-1]["revid"] if items else None
+    return table
+
+
+def build_revisions(queries):
+    """
+    :return: {article: {lang: revision table}}, without the articles that were not found
+    """
+    return {
+        name: {lang: build_table(lang, page) for lang, page in obj["langs"].items()}
+        for name, obj in queries.items()
+        if "error" not in obj
+    }
+
+
+def get_revisions(dataset_id):
+    """
+    Revision tables of a stored dataset, built (and stored) from its results if the dataset predates them.
+
+    :raise KeyError: if there is no such dataset
+    """
+    try:
+        return load_derived(dataset_id, "revisions")
+    except KeyError:
+        revisions = build_revisions(load_results(dataset_id))
+        save_derived(dataset_id, "revisions", revisions)
+        return revisions
+
+
+def _matches(function, cell, value):
+    try:
+        return function(cell, value)
+    except TypeError:  # Such as a number compared to a text column
+        return False
+
+
+def parse_filter(filter_query):
+    """
+    Parse a DataTable filter query ("{username} contains bot && {size} > 1000") into [(column, function, value)].
+    Unsupported expressions are ignored.
+    """
+    filters = []
+    for part in (filter_query or "").split(" && "):
+        match = _FILTER.match(part)
+        if match is None or match.group("column") not in COLUMNS:
+            continue
+        value, name = match.group("value"), match.group("operator")
+        if value[:1] == value[-1:] and value[:1] in "\"'`" and len(value) > 1:
+            value = value[1:-1]
+        elif name not in ("contains", "datestartswith"):  # Text operators
+            try:
+                value = float(value)
+            except ValueError:
+                pass
+        filters.append((match.group("column"), OPERATORS[name], value))
+    return filters
+
+
+def format_row(table, i):
+    lang, title, revid = table["lang"], table["name"].replace(" ", "_"), table["revid"][i]
+    actu = (
+        f"[actu](https://{lang}.wikipedia.org/w/index.php?title={title}&diff={table['last_revid']}&oldid={revid})"
+        if table["last_revid"] != revid
+        else "actu"
+    )
+    diff = f"[diff](https://{lang}.wikipedia.org/w/index.php?title={title}&diff=prev&oldid={revid})"
+    timestamp = datetime.fromisoformat(table["timestamp"][i].replace("Z", "+00:00"))
+    return {
+        "timestamp": timestamp.strftime("%Y-%m-%d %H:%M"),
+        "username": table["username"][i],
+        "change": sizeof_fmt(table["change"][i], sign=True),
+        "size": sizeof_fmt(table["size"][i]),
+        "links": f"({actu} | {diff})",
+    }
+
+
+def query_table(table, page_current=0, page_size=10, sort_by=None, filter_query=""):
+    """
+    One page of a revision table, as DataTable rows.
+
+    :param sort_by: sort_by of the DataTable ([{"column_id": ..., "direction": "asc" or "desc"}]), only the first
+    sorted column is used
+    :return: (rows, number of pages)
+    """
+    sort_by = [sort for sort in sort_by or [] if sort["column_id"] in SORTABLE]
+    if sort_by:
+        order = table["index"][sort_by[0]["column_id"]]
+        if sort_by[0]["direction"] == "desc":
+            order = order[::-1]
+    else:
+        order = range(len(table["revid"]))
+
+    filters = parse_filter(filter_query)
+    if filters:
+        columns = {column: table[column] for column, _, _ in filters}
+        order = [
+            i
+            for i in order
+            if all(_matches(function, columns[column][i], value) for column, function, value in filters)
+        ]
+
+    start = (page_current or 0) * page_size
+    rows = [format_row(table, i) for i in order[start : start + page_size]]
+    return rows, max(1, -(-len(order) // page_size))
@@ -0,0 +1,191 @@
+"""
+Server-side store for the results of a run, so that big results do not have to go back and forth with the browser.
+Results are kept gzipped on disk, keyed by a content hash, with the most recent ones also kept in memory.
+Data derived from a result set (such as the view models of webapp.views) is stored next to it, under the same id.
+A dataset can also be published under a name (such as the snapshot of the tracked articles, see refresh.py).
+"""
+from collections import OrderedDict
+import gzip
+import hashlib
+import os
+import re
+import tempfile
+import threading
+
+
+from serialization import dumps, loads
+
+
+RESULTS_DIR = os.environ.get("WIKISTATS_RESULTS_DIR", os.path.join(tempfile.gettempdir(), "wikistats-results"))
+MEMORY_SLOTS = 4  # Number of datasets kept deserialized in memory, with all the data derived from them
+CHUNK_SIZE = 64 * 1024
+
+_DATASET_ID = re.compile(r"^[0-9a-f]{16}$")
+_SNAPSHOT_NAME = re.compile(r"^[\w-]+$")
+_memory = OrderedDict()  # {dataset_id: {kind: obj}}, least recently used dataset first
+_lock = threading.Lock()
+
+
+def results_path(dataset_id, kind=None):
+    """
+    :param kind: None for the results themselves, else the name of data derived from them ("views")
+    """
+    if not _DATASET_ID.match(dataset_id or ""):
+        raise KeyError(dataset_id)
+    return os.path.join(RESULTS_DIR, f"{dataset_id}.{kind}.json.gz" if kind else f"{dataset_id}.json.gz")
+
+
+def _remember(dataset_id, kind, obj):
+    with _lock:
+        _memory.setdefault(dataset_id, {})[kind] = obj
+        _memory.move_to_end(dataset_id)
+        while len(_memory) > MEMORY_SLOTS:
+            _memory.popitem(last=False)
+
+
+def _recall(dataset_id, kind):
+    """
+    :return: the object kept in memory, or None
+    """
+    with _lock:
+        if dataset_id in _memory and kind in _memory[dataset_id]:
+            _memory.move_to_end(dataset_id)
+            return _memory[dataset_id][kind]
+    return None
+
+
+def _write(path, data):
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with gzip.open(tmp, "wb", compresslevel=6) as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def _read(dataset_id, kind=None):
+    obj = _recall(dataset_id, kind)
+    if obj is not None:
+        return obj
+
+    try:
+        with gzip.open(results_path(dataset_id, kind), "rb") as f:
+            obj = loads(f.read())
+    except FileNotFoundError:
+        raise KeyError(dataset_id)
+
+    _remember(dataset_id, kind, obj)
+    return obj
+
+
+def save_results(queries):
+    """
+    Store a result set.
+
+    :return: its dataset id
+    """
+    data = dumps(queries)
+    dataset_id = hashlib.sha256(data).hexdigest()[:16]
+
+    path = results_path(dataset_id)
+    if not os.path.exists(path):
+        _write(path, data)
+
+    _remember(dataset_id, None, queries)
+    return dataset_id
+
+
+def load_results(dataset_id):
+    """
+    :raise KeyError: if there is no such dataset
+    """
+    return _read(dataset_id)
+
+
+def save_derived(dataset_id, kind, obj):
+    """
+    Store data derived from a dataset, such as its view models (see webapp.views) or its revision tables (see
+    webapp.revisions).
+    """
+    _write(results_path(dataset_id, kind), dumps(obj))
+    _remember(dataset_id, kind, obj)
+
+
+def load_derived(dataset_id, kind):
+    """
+    :raise KeyError: if this kind of data was not stored for the dataset
+    """
+    return _read(dataset_id, kind)
+
+
+def save_arrays(dataset_id, kind, **arrays):
+    """
+    Store numpy arrays derived from a dataset (see webapp.aggregates), as a compressed .npz file.
+    """
+    import numpy as np  # Only needed by the aggregates, slow to import
+
+    path = results_path(dataset_id, kind).replace(".json.gz", ".npz")
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp.npz"
+    np.savez_compressed(tmp, **arrays)
+    os.replace(tmp, path)
+    _remember(dataset_id, kind, arrays)
+
+
+def load_arrays(dataset_id, kind):
+    """
+    :return: {name: array}
+    :raise KeyError: if these arrays were not stored for the dataset
+    """
+    arrays = _recall(dataset_id, kind)
+    if arrays is not None:
+        return arrays
+
+    import numpy as np
+
+    try:
+        with np.load(results_path(dataset_id, kind).replace(".json.gz", ".npz"), allow_pickle=False) as f:
+            arrays = dict(f)
+    except FileNotFoundError:
+        raise KeyError(dataset_id)
+
+    _remember(dataset_id, kind, arrays)
+    return arrays
+
+
+def snapshot_path(name):
+    if not _SNAPSHOT_NAME.match(name or ""):
+        raise KeyError(name)
+    return os.path.join(RESULTS_DIR, f"{name}.snapshot")
+
+
+def publish(name, dataset_id):
+    """
+    Make a stored dataset the latest snapshot published under name.
+    """
+    path = snapshot_path(name)
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        f.write(dataset_id)
+    os.replace(tmp, path)
+
+
+def published(name):
+    """
+    :return: id of the latest dataset published under name
+    :raise KeyError: if nothing was published under name
+    """
+    try:
+        with open(snapshot_path(name)) as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        raise KeyError(name)
+
+
+def iter_results_gz(dataset_id):
+    """
+    Stream the gzipped JSON of a dataset, as stored on disk.
+    """
+    with open(results_path(dataset_id), "rb") as f:
+        while chunk := f.read(CHUNK_SIZE):
+            yield chunk
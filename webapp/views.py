@@ -0,0 +1,141 @@
+"""
+View models of the article dashboard: everything the callbacks display, formatted once per dataset when it is ingested
+(and stored next to it, see webapp.store) instead of on every callback.
+"""
+from datetime import datetime
+
+
+from get_from_wikipedia import BACKLINKS_LIMIT, CONTRIBS_LIMIT
+from webapp.aggregates import build_matrix
+from webapp.helpers import get_color, get_lang_name, get_textcolor, humantime_fmt, LANGS, map_score
+from webapp.revisions import build_revisions
+from webapp.store import load_derived, load_results, save_arrays, save_derived, save_results
+
+
+def format_timestamp(timestamp):
+    return datetime.fromisoformat(timestamp.replace("Z", "+00:00")).strftime("%Y-%m-%d %H:%M")
+
+
+def page_url(lang, name):
+    return f"https://{lang}.wikipedia.org/wiki/{name.replace(' ', '_')}"
+
+
+def readability_items(readability):
+    items = []
+    for obj in readability.values():
+        percent = map_score(obj["result"], obj["min"], obj["max"], 0, 100)  # min is harder to read
+        if percent < 30:
+            color = "danger"
+        elif percent > 60:
+            color = "success"
+        else:
+            color = "warning"
+        easier = "Lower" if obj["min"] > obj["max"] else "Higher"
+        items.append(
+            {
+                "name": obj["name"],
+                "link": obj["link"],
+                "result": obj["result"],
+                "percent": percent,
+                "color": color,
+                "hint": f"{easier} value means the article is easier to read (from {obj['min']} to {obj['max']}).",
+            }
+        )
+    return items
+
+
+def assessment_items(pageassessments):
+    # Text colors assure readability in the badges (no white text on yellow background)
+    return [
+        {
+            "category": category,
+            "class": obj.get("class", ""),
+            "class_color": get_color(obj.get("class", "")),
+            "class_textcolor": get_textcolor(obj.get("class", "")),
+            "importance": obj.get("importance", ""),
+            "importance_color": get_color(obj.get("importance", "")),
+        }
+        for category, obj in pageassessments.items()
+    ]
+
+
+def page_view(lang, page):
+    """
+    View model of a page (an article in one lang). Fields can be missing from the page when their stage did not run
+    (field selection, request budget), they are None in the view then.
+    """
+    name = page["name"]
+    # Can be missing if the stage was skipped to stay within the request budget
+    len_contributors = len(set(page.get("contributors", [])))
+    len_backlinks = page.get("backlinks_count", len(set(page.get("backlinks", []))))
+    creation = page.get("creation")
+    stats = page.get("stats")
+
+    return {
+        "lang": lang,
+        "lang_name": LANGS.get(lang) or get_lang_name(lang),
+        "name": name,
+        "link": page_url(lang, name),
+        "description": page.get("description") or "(no short description found)",
+        "creation": {
+            "date": format_timestamp(creation["timestamp"]),
+            "user": creation["user"],
+            "user_link": f"https://{lang}.wikipedia.org/wiki/User:{creation['user']}",
+        }
+        if creation
+        else None,
+        "contributors": len_contributors if len_contributors < CONTRIBS_LIMIT else f"More than {CONTRIBS_LIMIT}",
+        "backlinks": len_backlinks if len_backlinks < BACKLINKS_LIMIT else f"More than {BACKLINKS_LIMIT}",
+        "backlinks_link": f"https://{lang}.wikipedia.org/wiki/Special:WhatLinksHere/{name.replace(' ', '_')}",
+        "assessments": assessment_items(page["pageassessments"]) if "pageassessments" in page else None,
+        "stats": {
+            "num_words": stats["num_words"],
+            "num_sentences": stats["num_sentences"],
+            "reading_time": humantime_fmt(stats["reading_time"]),
+        }
+        if stats
+        else None,
+        "readability": readability_items(page.get("readability", {})),
+        # The contributions themselves are in the revision tables (see webapp.revisions)
+        "nb_contributions": len(page.get("contributions", {}).get("items", [])),
+        # Stages that failed on the page, their fields are missing (see WikipediaClient.retry_failed)
+        "failed": list(page.get("errors", {})),
+    }
+
+
+def build_views(queries):
+    """
+    :return: {article: {lang: page view}}, without the articles that were not found
+    """
+    return {
+        name: {lang: page_view(lang, page) for lang, page in obj["langs"].items()}
+        for name, obj in queries.items()
+        if "error" not in obj
+    }
+
+
+def get_views(dataset_id):
+    """
+    Views of a stored dataset, built (and stored) from its results if the dataset predates them.
+
+    :raise KeyError: if there is no such dataset
+    """
+    try:
+        return load_derived(dataset_id, "views")
+    except KeyError:
+        views = build_views(load_results(dataset_id))
+        save_derived(dataset_id, "views", views)
+        return views
+
+
+def save_dataset(queries):
+    """
+    Ingest a result set: store it with its views, its revision tables and its pageview matrix.
+
+    :return: its dataset id
+    """
+    dataset_id = save_results(queries)
+    save_derived(dataset_id, "views", build_views(queries))
+    save_derived(dataset_id, "revisions", build_revisions(queries))
+    save_arrays(dataset_id, "pageviews", **build_matrix(queries))
+    return dataset_id